@@ -58,7 +58,7 @@ def load_mantid_mask(pixel_number, mantid_mask_xml, is_mask):
         # get range
         terms = masked_det_pair.split('-')
         start_detid = int(terms[0])
-        end_detid = int(terms[1])
+        end_detid = int(terms[-1])
         # check range
         if end_detid >= pixel_number:
             raise RuntimeError('Detector ID {} is out of range of given detector size {}'
@@ -3,15 +3,14 @@ Convert HB2B NeXus file to Hidra project file for further reduction
 """
 from __future__ import (absolute_import, division, print_function)  # python3 compatibility
 import h5py
-from mantid.kernel import Logger, BoolTimeSeriesProperty, FloatFilteredTimeSeriesProperty, FloatTimeSeriesProperty
-from mantid.kernel import Int32TimeSeriesProperty, Int64TimeSeriesProperty, Int32FilteredTimeSeriesProperty,\
-    Int64FilteredTimeSeriesProperty
-from mantid.simpleapi import mtd, DeleteWorkspace, LoadEventNexus, LoadMask, RemoveLogs
+import logging
+import multiprocessing
 import numpy as np
 import os
 from pyrs.core import workspaces
 from pyrs.core.instrument_geometry import AnglerCameraDetectorGeometry, HidraSetup
 from pyrs.core import MonoSetting
+from pyrs.core.mask_util import load_mantid_mask
 from pyrs.dataobjects import HidraConstants
 from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode
 from pyrs.utilities import checkdatatypes
@@ -21,6 +20,10 @@ NUM_PIXEL_1D = 1024
 HIDRA_PIXEL_NUMBER = NUM_PIXEL_1D * NUM_PIXEL_1D
 PIXEL_SIZE = 0.3 / NUM_PIXEL_1D
 ARM_LENGTH = 0.985
+# number of events read from NeXus at a time for histogramming: 16M uint32 event ids take 64 MB
+EVENT_CHUNK_SIZE = 1 << 24
+# NeXus file name and mask of a worker process histogramming sub runs: set by the pool initializer
+_WORKER_CONVERSION_ARGS = None
 
 DEFAULT_KEEP_LOGS = ['experiment_identifier', 'run_number', 'run_title', 'file_notes', 'start_time', 'end_time',
                      'SampleId', 'SampleName', 'SampleDescription', 'StrainDirection', 'hklPhase', 'Wavelength',
@@ -29,6 +32,11 @@ DEFAULT_KEEP_LOGS = ['experiment_identifier', 'run_number', 'run_title', 'file_n
                      'vx', 'vy', 'vz', 'omegaSetpoint', '2thetaSetpoint', 'phiSetpoint', 'chiSetpoint', 'sxSetpoint',
                      'sySetpoint', 'szSetpoint', 'scan_index', 'duration']
 
+# fields of NeXus entry loaded as sample logs with their names given by Mantid LoadEventNexus
+NEXUS_ENTRY_LOGS = {'experiment_identifier': 'experiment_identifier', 'run_number': 'run_number',
+                    'title': 'run_title', 'notes': 'file_notes', 'start_time': 'start_time',
+                    'end_time': 'end_time', 'duration': 'duration'}
+
 
 def convert_pulses_to_datetime64(h5obj):
     '''The h5object is the h5py handle to ``event_time_zero``. This only supports pulsetimes in seconds'''
@@ -48,40 +56,233 @@ def convert_pulses_to_datetime64(h5obj):
     return pulse_time + start_time
 
 
-def calculate_sub_run_time_average(log_property, time_filter):
-    '''Determine the time average value of the supplied log'''
+def convert_log_times_to_datetime64(h5obj):
+    '''The h5object is the h5py handle to ``time`` of a ``DASlogs`` entry. This only supports times in seconds'''
+    units = h5obj.attrs['units']
+    if not isinstance(units, str):
+        units = units.decode()
+    if units != 'second':
+        raise RuntimeError('Do not understand time units "{}"'.format(units))
+
+    # the value is number of seconds since the start as a float
+    log_time = h5obj.value * 1.e9 * np.timedelta64(1, 'ns')
+
+    # get absolute start and convert to absolute time
+    start_time = h5obj.attrs['start']
+    if not isinstance(start_time, str):
+        start_time = start_time.decode()
+
+    return log_time + np.datetime64(start_time)
+
+
+def _decode_nexus_value(value):
+    '''Convert value of a NeXus field to a single number or string if it only has one element'''
+    if isinstance(value, np.ndarray) and value.size == 1:
+        value = value.reshape(-1)[0]
+    if isinstance(value, bytes):
+        value = value.decode()
+
+    return value
+
+
+class TimeSeriesLog(object):
+    '''Time series sample log with absolute times (``numpy.datetime64``) and values in time order'''
+    def __init__(self, times, value):
+        if times.size > 1 and not np.all(times[:-1] <= times[1:]):
+            order = np.argsort(times, kind='mergesort')
+            times, value = times[order], value[order]
+        self.times = times
+        self.value = value
+
+    def size(self):
+        return self.value.size
+
+
+def load_nexus_logs(nexus_h5, log_names):
+    '''Load sample logs from ``DASlogs`` time series and the fields of NeXus entry
+
+    Parameters
+    ----------
+    nexus_h5 : h5py.File
+        NeXus file
+    log_names : list
+        names of the sample logs to load.  The sample logs that do not exist are ignored
+
+    Returns
+    -------
+    dict
+        sample log name and TimeSeriesLog for time series or a single value (number or string) otherwise
+    '''
+    sample_logs = dict()
+    entry = nexus_h5['entry']
+
+    for field_name, log_name in NEXUS_ENTRY_LOGS.items():
+        if log_name in log_names and field_name in entry:
+            sample_logs[log_name] = _decode_nexus_value(entry[field_name].value)
+
+    das_logs = entry['DASlogs'] if 'DASlogs' in entry else dict()
+    for log_name in log_names:
+        if log_name not in das_logs or 'time' not in das_logs[log_name] or 'value' not in das_logs[log_name]:
+            continue
+        log_value = das_logs[log_name]['value'].value
+        if log_value.dtype.kind in 'SO':
+            log_value = np.array([_decode_nexus_value(value) for value in log_value])
+        sample_logs[log_name] = TimeSeriesLog(convert_log_times_to_datetime64(das_logs[log_name]['time']),
+                                              log_value)
+
+    return sample_logs
+
+
+def calculate_sub_runs_time_average(log_property, start_times, stop_times):
+    '''Determine the time average values of the supplied log in all the sub runs at once
+
+    Log's value is taken as constant until the next time in the log.  Before the first time in the log,
+    the value is the first value in the log.  The log is integrated cumulatively once, such that the average
+    in each sub run is the difference of the integrals at its stop and start time over its duration
+
+    Parameters
+    ----------
+    log_property : TimeSeriesLog
+        time series log
+    start_times : numpy.ndarray
+        start times (numpy.datetime64) of the sub runs
+    stop_times : numpy.ndarray
+        stop times (numpy.datetime64) of the sub runs
+
+    Returns
+    -------
+    numpy.ndarray
+        time average values of the sub runs
+    '''
+    times, value = log_property.times, log_property.value
     if log_property.size() == 1:  # single value property just copy
-        time_average_value = log_property.value
-    elif time_filter is None:  # no filtering means use all values
-        time_average_value = log_property.timeAverageValue()
-    else:
-        # filter and get time average value
-        if isinstance(log_property, FloatTimeSeriesProperty):
-            filtered_tsp = FloatFilteredTimeSeriesProperty(log_property, time_filter)
-        elif isinstance(log_property, Int32TimeSeriesProperty):
-            filtered_tsp = Int32FilteredTimeSeriesProperty(log_property, time_filter)
-        elif isinstance(log_property, Int64TimeSeriesProperty):
-            filtered_tsp = Int64FilteredTimeSeriesProperty(log_property, time_filter)
-        else:
-            raise NotImplementedError('TSP log property {} of type {} is not supported'
-                                      ''.format(log_property.name, type(log_property)))
+        return np.full(start_times.shape, value[0])
+
+    # integrals of the log from its first time to each time in the log
+    log_seconds = (times - times[0]) / np.timedelta64(1, 's')
+    log_integrals = np.concatenate([[0.], np.cumsum(value[:-1] * np.diff(log_seconds))])
+
+    def integrate(time_array):
+        # integral from log's first time: the log value at the time holds since the latest log time before it
+        seconds = (time_array - times[0]) / np.timedelta64(1, 's')
+        log_index = np.maximum(np.searchsorted(times, time_array, side='right') - 1, 0)
+        return log_integrals[log_index] + value[log_index] * (seconds - log_seconds[log_index])
 
-        time_average_value = filtered_tsp.timeAverageValue()
-        del filtered_tsp
+    durations = (stop_times - start_times) / np.timedelta64(1, 's')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        time_averages = (integrate(stop_times) - integrate(start_times)) / durations
 
-    return time_average_value
+    # the first value for the sub runs without duration
+    return np.where(durations > 0., time_averages, value[0])
+
+
+def calculate_sub_run_time_average(log_property, time_filter):
+    '''Determine the time average value of the supplied log
+
+    Parameters
+    ----------
+    log_property : TimeSeriesLog
+        time series log
+    time_filter : tuple or None
+        start and stop time (numpy.datetime64) of the sub run.  None for the time range of the log
+
+    Returns
+    -------
+    float
+        time average value
+    '''
+    if time_filter is None:  # no filtering means use all values
+        time_filter = log_property.times[0], log_property.times[-1]
+    start_times, stop_times = np.array(time_filter[:1]), np.array(time_filter[1:])
+
+    return calculate_sub_runs_time_average(log_property, start_times, stop_times)[0]
+
+
+def histogram_event_ids(event_id_array, start_event_index, stop_event_index, chunk_size=EVENT_CHUNK_SIZE):
+    '''Count the occurrence of each event ID (aka detector ID) in a range of events as counts on each pixel
+
+    Event IDs are read chunk by chunk starting from the first event of the range, such that the memory
+    is bounded by the chunk size rather than the number of events
+
+    Parameters
+    ----------
+    event_id_array : h5py.Dataset or numpy.ndarray
+        event IDs of all the events
+    start_event_index : int
+        index of the first event in range
+    stop_event_index : int
+        index after the last event in range.  It is clipped to the number of events
+    chunk_size : int
+        maximum number of events read at a time
+
+    Returns
+    -------
+    numpy.ndarray
+        counts on each detector pixel
+    '''
+    stop_event_index = min(stop_event_index, event_id_array.shape[0])
+
+    hist = np.zeros(HIDRA_PIXEL_NUMBER, dtype=np.int64)
+    for chunk_start_index in range(start_event_index, stop_event_index, chunk_size):
+        chunk_stop_index = min(chunk_start_index + chunk_size, stop_event_index)
+        chunk_hist = np.bincount(event_id_array[chunk_start_index:chunk_stop_index], minlength=HIDRA_PIXEL_NUMBER)
+        if chunk_hist.size > hist.size:
+            # event IDs out of detector range
+            hist = np.concatenate([hist, np.zeros(chunk_hist.size - hist.size, dtype=hist.dtype)])
+        hist[:chunk_hist.size] += chunk_hist
+
+    return hist
+
+
+def _histogram_sub_run_events(event_id_array, start_event_index, stop_event_index, mask_array):
+    '''Histogram the events of a sub run to masked detector counts in compact unsigned integer type'''
+    hist = histogram_event_ids(event_id_array, start_event_index, stop_event_index)
+
+    # mask (set to zero) the pixels that are not wanted
+    if mask_array is not None:
+        assert hist.shape == mask_array.shape
+        hist *= mask_array
+
+    return workspaces.compact_counts(hist)
+
+
+def _init_conversion_worker(nexus_name, mask_array):
+    '''Set the NeXus file name and mask for the sub runs histogrammed in this worker process'''
+    global _WORKER_CONVERSION_ARGS
+    _WORKER_CONVERSION_ARGS = nexus_name, mask_array
+
+
+def _histogram_sub_run_in_worker(event_range):
+    '''Histogram the events of a sub run in a forked worker process reading its own range of events
+
+    Parameters
+    ----------
+    event_range : tuple
+        sub run, start event index and stop event index
+
+    Returns
+    -------
+    numpy.ndarray
+        counts on each detector pixel
+    '''
+    nexus_name, mask_array = _WORKER_CONVERSION_ARGS
+    _, start_event_index, stop_event_index = event_range
+
+    with h5py.File(nexus_name, 'r') as nexus_h5:
+        return _histogram_sub_run_events(nexus_h5['entry']['bank1_events']['event_id'], start_event_index,
+                                         stop_event_index, mask_array)
 
 
 class Splitter(object):
-    def __init__(self, runObj):
-        self._log = Logger(__name__)
+    def __init__(self, sample_logs):
+        self._log = logging.getLogger(__name__)
 
-        if runObj['scan_index'].size() == 0:
+        if sample_logs['scan_index'].size() == 0:
             raise RuntimeError('"scan_index" is empty')
 
-        # Get the time and value from the run object
-        scan_index_times = runObj['scan_index'].times   # absolute times
-        scan_index_value = runObj['scan_index'].value
+        # Get the time and value from the sample logs
+        scan_index_times = sample_logs['scan_index'].times   # absolute times
+        scan_index_value = sample_logs['scan_index'].value
         # TODO add final time from pcharge logs + 1s with scan_index=0
 
         if np.unique(scan_index_value).size == 1:
@@ -89,11 +290,9 @@ class Splitter(object):
 
         self.times = None
         self.subruns = None
-        self.propertyFilters = list()
 
         self.__generate_sub_run_splitter(scan_index_times, scan_index_value)
-        self.__correct_starting_scan_index_time(runObj)
-        self._createPropertyFilters()
+        self.__correct_starting_scan_index_time(sample_logs)
 
     def __generate_sub_run_splitter(self, scan_index_times, scan_index_value):
         """Generate event splitters according to sub runs
@@ -129,7 +328,7 @@ class Splitter(object):
         # Check the ending
         if curr_sub_run > 0:
             # In case the stop (scan_index = 0) is not recorded
-            sub_run_time_list.append(np.nan)
+            sub_run_time_list.append(np.datetime64('NaT'))
 
         # Convert from list to array
         self.times = np.array(sub_run_time_list)
@@ -145,7 +344,7 @@ class Splitter(object):
             raise RuntimeError('Sub run number {} and sub run times {} do not match (as twice)'
                                ''.format(self.subruns, self.times))
 
-    def __correct_starting_scan_index_time(self, runObj, abs_tolerance=0.05):
+    def __correct_starting_scan_index_time(self, sample_logs, abs_tolerance=0.05):
         """Correct the DAS-issue for mis-record the first scan_index/sub run before the motor is in position
 
         This goes through a subset of logs and compares when they actually
@@ -168,22 +367,22 @@ class Splitter(object):
         start_time = self.times[0]
         # loop through the 'special' logs
         for log_name in ['sx', 'sy', 'sz', '2theta', 'omega', 'chi', 'phi']:
-            if log_name not in runObj:
+            if log_name not in sample_logs:
                 continue  # log doesn't exist - not a good one to look at
-            if log_name + 'Setpoint' not in runObj:
+            if log_name + 'Setpoint' not in sample_logs:
                 continue  # log doesn't have a setpoint - not a good one to look at
-            if runObj[log_name].size() == 1:
+            if sample_logs[log_name].size() == 1:
                 continue  # there is only one value
 
             # get the observed values of the log
-            observed = runObj[log_name].value
+            observed = sample_logs[log_name].value
             if observed.std() <= .5 * abs_tolerance:
                 continue  # don't bother if the log is constant within half of the tolerance
 
             # look for the setpoint and find when the log first got there
             # only look at first setpoint
-            set_point = runObj[log_name + 'Setpoint'].value[0]
-            for log_time, value in zip(runObj[log_name].times, observed):
+            set_point = sample_logs[log_name + 'Setpoint'].value[0]
+            for log_time, value in zip(sample_logs[log_name].times, observed):
                 if abs(value - set_point) < abs_tolerance:
                     # pick the larger of what was found and the previous largest value
                     if log_time > start_time:
@@ -198,28 +397,111 @@ class Splitter(object):
     def durations(self):
         return (self.times[1::2] - self.times[::2]) / np.timedelta64(1, 's')
 
-    def _createPropertyFilters(self):
-        self.propertyFilters = list()
-        if self.subruns.size == 1:
-            self.propertyFilters.append(None)
-        else:
-            for subrun_index in range(self.subruns.size):
-                subrun_start_time = self.times[2 * subrun_index]
-                subrun_stop_time = self.times[2 * subrun_index + 1]
 
-                # create a Boolean time series property as the filter
-                time_filter = BoolTimeSeriesProperty('filter')
-                time_filter.addValue(subrun_start_time, True)
-                time_filter.addValue(subrun_stop_time, False)
+class EventFilter(object):
+    '''Filter of events by time windows and ranges of sample log values
 
-                self.propertyFilters.append(time_filter)
+    Each contiguous time range, in which all the log values are inside their ranges, is a sub run.
+    Time ranges in different time windows are different sub runs
+    '''
+    def __init__(self, time_windows=None, log_value_ranges=None):
+        '''Initialization
+
+        Parameters
+        ----------
+        time_windows : list or None
+            start and stop times (in seconds since the first pulse of the run) of the time windows.
+            None for the whole run
+        log_value_ranges : dict or None
+            log name and minimum (inclusive) and maximum (exclusive) values of the log.  None in the
+            range for no limit.  Log's value is taken as constant until the next time in the log
+        '''
+        self.time_windows = list() if time_windows is None else [(float(start), float(stop))
+                                                                 for start, stop in time_windows]
+        for (start, stop), (next_start, _) in zip(self.time_windows, self.time_windows[1:] + [(np.inf, None)]):
+            if not start < stop <= next_start:
+                raise RuntimeError('Time windows {} shall be increasing and not overlapping'
+                                   ''.format(self.time_windows))
+
+        self.log_value_ranges = dict() if log_value_ranges is None else dict(log_value_ranges)
+        for log_name, (min_value, max_value) in self.log_value_ranges.items():
+            checkdatatypes.check_string_variable('Log name', log_name)
+            if min_value is not None and max_value is not None and min_value >= max_value:
+                raise RuntimeError('Minimum value {} of log {} is not less than maximum value {}'
+                                   ''.format(min_value, log_name, max_value))
+
+
+class FilterSplitter(object):
+    '''Splitter of the run to sub runs by an EventFilter, having the same times and sub runs as Splitter'''
+    def __init__(self, sample_logs, event_filter, run_start_time, run_stop_time):
+        '''Initialization
+
+        Parameters
+        ----------
+        sample_logs : dict
+            sample logs containing the logs filtered by
+        event_filter : EventFilter
+            filter of events
+        run_start_time : numpy.datetime64
+            time of the first pulse
+        run_stop_time : numpy.datetime64
+            time after the last pulse
+        '''
+        for log_name in event_filter.log_value_ranges:
+            if not isinstance(sample_logs.get(log_name), TimeSeriesLog):
+                raise RuntimeError('Log {} to filter events is not a time series log'.format(log_name))
+
+        # boundaries of the time segments, in each of which all the logs are constant
+        boundaries = [np.array([run_start_time, run_stop_time])]
+        window_seconds = np.array(event_filter.time_windows, dtype=float).reshape((-1, 2))
+        window_times = run_start_time + window_seconds * 1.e9 * np.timedelta64(1, 'ns')
+        boundaries.append(window_times.flatten())
+        boundaries.extend([sample_logs[log_name].times for log_name in event_filter.log_value_ranges])
+        boundaries = np.unique(np.concatenate(boundaries).astype(run_start_time.dtype))
+        boundaries = boundaries[(boundaries >= run_start_time) & (boundaries <= run_stop_time)]
+        segment_starts, segment_stops = boundaries[:-1], boundaries[1:]
+
+        # label the segments by time window: -1 for being filtered out
+        if window_times.size == 0:
+            labels = np.zeros(segment_starts.size, dtype=int)
+        else:
+            window_index = np.maximum(np.searchsorted(window_times[:, 0], segment_starts, side='right') - 1, 0)
+            in_window = (segment_starts >= window_times[window_index, 0]) & \
+                (segment_starts < window_times[window_index, 1])
+            labels = np.where(in_window, window_index, -1)
+
+        for log_name, (min_value, max_value) in event_filter.log_value_ranges.items():
+            log_property = sample_logs[log_name]
+            # log value in each segment
+            log_index = np.maximum(np.searchsorted(log_property.times, segment_starts, side='right') - 1, 0)
+            segment_values = log_property.value[log_index]
+            if min_value is not None:
+                labels[segment_values < min_value] = -1
+            if max_value is not None:
+                labels[segment_values >= max_value] = -1
+
+        # contiguous segments with the same label are a sub run
+        first_segments = np.concatenate([[0], np.flatnonzero(np.diff(labels)) + 1])
+        last_segments = np.concatenate([first_segments[1:], [labels.size]]) - 1
+        kept = labels[first_segments] >= 0
+        if not np.any(kept):
+            raise RuntimeError('No time range of the run passes the event filter')
+
+        self.times = np.empty(2 * np.count_nonzero(kept), dtype=boundaries.dtype)
+        self.times[::2] = segment_starts[first_segments[kept]]
+        self.times[1::2] = segment_stops[last_segments[kept]]
+        self.subruns = np.arange(1, self.times.size // 2 + 1)
+
+    @property
+    def durations(self):
+        return (self.times[1::2] - self.times[::2]) / np.timedelta64(1, 's')
 
 
 class NeXusConvertingApp(object):
     """
     Convert NeXus file to Hidra project file
     """
-    def __init__(self, nexus_file_name, mask_file_name=None, extra_logs=list()):
+    def __init__(self, nexus_file_name, mask_file_name=None, extra_logs=list(), event_filter=None):
         """Initialization
 
         Parameters
@@ -230,9 +512,11 @@ class NeXusConvertingApp(object):
             Name of masking file
         extra_logs : list, tuple
             list of string with no default logs to keep in project file
+        event_filter : EventFilter or None
+            filter to split the run to sub runs by times and log values.  None for splitting by ``scan_index``
         """
         # configure logging for this class
-        self._log = Logger(__name__)
+        self._log = logging.getLogger(__name__)
 
         # validate NeXus file exists
         checkdatatypes.check_file_name(nexus_file_name, True, False, False, 'NeXus file')
@@ -249,12 +533,13 @@ class NeXusConvertingApp(object):
                                           '{} with type {} is not supported yet.'
                                           ''.format(mask_file_name, mask_file_name.split('.')[-1]))
 
-        # workspaces
-        self._event_ws_name = os.path.basename(nexus_file_name).split('.')[0]
-
         logs_to_keep = list(extra_logs)
         logs_to_keep.extend(DEFAULT_KEEP_LOGS)
 
+        self._event_filter = event_filter
+        if event_filter is not None:
+            logs_to_keep.extend(event_filter.log_value_ranges.keys())
+
         self.__load_logs(logs_to_keep)
 
         # load the mask
@@ -275,47 +560,37 @@ class NeXusConvertingApp(object):
         # project file
         self._project_file = None
 
-    def __del__(self):
-        if self._event_ws_name in mtd:
-            DeleteWorkspace(Workspace=self._event_ws_name, EnableLogging=False)
-
     def __load_logs(self, logs_to_keep):
-        '''Use mantid to load the logs then set up the Splitters object'''
-        self._event_wksp = LoadEventNexus(Filename=self._nexus_name, OutputWorkspace=self._event_ws_name,
-                                          MetaDataOnly=True, LoadMonitors=False)
-
-        # remove unwanted sample logs
-        RemoveLogs(self._event_wksp, KeepLogs=logs_to_keep)
+        '''Load the logs from NeXus file with h5py then set up the Splitters object'''
+        with h5py.File(self._nexus_name, 'r') as nexus_h5:
+            self._sample_logs = load_nexus_logs(nexus_h5, logs_to_keep)
+            if self._event_filter is not None:
+                pulse_time_array = convert_pulses_to_datetime64(nexus_h5['entry']['bank1_events']['event_time_zero'])
+        if 'Filename' in logs_to_keep:
+            self._sample_logs['Filename'] = self._nexus_name
+
+        if self._event_filter is not None:
+            # split by the event filter in the time range including the events of the last pulse
+            self._splitter = FilterSplitter(self._sample_logs, self._event_filter, pulse_time_array[0],
+                                            pulse_time_array[-1] + np.timedelta64(1, 'ns'))
+            return
 
         # raise an exception if there is only one scan index entry
         # this is an underlying assumption of the rest of the code
-        if self._event_wksp.run()['scan_index'].size() == 1 \
-                or np.unique(self._event_wksp.run()['scan_index'].value).size == 1:
+        if self._sample_logs['scan_index'].size() == 1 \
+                or np.unique(self._sample_logs['scan_index'].value).size == 1:
             self._splitter = None
         else:
             # object to be used for splitting times
-            self._splitter = Splitter(self._event_wksp.run())
+            self._splitter = Splitter(self._sample_logs)
 
     def __load_mask(self, mask_file_name):
         # Check input
         checkdatatypes.check_file_name(mask_file_name, True, False, False, 'Mask XML file')
-        if self._event_wksp is None:
-            raise RuntimeError('Meta data only workspace {} does not exist'.format(self._event_ws_name))
 
-        # Load mask XML to workspace
-        mask_ws_name = os.path.basename(mask_file_name.split('.')[0])
-        mask_ws = LoadMask(Instrument='nrsf2', InputFile=mask_file_name, RefWorkspace=self._event_wksp,
-                           OutputWorkspace=mask_ws_name)
-
-        # Extract mask out
-        # get the Y array from mask workspace: shape = (1048576, 1)
-        self.mask_array = mask_ws.extractY().flatten()
-        # in Mantid's mask workspace: one stands delete, zero stands for keep
-        # we multiply by the value: zero is delete, one is keep
-        self.mask_array = 1 - self.mask_array.astype(int)
-
-        # clean up
-        DeleteWorkspace(Workspace=mask_ws_name)
+        # Parse the detector IDs out of the Mantid mask XML: detector ID is the pixel index
+        # in the mask vector: zero is delete, one is keep
+        self.mask_array = load_mantid_mask(HIDRA_PIXEL_NUMBER, mask_file_name, is_mask=True).astype(int)
 
     def _generate_subrun_event_indices(self, pulse_time_array, event_index_array, num_events):
         # convert times to array indices
@@ -337,9 +612,47 @@ class NeXusConvertingApp(object):
 
         return subrun_event_index
 
-    def split_events_sub_runs(self):
-        '''Filter the data by ``scan_index`` and set counts array in the hidra_workspace'''
-        # Load: this h5 will be opened all the time
+    def get_sub_runs(self):
+        '''Sub runs of the run: ``scan_index`` values or 1 if the run is not split'''
+        if self._splitter:
+            return np.array(self._splitter.subruns.tolist())
+        else:
+            return np.array([1])
+
+    def split_events_sub_runs(self, workers=1):
+        '''Filter the data by ``scan_index`` and set counts array in the hidra_workspace
+
+        Parameters
+        ----------
+        workers : int
+            number of processes to histogram sub runs.  1 for histogramming in this process
+
+        Returns
+        -------
+        numpy.ndarray
+            sub runs
+        '''
+        subruns = list()
+        for subrun, hist in self.iterate_sub_run_counts(workers=workers):
+            subruns.append(subrun)
+            # set it in the workspace
+            self._hidra_workspace.set_raw_counts(subrun, hist)
+
+        return np.array(subruns)
+
+    def _get_sub_run_event_ranges(self, sub_runs=None):
+        '''Ranges of events of the sub runs
+
+        Parameters
+        ----------
+        sub_runs : list or None
+            sub runs to get.  None for all
+
+        Returns
+        -------
+        list
+            sub run, start event index and stop event index of each sub run in order
+        '''
         with h5py.File(self._nexus_name, 'r') as nexus_h5:
             bank1_events = nexus_h5['entry']['bank1_events']
             # Check number of neutron events.  Raise exception if there is no neutron event
@@ -348,8 +661,8 @@ class NeXusConvertingApp(object):
                 raise RuntimeError('Run {} has no count.  Proper reduction requires the run to have count'
                                    ''.format(self._nexus_name))
 
-            # detector id for the events
-            event_id_array = bank1_events['event_id'].value
+            # number of events
+            num_events = bank1_events['event_id'].shape[0]
 
             if self._splitter:
                 # get event index array: same size as pulse times
@@ -357,41 +670,65 @@ class NeXusConvertingApp(object):
                 # get pulse times
                 pulse_time_array = convert_pulses_to_datetime64(bank1_events['event_time_zero'])
                 subrun_eventindex_array = self._generate_subrun_event_indices(pulse_time_array, event_index_array,
-                                                                              event_id_array.size)
-                # reduce memory foot print
-                del pulse_time_array, event_index_array
+                                                                              num_events)
 
-        # split data
-        subruns = list()
-        if self._splitter:
-            for subrun, start_event_index, stop_event_index in zip(self._splitter.subruns.tolist(),
-                                                                   subrun_eventindex_array[::2].tolist(),
-                                                                   subrun_eventindex_array[1::2].tolist()):
-                subruns.append(subrun)
-                # get sub set of the events falling into this range
-                # and count the occurrence of each event ID (aka detector ID) as counts on each detector pixel
-                hist = np.bincount(event_id_array[start_event_index:stop_event_index], minlength=HIDRA_PIXEL_NUMBER)
-
-                # mask (set to zero) the pixels that are not wanted
-                if self.mask_array is not None:
-                    assert hist.shape == self.mask_array.shape
-                    hist *= self.mask_array
-
-                # set it in the workspace
-                self._hidra_workspace.set_raw_counts(int(subrun), hist)
-        else:  # or histogram everything
-            subruns.append(1)
-            hist = np.bincount(event_id_array, minlength=HIDRA_PIXEL_NUMBER)
-
-            # mask (set to zero) the pixels that are not wanted
-            if self.mask_array is not None:
-                assert hist.shape == self.mask_array.shape
-                hist *= self.mask_array
+                event_ranges = list(zip(self._splitter.subruns.tolist(), subrun_eventindex_array[::2].tolist(),
+                                        subrun_eventindex_array[1::2].tolist()))
+            else:
+                # histogram everything
+                event_ranges = [(1, 0, num_events)]
 
-            # set it in the workspace
-            self._hidra_workspace.set_raw_counts(1, hist)
+        return [(int(subrun), start_event_index, stop_event_index)
+                for subrun, start_event_index, stop_event_index in event_ranges
+                if sub_runs is None or subrun in sub_runs]
 
-        return np.array(subruns)
+    def iterate_sub_run_counts(self, sub_runs=None, workers=1):
+        '''Histogram the events of each sub run to detector counts one sub run at a time
+
+        Only the counts of one sub run are created at each step, which are not set to the hidra_workspace.
+        With multiple workers, forked processes histogram the sub runs concurrently, each reading its own
+        range of events, and the counts are yielded in the order of sub runs
+
+        Parameters
+        ----------
+        sub_runs : list or None
+            sub runs to histogram.  None for all
+        workers : int
+            number of processes to histogram sub runs.  1 for histogramming in this process
+
+        Returns
+        -------
+        generator
+            sub run number and counts array (in compact unsigned integer type) of each sub run
+        '''
+        checkdatatypes.check_int_variable('Number of workers', workers, (1, None))
+        if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            self._log.warning('Sub runs are histogrammed serially: process pool requires fork start method')
+            workers = 1
+
+        event_ranges = self._get_sub_run_event_ranges(sub_runs)
+
+        if workers == 1 or len(event_ranges) == 1:
+            # Load: this h5 will be opened all the time and event IDs will be read chunk by chunk
+            with h5py.File(self._nexus_name, 'r') as nexus_h5:
+                event_id_array = nexus_h5['entry']['bank1_events']['event_id']
+                for subrun, start_event_index, stop_event_index in event_ranges:
+                    # get sub set of the events falling into this range
+                    # and count the occurrence of each event ID (aka detector ID) as counts on each detector pixel
+                    yield subrun, _histogram_sub_run_events(event_id_array, start_event_index, stop_event_index,
+                                                            self.mask_array)
+            return
+
+        # workers are given the NeXus file name and mask once at fork rather than with each sub run
+        pool = multiprocessing.get_context('fork').Pool(min(workers, len(event_ranges)),
+                                                        initializer=_init_conversion_worker,
+                                                        initargs=(self._nexus_name, self.mask_array))
+        try:
+            for event_range, hist in zip(event_ranges, pool.imap(_histogram_sub_run_in_worker, event_ranges)):
+                yield event_range[0], hist
+        finally:
+            pool.close()
+            pool.join()
 
     def split_sample_logs(self, subruns):
         """Create dictionary for sample log of a sub run
@@ -400,8 +737,6 @@ class NeXusConvertingApp(object):
             1. set sample logs on the hidra workspace
             2. set duration on the hidra worksapce
         """
-        run_obj = self._event_wksp.run()
-
         # this contains all of the sample logs
         sample_log_dict = dict()
 
@@ -411,9 +746,9 @@ class NeXusConvertingApp(object):
             log_array_size = 1
 
         # loop through all available logs
-        for log_name in run_obj.keys():
+        for log_name in self._sample_logs.keys():
             # create and calculate the sample log
-            sample_log_dict[log_name] = self.__split_property(run_obj, log_name, log_array_size)
+            sample_log_dict[log_name] = self.__split_property(log_name, log_array_size)
         # END-FOR
 
         # create a fictional log for duration
@@ -422,7 +757,7 @@ class NeXusConvertingApp(object):
                 sample_log_dict[HidraConstants.SUB_RUN_DURATION] = self._splitter.durations
             else:
                 duration = np.ndarray(shape=(log_array_size,), dtype=float)
-                duration[0] = run_obj.getPropertyAsSingleValue('duration')
+                duration[0] = self.__get_log_single_value('duration')
                 sample_log_dict[HidraConstants.SUB_RUN_DURATION] = duration
 
         # set the logs on the hidra workspace
@@ -433,44 +768,52 @@ class NeXusConvertingApp(object):
 
         return sample_log_dict  # needed for testing
 
-    def __split_property(self, runObj, log_name, log_array_size):
+    def __get_log_single_value(self, log_name):
+        '''Mean of a numeric time series log, first value of a string time series log or the log's value'''
+        log_property = self._sample_logs[log_name]
+        if not isinstance(log_property, TimeSeriesLog):
+            return log_property
+        elif log_property.value.dtype.kind in 'fiub':
+            return log_property.value.mean()
+        else:
+            return log_property.value[0]
+
+    def __split_property(self, log_name, log_array_size):
         """Calculate the mean value of the sample log "within" the sub run time range
 
         Parameters
         ----------
-        log_property
-        splitter_times
-        log_array_size
+        log_name : str
+            sample log name
+        log_array_size : int
+            number of sub runs
 
         Returns
         -------
         numpy.ndarray
             split logs
         """
-        # Init split sample logs
-        log_property = runObj[log_name]
-        log_dtype = log_property.dtype()
-        split_log = np.ndarray(shape=(log_array_size,), dtype=log_dtype)
-
-        if self._splitter and isinstance(log_property.value, np.ndarray) and str(log_dtype) in ['f', 'i']:
-            # Float or integer time series property: split and get time average
-            for i_sb in range(log_array_size):
-                split_log[i_sb] = calculate_sub_run_time_average(log_property,
-                                                                 self._splitter.propertyFilters[i_sb])
+        log_property = self._sample_logs[log_name]
+
+        if self._splitter and isinstance(log_property, TimeSeriesLog) and log_property.value.dtype.kind in 'fiu':
+            # Float or integer time series property: split and get time average of all sub runs
+            if self._event_filter is None and self._splitter.subruns.size == 1:
+                # single sub run takes the time range of the log
+                start_times, stop_times = log_property.times[:1], log_property.times[-1:]
+            else:
+                start_times, stop_times = self._splitter.times[::2], self._splitter.times[1::2]
+            split_log = calculate_sub_runs_time_average(log_property, start_times,
+                                                        stop_times).astype(log_property.value.dtype)
         else:
-            try:
-                split_log[:] = runObj.getPropertyAsSingleValue(log_name)
-            except ValueError:
-                if isinstance(log_property.value, str):
-                    split_log[:] = log_property.value
-                elif isinstance(log_property.value, list):
-                    split_log[:] = log_property.value[0]
-                else:
-                    raise ValueError('Cannot filter log "{}" of type "{}"'.format(log_name, log_dtype))
+            log_value = self.__get_log_single_value(log_name)
+            if isinstance(log_value, str):
+                # strings are saved to project file as bytes
+                log_value = log_value.encode()
+            split_log = np.array([log_value] * log_array_size)
 
         return split_log
 
-    def convert(self, use_mantid=False):
+    def convert(self, use_mantid=False, load_counts=True, workers=1):
         """Main method to convert NeXus file to HidraProject File by
 
         1. split the workspace to sub runs
@@ -481,6 +824,12 @@ class NeXusConvertingApp(object):
         use_mantid : bool
             Flag to use Mantid library to convert NeXus (True);
             Otherwise, use PyRS/Python algorithms to convert NeXus
+        load_counts : bool
+            Flag to set the counts of all sub runs to HidraWorkspace.  Otherwise, the counts shall be
+            taken from iterate_sub_run_counts() one sub run at a time
+        workers : int
+            number of processes to histogram the events of sub runs concurrently.  1 for histogramming
+            in this process
 
         Returns
         -------
@@ -492,7 +841,10 @@ class NeXusConvertingApp(object):
             raise RuntimeError('use_mantid=True is no longer supported')
 
         # set counts to each sub run
-        sub_runs = self.split_events_sub_runs()
+        if load_counts:
+            sub_runs = self.split_events_sub_runs(workers)
+        else:
+            sub_runs = self.get_sub_runs()
 
         # set mask
         if self.mask_array is not None:
@@ -501,11 +853,10 @@ class NeXusConvertingApp(object):
         self.split_sample_logs(sub_runs)
 
         # set the nominal wavelength from the nexus file
-        runObj = self._event_wksp.run()
-        if runObj.hasProperty('MonoSetting'):
-            monosetting = MonoSetting.getFromIndex(runObj.getPropertyAsSingleValue('MonoSetting'))
+        if 'MonoSetting' in self._sample_logs:
+            monosetting = MonoSetting.getFromIndex(self.__get_log_single_value('MonoSetting'))
         else:
-            monosetting = MonoSetting.getFromRotation(runObj.getPropertyAsSingleValue('mrot'))
+            monosetting = MonoSetting.getFromRotation(self.__get_log_single_value('mrot'))
         self._hidra_workspace.set_wavelength(float(monosetting), calibrated=False)
 
         return self._hidra_workspace
@@ -520,7 +871,7 @@ class NeXusConvertingApp(object):
 
         # remove file if it already exists
         if os.path.exists(projectfile):
-            self._log.information('Projectfile "{}" exists, removing previous version'.format(projectfile))
+            self._log.info('Projectfile "{}" exists, removing previous version'.format(projectfile))
             os.remove(projectfile)
 
         # save
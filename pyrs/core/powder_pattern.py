@@ -101,7 +101,8 @@ class ReductionApp(object):
         self._reduction_manager.init_session(self._session, self._hydra_ws)
 
     def reduce_data(self, sub_runs, instrument_file, calibration_file, mask, mask_id=None,
-                    van_file=None, num_bins=1000, eta_step=None, eta_min=-8.2, eta_max=8.2):
+                    van_file=None, num_bins=1000, eta_step=None, eta_min=-8.2, eta_max=8.2, workers=1,
+                    pixel_splitting=False, lazy=False, shared_bins=False):
         """Reduce data from HidraWorkspace
 
         Parameters
@@ -126,6 +127,14 @@ class ReductionApp(object):
             min angle for out-of-plane reduction
         eta_max : float
             max angle for out-of-plane reduction
+        workers : int
+            number of processes to reduce sub runs
+        pixel_splitting : bool
+            flag to split each pixel's counts to the 2theta bins overlapped by the pixel
+        lazy : bool
+            flag to reduce each sub run only when its diffraction pattern is requested
+        shared_bins : bool
+            flag to reduce all the sub runs to the same 2theta bins
 
         Returns
         -------
@@ -135,6 +144,93 @@ class ReductionApp(object):
         if sub_runs is None or not bool(sub_runs):  # None or empty list
             sub_runs = self._hydra_ws.get_sub_runs()
 
+        geometry_calibration, van_array, van_duration = self._load_reduction_inputs(instrument_file,
+                                                                                    calibration_file, van_file)
+
+        self._reduction_manager.set_pixel_splitting(pixel_splitting)
+        self._reduction_manager.reduce_diffraction_data(self._session,
+                                                        apply_calibrated_geometry=geometry_calibration,
+                                                        num_bins=num_bins,
+                                                        sub_run_list=sub_runs,
+                                                        mask=mask,
+                                                        mask_id=mask_id,
+                                                        vanadium_counts=van_array,
+                                                        van_duration=van_duration,
+                                                        eta_step=eta_step,
+                                                        eta_min=eta_min,
+                                                        eta_max=eta_max,
+                                                        workers=workers,
+                                                        lazy=lazy,
+                                                        shared_bins=shared_bins)
+
+    def reduce_data_streaming(self, sub_run_counts, instrument_file, calibration_file, mask, mask_id=None,
+                              van_file=None, num_bins=1000, pixel_splitting=False):
+        """Reduce sub runs one at a time as their counts are streamed in
+
+        Each sub run's counts are set to HidraWorkspace, reduced to powder pattern and then removed from
+        HidraWorkspace such that only the counts of the sub run in process are held in memory.
+
+        The same HidraWorkspace (loaded by load_hidra_workspace) is reused for all the sub runs: when a sub run
+        is yielded, its powder pattern has been set to the workspace's reduced diffraction data (overwriting
+        any previous pattern of the sub run with the same mask) and its counts are no longer in the workspace.
+        The counts are yielded such that the caller can still save them, for example to project file
+
+        Parameters
+        ----------
+        sub_run_counts : iterable
+            sub run number and counts array of each sub run, such as NeXusConvertingApp.iterate_sub_run_counts()
+        instrument_file
+        calibration_file : str or None
+            path of calibration file (optionally)
+        mask : str or numpy.ndarray or None
+            Mask name or mask (value) array.  None for no mask
+        mask_id : str or None
+            ID for mask.  If mask ID is None and if default universal mask exists, the default will be
+            applied to all data
+        van_file : str or None
+            HiDRA project file containing vanadium counts or event NeXus file
+        num_bins : int
+            number of bins
+        pixel_splitting : bool
+            flag to split each pixel's counts to the 2theta bins overlapped by the pixel
+
+        Returns
+        -------
+        generator
+            sub run number and counts array of each reduced sub run, in the order of ``sub_run_counts``.
+            The counts array is the object taken from ``sub_run_counts`` (not a copy); the powder pattern is
+            read from the workspace, e.g., by get_diffraction_data(sub_run)
+
+        """
+        geometry_calibration, van_array, van_duration = self._load_reduction_inputs(instrument_file,
+                                                                                    calibration_file, van_file)
+
+        self._reduction_manager.set_pixel_splitting(pixel_splitting)
+        for sub_run, counts in sub_run_counts:
+            self._hydra_ws.set_raw_counts(sub_run, counts)
+            self._reduction_manager.reduce_diffraction_data(self._session,
+                                                            apply_calibrated_geometry=geometry_calibration,
+                                                            num_bins=num_bins,
+                                                            sub_run_list=[sub_run],
+                                                            mask=mask,
+                                                            mask_id=mask_id,
+                                                            vanadium_counts=van_array,
+                                                            van_duration=van_duration)
+            # release counts
+            self._hydra_ws.remove_raw_counts(sub_run)
+
+            yield sub_run, counts
+
+    def _load_reduction_inputs(self, instrument_file, calibration_file, van_file):
+        """Load instrument geometry calibration and vanadium for reduction
+
+        Returns
+        -------
+        tuple
+            geometry calibration (AnglerCameraDetectorShift or False), vanadium counts (array or None) and
+            vanadium duration (float or None)
+
+        """
         # instrument file
         if instrument_file is not None:
             print('instrument file: {}'.format(instrument_file))
@@ -164,17 +260,7 @@ class ReductionApp(object):
             van_array = None
             van_duration = None
 
-        self._reduction_manager.reduce_diffraction_data(self._session,
-                                                        apply_calibrated_geometry=geometry_calibration,
-                                                        num_bins=num_bins,
-                                                        sub_run_list=sub_runs,
-                                                        mask=mask,
-                                                        mask_id=mask_id,
-                                                        vanadium_counts=van_array,
-                                                        van_duration=van_duration,
-                                                        eta_step=eta_step,
-                                                        eta_min=eta_min,
-                                                        eta_max=eta_max)
+        return geometry_calibration, van_array, van_duration
 
     def plot_reduced_data(self, sub_run_number=None):
 
@@ -1,6 +1,10 @@
 # This is a prototype reduction engine for HB2B living independently from Mantid
+from collections import OrderedDict
+import hashlib
+import os
 import numpy as np
 import numpy
+from scipy.sparse import csr_matrix
 from pyrs.core import instrument_geometry
 from pyrs.utilities import checkdatatypes
 # from mantid.simpleapi import CreateWorkspace
@@ -9,30 +13,79 @@ from pyrs.utilities import checkdatatypes
 # import time
 import math
 
+# units of the pixels' values that counts can be binned to: 2theta (degree), d-spacing (Angstrom), Q (1/Angstrom)
+BINNING_UNITS = ('2theta', 'dSpacing', 'Q')
+
+
+def convert_2theta_to_unit(two_theta_array, unit, wave_length):
+    """Convert 2theta to d-spacing or Q
+
+    Parameters
+    ----------
+    two_theta_array : numpy.ndarray
+        2theta in degree
+    unit : str
+        target unit in BINNING_UNITS
+    wave_length : float or None
+        wave length in Angstrom.  It is not required by 2theta
+
+    Returns
+    -------
+    numpy.ndarray
+        values in the target unit
+    """
+    if unit == '2theta':
+        return two_theta_array
+    elif unit not in BINNING_UNITS:
+        raise RuntimeError('Unit {} is not supported.  Supported units are {}'.format(unit, BINNING_UNITS))
+    elif wave_length is None:
+        raise RuntimeError('Wave length is required to convert 2theta to {}'.format(unit))
+
+    sin_theta_array = np.sin(np.deg2rad(0.5 * two_theta_array))
+    if unit == 'dSpacing':
+        return 0.5 * wave_length / sin_theta_array
+
+    return 4. * np.pi / wave_length * sin_theta_array
+
 
 class ResidualStressInstrument(object):
     """
     This is a class to define HB2B instrument geometry and related calculation
     """
 
-    def __init__(self, instrument_setup):
+    def __init__(self, instrument_setup, use_float32=False):
         """
         initialization
         :param instrument_setup:
+        :param use_float32: flag to calculate pixels' positions, 2theta and eta in single precision,
+                            which halves the memory footprint and bandwidth
         """
         # check input
         checkdatatypes.check_type('Instrument setup', instrument_setup,
                                   instrument_geometry.AnglerCameraDetectorGeometry)
+        checkdatatypes.check_bool_variable('Flag to use float32 geometry', use_float32)
 
         # Instrument geometry parameters
         self._instrument_geom_params = instrument_setup
+        self._dtype = np.float32 if use_float32 else np.float64
 
         # Pixels' positions without calibration. It is kept stable upon calibration values (shifts) and arm (000 plane)
         self._raw_pixel_matrix = self._set_uncalibrated_pixels()  # never been used for external client: len(shape) = 3
+        # pre-allocated pixels' positions written by build_instrument
+        self._pixel_buffer = np.empty_like(self._raw_pixel_matrix)
+        # calibrated pixels' positions at arm length before rotating to 2theta, their distances to sample
+        # and the (L2, calibration) they are calculated from
+        self._unrotated_pixel_matrix = None
+        self._unrotated_pixel_norm = None
+        self._unrotated_key = None
 
         self._pixel_matrix = None  # used by external after build_instrument: matrix for pixel positions
+        self._pixel_position_args = None  # (2theta, L2, calibration) to build positions of pixels set by angles
         self._pixel_2theta_matrix = None  # matrix for pixel's 2theta value
+        self._pixel_2theta_footprint = None  # 2theta matrix, pixels' minimum and maximum 2theta
         self._pixel_eta_matrix = None  # matrix for pixel's eta value
+        # [(unit, wave length)] = 2theta matrix, pixels' d-spacing or Q converted from it
+        self._pixel_unit_values = dict()
 
         self._wave_length = None
 
@@ -42,18 +95,11 @@ class ResidualStressInstrument(object):
     def _rotate_detector(detector_matrix, rotation_matrix):
         """
         rotate instrument
-        :param detector_matrix:
-        :param rotation_matrix:
-        :return:
+        :param detector_matrix: N x M x 3 pixel positions
+        :param rotation_matrix: 3 x 3 rotation matrix
+        :return: N x M x 3 rotated pixel positions
         """
-        rotate_det = np.zeros(detector_matrix.shape, dtype='float')
-
-        for i in range(3):
-            for j in range(3):
-                temp_det = rotation_matrix[i, j] * detector_matrix[:, :, j]
-                rotate_det[:, :, i] += temp_det[:, :]
-
-        return rotate_det
+        return np.dot(detector_matrix, np.asarray(rotation_matrix).T.astype(detector_matrix.dtype))
 
     def _set_uncalibrated_pixels(self):
         """
@@ -89,7 +135,8 @@ class ResidualStressInstrument(object):
         # Transpose is required to match instrument pixel ID arrangement:
         # This is the only pixel positions to be transposed in the instrument setup
         # Causing Error?  FIXME -
-        pixel_matrix = pixel_matrix.transpose((1, 0, 2))
+        # Contiguous such that it can be transformed as a (N x M) x 3 array
+        pixel_matrix = np.ascontiguousarray(pixel_matrix.transpose((1, 0, 2)), dtype=self._dtype)
 
         return pixel_matrix
 
@@ -98,57 +145,138 @@ class ResidualStressInstrument(object):
         build instrument considering calibration
         step 1: rotate instrument according to the calibration
         step 2: rotate instrument about 2theta
+        The pixels' positions are written to a buffer owned by this instrument.  The returned matrix is thus
+        only valid until the next build: copy it to keep the positions of more than one build
         :param two_theta
         :param instrument_calibration: AnglerCameraDetectorShift or None (no calibration)
-        :return:
+        :return: N x M x 3 pixels' positions (shared buffer overwritten by the next build)
         """
         # Check input
         checkdatatypes.check_float_variable('2theta', two_theta, (None, None))
-        # Check or set L2
-        if l2 is None:
-            l2 = self._instrument_geom_params.arm_length
-        else:
+        if l2 is not None:
             checkdatatypes.check_float_variable('L2', l2, (1E-2, None))
+        if instrument_calibration is not None:
+            checkdatatypes.check_type('Instrument calibration', instrument_calibration,
+                                      instrument_geometry.AnglerCameraDetectorShift)
 
         # print('[DB...L101] Build instrument: 2theta = {}, arm = {} (diff to default = {})'
         #       ''.format(two_theta, l2, l2 - self._instrument_geom_params.arm_length))
 
-        # make a copy from raw (constant position)
-        self._pixel_matrix = self._raw_pixel_matrix.copy()
+        self._build_pixel_positions(two_theta, l2, instrument_calibration)
+
+        # get 2theta and eta
+        self._pixel_2theta_matrix = np.arccos(self._pixel_matrix[:, :, 2] / self._unrotated_pixel_norm) * 180 / np.pi
+        self._calculate_pixel_eta()
+
+        return self._pixel_matrix
+
+    def _build_pixel_positions(self, two_theta, l2, instrument_calibration):
+        """Calculate pixels' positions (only) of the detector at 2theta
+
+        Parameters
+        ----------
+        two_theta : float
+            detector's 2theta in degree
+        l2 : float or None
+            arm length.  None for the default
+        instrument_calibration : ~pyrs.core.instrument_geometry.AnglerCameraDetectorShift or None
+            geometry calibration
+        """
+        # Set default L2
+        if l2 is None:
+            l2 = self._instrument_geom_params.arm_length
+
+        # Calibrated pixels at arm length are kept such that only 2theta rotation is applied
+        # if the detector is moved to another 2theta
+        if instrument_calibration is None:
+            unrotated_key = (l2, )
+        else:
+            unrotated_key = (l2, instrument_calibration.center_shift_x, instrument_calibration.center_shift_y,
+                             instrument_calibration.center_shift_z, instrument_calibration.rotation_x,
+                             instrument_calibration.rotation_y, instrument_calibration.rotation_z)
+        if unrotated_key != self._unrotated_key:
+            self._set_unrotated_pixels(l2, instrument_calibration)
+            self._unrotated_key = unrotated_key
+
+        # rotate detector (2theta) if it is not zero
+        self._rotate_unrotated_pixels(two_theta)
+        self._pixel_position_args = None
+
+    def _set_unrotated_pixels(self, l2, instrument_calibration):
+        """Set calibrated pixels' positions at arm length before rotating to detector's 2theta
+
+        Calibration rotation and shifts are composed to a single transform of the raw pixel positions:
+        pixel = R_calib * (raw + shift_xy) + arm = R_calib * raw + (R_calib * shift_xy + arm)
+
+        Parameters
+        ----------
+        l2 : float
+            arm length
+        instrument_calibration : ~pyrs.core.instrument_geometry.AnglerCameraDetectorShift or None
+            geometry calibration
+        """
+        rotation_matrix = np.identity(3)
+        translation_vec = np.zeros(3)
+        arm_l2 = l2
 
         # Check and set instrument calibration
         if instrument_calibration is not None:
-            # check type
-            checkdatatypes.check_type('Instrument calibration', instrument_calibration,
-                                      instrument_geometry.AnglerCameraDetectorShift)
-
             # shift center
-            self._pixel_matrix[:, :, 0] += instrument_calibration.center_shift_x
-            self._pixel_matrix[:, :, 1] += instrument_calibration.center_shift_y
+            translation_vec[0] = instrument_calibration.center_shift_x
+            translation_vec[1] = instrument_calibration.center_shift_y
 
             # rotation around instrument center
             # get rotation matrix at origin (for flip, spin and vertical): all data from calibration value
             rot_x_flip = instrument_calibration.rotation_x * np.pi / 180.
             rot_y_flip = instrument_calibration.rotation_y * np.pi / 180.
             rot_z_spin = instrument_calibration.rotation_z * np.pi / 180.
-            calib_matrix = self.generate_rotation_matrix(rot_x_flip, rot_y_flip, rot_z_spin)
-            # print ('[DB...BAT] Calibration rotation matrix:\n{}'.format(calib_matrix))
-            # and rotate at origin
-            self._pixel_matrix = self._rotate_detector(self._pixel_matrix, calib_matrix)
-        # END-IF-ELSE
+            rotation_matrix = np.asarray(self.generate_rotation_matrix(rot_x_flip, rot_y_flip, rot_z_spin))
+            translation_vec = rotation_matrix.dot(translation_vec)
 
-        # push to +Z at length of detector arm
-        arm_l2 = l2
-        if instrument_calibration is not None:
             # Apply the shift on Z (arm length)
             arm_l2 += instrument_calibration.center_shift_z
         # END-IF
-        self._pixel_matrix[:, :, 2] += arm_l2
 
-        # rotate detector (2theta) if it is not zero
-        self.rotate_detector_2theta(two_theta)
+        # push to +Z at length of detector arm
+        translation_vec[2] += arm_l2
 
-        return self._pixel_matrix
+        # transform raw pixels in one pass
+        if self._unrotated_pixel_matrix is None:
+            self._unrotated_pixel_matrix = np.empty_like(self._raw_pixel_matrix)
+        pixel_array = self._unrotated_pixel_matrix.reshape((-1, 3))
+        np.dot(self._raw_pixel_matrix.reshape((-1, 3)), rotation_matrix.T.astype(self._dtype), out=pixel_array)
+        pixel_array += translation_vec
+
+        # distance to sample is not changed by 2theta rotation
+        self._unrotated_pixel_norm = np.sqrt(np.sum(self._unrotated_pixel_matrix**2, axis=2))
+
+    def _rotate_unrotated_pixels(self, two_theta):
+        """Rotate calibrated pixels about Y-axis to detector's 2theta
+
+        Only X and Z are changed by the rotation, and pixels' distances to sample are kept
+
+        Parameters
+        ----------
+        two_theta : float
+            detector's 2theta in degree
+        """
+        unrotated_matrix = self._unrotated_pixel_matrix
+        pixel_matrix = self._pixel_buffer
+
+        two_theta = float(two_theta)
+        if abs(two_theta) > 1.E-7:
+            # same as rotation matrix from _cal_rotation_matrix_y
+            two_theta_rad = np.deg2rad(two_theta)
+            cos_2theta = float(np.cos(two_theta_rad))
+            sin_2theta = float(np.sin(two_theta_rad))
+            np.multiply(unrotated_matrix[:, :, 0], cos_2theta, out=pixel_matrix[:, :, 0])
+            pixel_matrix[:, :, 0] += sin_2theta * unrotated_matrix[:, :, 2]
+            pixel_matrix[:, :, 1] = unrotated_matrix[:, :, 1]
+            np.multiply(unrotated_matrix[:, :, 2], cos_2theta, out=pixel_matrix[:, :, 2])
+            pixel_matrix[:, :, 2] -= sin_2theta * unrotated_matrix[:, :, 0]
+        else:
+            np.copyto(pixel_matrix, unrotated_matrix)
+        self._pixel_matrix = pixel_matrix
 
     def rotate_detector_2theta(self, det_2theta):
         """Rotate detector, i.e., change 2theta value of the detector
@@ -187,7 +315,7 @@ class ResidualStressInstrument(object):
         # define
         # k_in_vec = [0, 0, 1]
 
-        det_pos_array = self._pixel_matrix.copy()
+        det_pos_array = self._pixel_matrix  # read only
 
         if len(self._pixel_matrix[:].shape) == 3:
             # N x M x 3 array
@@ -225,7 +353,7 @@ class ResidualStressInstrument(object):
 
         # define
 
-        det_pos_array = self._pixel_matrix.copy()
+        det_pos_array = self._pixel_matrix  # read only
 
         if len(self._pixel_matrix[:].shape) == 3:
             # N x M x 3 array
@@ -315,8 +443,9 @@ class ResidualStressInstrument(object):
     def get_pixel_matrix(self):
         """
         return the 2D matrix of pixels' coordination
-        :return: 3D array (2D of 1-D array) (N x M x 3)
+        :return: 3D array (2D of 1-D array) (N x M x 3).  It is overwritten by the next build_instrument
         """
+        self._build_pixel_positions_on_demand()
         if self._pixel_matrix is None:
             raise RuntimeError('Instrument has not been built yet')
 
@@ -339,6 +468,96 @@ class ResidualStressInstrument(object):
 
         return two_theta_values
 
+    def get_pixels_2theta_footprint(self):
+        """Get the 2theta range covered by each pixel
+
+        The 2theta of a pixel's corner is interpolated from the 2theta of the 4 pixels sharing the corner,
+        which are linearly extrapolated beyond the detector's edges.  Therefore, it is available from the
+        pixels' 2theta only, including the instruments set up from the pixel geometry cache.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            minimum and maximum 2theta of each pixel (1D arrays in the same order as get_pixels_2theta(1))
+        """
+        if self._pixel_2theta_matrix is None:
+            raise RuntimeError('2theta values for all the pixels are not calculated yet. (instrument not built')
+
+        if self._pixel_2theta_footprint is None or self._pixel_2theta_footprint[0] is not self._pixel_2theta_matrix:
+            two_theta_matrix = np.pad(self._pixel_2theta_matrix.astype('float64'), 1, mode='reflect',
+                                      reflect_type='odd')
+            corner_matrix = 0.25 * (two_theta_matrix[:-1, :-1] + two_theta_matrix[1:, :-1] +
+                                    two_theta_matrix[:-1, 1:] + two_theta_matrix[1:, 1:])
+            corner_list = [corner_matrix[:-1, :-1], corner_matrix[1:, :-1], corner_matrix[:-1, 1:],
+                           corner_matrix[1:, 1:]]
+            min_2theta_array = np.minimum(np.minimum(corner_list[0], corner_list[1]),
+                                          np.minimum(corner_list[2], corner_list[3])).reshape(-1)
+            max_2theta_array = np.maximum(np.maximum(corner_list[0], corner_list[1]),
+                                          np.maximum(corner_list[2], corner_list[3])).reshape(-1)
+            self._pixel_2theta_footprint = self._pixel_2theta_matrix, min_2theta_array, max_2theta_array
+
+        return self._pixel_2theta_footprint[1:]
+
+    def get_pixels_values(self, unit, wave_length=None):
+        """Get the 2theta, d-spacing or Q of all the pixels
+
+        d-spacing and Q are converted from 2theta once for each wave length and kept until the instrument is rebuilt
+
+        Parameters
+        ----------
+        unit : str
+            unit in BINNING_UNITS
+        wave_length : float or None
+            wave length in Angstrom.  None for the wave length of this instrument
+
+        Returns
+        -------
+        numpy.ndarray
+            1D array in the same order as get_pixels_2theta(1)
+        """
+        if unit == '2theta':
+            return self.get_pixels_2theta(1)
+        if wave_length is None:
+            wave_length = self._wave_length
+
+        pixel_2theta_array = self.get_pixels_2theta(1)
+        cached_values = self._pixel_unit_values.get((unit, wave_length), None)
+        if cached_values is None or cached_values[0] is not self._pixel_2theta_matrix:
+            if cached_values is not None:
+                # instrument has been rebuilt: all the converted values are out of date
+                self._pixel_unit_values.clear()
+            cached_values = self._pixel_2theta_matrix, convert_2theta_to_unit(pixel_2theta_array, unit, wave_length)
+            self._pixel_unit_values[unit, wave_length] = cached_values
+
+        return cached_values[1]
+
+    def get_pixels_footprint(self, unit, wave_length=None):
+        """Get the 2theta, d-spacing or Q range covered by each pixel
+
+        Parameters
+        ----------
+        unit : str
+            unit in BINNING_UNITS
+        wave_length : float or None
+            wave length in Angstrom.  None for the wave length of this instrument
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            minimum and maximum of each pixel (1D arrays in the same order as get_pixels_2theta(1))
+        """
+        min_2theta_array, max_2theta_array = self.get_pixels_2theta_footprint()
+        if unit == '2theta':
+            return min_2theta_array, max_2theta_array
+        if wave_length is None:
+            wave_length = self._wave_length
+
+        # d-spacing decreases with 2theta
+        min_value_array = convert_2theta_to_unit(min_2theta_array, unit, wave_length)
+        max_value_array = convert_2theta_to_unit(max_2theta_array, unit, wave_length)
+
+        return np.minimum(min_value_array, max_value_array), np.maximum(min_value_array, max_value_array)
+
     def get_eta_values(self, dimension):
         """
                 get the 2theta values for all the pixels
@@ -359,20 +578,12 @@ class ResidualStressInstrument(object):
     def get_dspacing_value(self, dimension=1):
         """
         get the dspacing value for all pixels
-        :param dimension:
+        :param dimension: 1 for array, 2 for matrix
         :return:
         """
-        two_theta_array = self.get_pixels_2theta(dimension)
-        print('[DB...BAT] 2theta range: ({}, {})'
-              ''.format(two_theta_array.min(), two_theta_array.max()))
-        assert isinstance(two_theta_array, numpy.ndarray), 'check'
-
-        # convert to d-spacing
-        d_spacing_array = 0.5 * self._wave_length / numpy.sin(0.5 * two_theta_array * numpy.pi / 180.)
-        assert isinstance(d_spacing_array, numpy.ndarray)
-
-        print('[DB...BAT] Converted d-spacing range: ({}, {})'
-              ''.format(d_spacing_array.min(), d_spacing_array.max()))
+        d_spacing_array = self.get_pixels_values('dSpacing')
+        if dimension != 1:
+            d_spacing_array = d_spacing_array.reshape(self._pixel_2theta_matrix.shape)
 
         return d_spacing_array
 
@@ -381,6 +592,7 @@ class ResidualStressInstrument(object):
         return the 1D array of pixels' coordination in the order of pixel IDs
         :return: 2D array ((N x M) x 3)
         """
+        self._build_pixel_positions_on_demand()
         if self._pixel_matrix is None:
             raise RuntimeError('Instrument has not been built yet')
 
@@ -394,20 +606,717 @@ class ResidualStressInstrument(object):
 
         return pixel_pos_array
 
+    def set_pixel_angles(self, two_theta_matrix, eta_matrix, two_theta=None, l2=None, instrument_calibration=None):
+        """Set pixels' 2theta and eta from an instrument previously built with the same geometry
+
+        Pixels' positions are only calculated when they are requested, from the detector's 2theta, L2 and
+        calibration that the angles are calculated with
+
+        Parameters
+        ----------
+        two_theta_matrix : numpy.ndarray
+            2D matrix of pixels' 2theta values
+        eta_matrix : numpy.ndarray
+            2D matrix of pixels' eta values
+        two_theta : float or None
+            detector's 2theta.  None for pixels' positions not being available
+        l2 : float or None
+            arm length.  None for the default
+        instrument_calibration : ~pyrs.core.instrument_geometry.AnglerCameraDetectorShift or None
+            geometry calibration
+        """
+        checkdatatypes.check_numpy_arrays('Pixels 2theta and eta', [two_theta_matrix, eta_matrix], 2, True)
+
+        self._pixel_matrix = None
+        self._pixel_2theta_matrix = two_theta_matrix
+        self._pixel_eta_matrix = eta_matrix
+        if two_theta is None:
+            self._pixel_position_args = None
+        else:
+            self._pixel_position_args = two_theta, l2, instrument_calibration
+
+    def _build_pixel_positions_on_demand(self):
+        """Calculate pixels' positions of the instrument set up by pixels' angles"""
+        if self._pixel_matrix is None and self._pixel_position_args is not None:
+            self._build_pixel_positions(*self._pixel_position_args)
+
     def set_wavelength(self, w_l):
         self._wave_length = w_l
 
+    @property
+    def use_float32(self):
+        """Flag whether pixels' positions, 2theta and eta are calculated in single precision
+        """
+        return self._dtype == np.float32
+
+    @property
+    def wave_length(self):
+        return self._wave_length
+
+
+def locate_bins(pixel_x_array, bin_edges):
+    """Locate the bin of each pixel with the same convention as numpy.histogram
+
+    The last bin includes its right boundary.  Pixels below range are given index -1, and pixels above range
+    or with NaN are given the number of bins.  Bins of uniform width are located arithmetically and corrected
+    for rounding against the bin edges; otherwise, they are searched.
+
+    Parameters
+    ----------
+    pixel_x_array : numpy.ndarray
+        pixels' X (such as 2theta) values
+    bin_edges : numpy.ndarray
+        monotonically increasing bin edges
+
+    Returns
+    -------
+    numpy.ndarray
+        bin index of each pixel
+    """
+    num_bins = bin_edges.shape[0] - 1
+    bin_widths = bin_edges[1:] - bin_edges[:-1]
+    if num_bins < 1 or not np.allclose(bin_widths, bin_widths[0], rtol=1.E-9, atol=0.):
+        bin_index_array = np.searchsorted(bin_edges, pixel_x_array, side='right') - 1
+        bin_index_array[pixel_x_array == bin_edges[-1]] = num_bins - 1
+        return bin_index_array
+
+    min_x, max_x = bin_edges[0], bin_edges[-1]
+    bin_index_array = np.full(pixel_x_array.shape, num_bins, dtype=np.int64)
+    bin_index_array[pixel_x_array < min_x] = -1
+    in_range = (pixel_x_array >= min_x) & (pixel_x_array <= max_x)
+    in_range_x = pixel_x_array[in_range]
+
+    in_range_index = ((in_range_x - min_x) * (num_bins / (max_x - min_x))).astype(np.int64)
+    np.clip(in_range_index, 0, num_bins - 1, out=in_range_index)
+    # correct the ones next to bin edges as numpy.histogram does for uniform bins
+    in_range_index[in_range_x < bin_edges[in_range_index]] -= 1
+    in_range_index[(in_range_x >= bin_edges[in_range_index + 1]) & (in_range_index != num_bins - 1)] += 1
+    bin_index_array[in_range] = in_range_index
+
+    return bin_index_array
+
+
+class PixelBinningPlan(object):
+    """Pre-computed pixel to bin assignment for rebinning detector counts
+
+    The assignment is stored as a sparse (CSR) matrix of shape (number of bins, number of pixels) with
+    the detector mask and the vanadium (zero-count pixel) exclusion folded in.  It only depends on the
+    detector geometry, the bin boundaries, the mask and the vanadium.  Therefore it can be built once
+    and reused by all the sub runs with the same detector position, such that histogramming a sub run
+    is reduced to one sparse matrix-vector product for intensity and one for variance.
+
+    Pixels with NaN or infinity counts are excluded by zero weights, without copying the valid pixels.
+    """
+
+    def __init__(self, pixel_x_array, bin_edges, mask_array=None, vanadium_counts=None, vanadium_histogram=None):
+        """Initialization
+
+        Parameters
+        ----------
+        pixel_x_array : numpy.ndarray
+            X value (e.g., 2theta) of each pixel in the order of pixel ID
+        bin_edges : numpy.ndarray
+            bin boundaries
+        mask_array : numpy.ndarray or None
+            mask: 1 to keep, 0 to mask (exclude)
+        vanadium_counts : numpy.ndarray or None
+            vanadium counts of each pixel for normalization.  Pixels with vanadium counts less than 0.9
+            are excluded
+        vanadium_histogram : tuple or None
+            histogrammed vanadium and its variances from a plan of the same geometry, bins, mask and vanadium
+            such that vanadium is not histogrammed again
+        """
+        checkdatatypes.check_numpy_arrays('Pixel X array and bin edges', [pixel_x_array, bin_edges], 1, False)
+        num_pixels = pixel_x_array.shape[0]
+        num_bins = bin_edges.shape[0] - 1
+
+        # Pixels to exclude: out of range, masked and no vanadium counts
+        bin_index_array = locate_bins(pixel_x_array, bin_edges)
+        valid_pixels = (bin_index_array >= 0) & (bin_index_array < num_bins)
+        if mask_array is not None:
+            checkdatatypes.check_numpy_arrays('Pixel X array and mask', [pixel_x_array, mask_array], 1, True)
+            valid_pixels &= mask_array == 1
+        if vanadium_counts is not None:
+            checkdatatypes.check_numpy_arrays('Pixel X array and vanadium counts',
+                                              [pixel_x_array, vanadium_counts], 1, True)
+            valid_pixels &= np.logical_not(vanadium_counts < 0.9)
+
+        # Build the sparse matrix
+        self._valid_pixels = valid_pixels
+        pixel_ids = np.where(valid_pixels)[0]
+        self._set_matrix(bin_index_array[pixel_ids], pixel_ids, num_bins, num_pixels)
+
+        self._bin_edges = bin_edges
+        self._mask_array = mask_array
+        self._set_vanadium(vanadium_counts, vanadium_histogram)
+
+    def _set_matrix(self, row_index_array, pixel_ids, num_rows, num_pixels, weight_array=None):
+        """Set the sparse matrix from the row (bin) index and optionally the weight of each included pixel
+        """
+        if weight_array is None:
+            weight_array = np.ones(pixel_ids.shape[0], dtype='float64')
+            self._matrix = csr_matrix((weight_array, (row_index_array, pixel_ids)), shape=(num_rows, num_pixels))
+            self._var_matrix = self._matrix
+        else:
+            # variances are propagated with squared weights
+            self._matrix = csr_matrix((weight_array, (row_index_array, pixel_ids)), shape=(num_rows, num_pixels))
+            self._var_matrix = self._matrix.multiply(self._matrix).tocsr()
+
+    def _set_vanadium(self, vanadium_counts, vanadium_histogram=None):
+        """Set vanadium and histogram it (unless its histogram is given) to the normalization denominator
+        """
+        self._vanadium_counts = vanadium_counts
+        if vanadium_counts is None:
+            self._van_hist = None
+            self._van_var = None
+            self._van_denominator = None
+            return
+
+        if vanadium_histogram is None:
+            self._van_hist, self._van_var = self._histogram_counts(vanadium_counts)
+        else:
+            self._van_hist, self._van_var = vanadium_histogram
+            if self._van_hist.shape != (self._matrix.shape[0],):
+                raise RuntimeError('Vanadium histogram with shape {} does not match {} bins'
+                                   ''.format(self._van_hist.shape, self._matrix.shape[0]))
+
+        # Mask the bins without vanadium counts by NaN
+        self._van_denominator = self._van_hist.copy()
+        self._van_denominator[np.where(self._van_denominator < 1E-10)] = np.nan
+
+    @property
+    def vanadium_histogram(self):
+        """Histogrammed vanadium and its variances.  None without vanadium
+        """
+        if self._van_hist is None:
+            return None
+
+        return self._van_hist, self._van_var
+
+    @property
+    def bin_edges(self):
+        """Bin boundaries
+        """
+        return self._bin_edges
+
+    @property
+    def valid_pixels(self):
+        """Boolean array of pixels that are in range, not masked and with vanadium counts
+        """
+        return self._valid_pixels
+
+    @property
+    def matrix(self):
+        """Sparse pixel to bin matrix with shape (number of bins, number of pixels)
+        """
+        return self._matrix
+
+    def is_compatible(self, bin_edges, mask_array, vanadium_counts):
+        """Check whether this plan can be used to histogram with the given bins, mask and vanadium
+
+        Mask and vanadium are compared by identity as they are expected to be the same arrays for all sub runs
+        """
+        return (mask_array is self._mask_array and vanadium_counts is self._vanadium_counts and
+                np.array_equal(bin_edges, self._bin_edges))
+
+    def _histogram_counts(self, counts_array, finite_array=None):
+        """Histogram counts and their variances (counts but 1 for pixels without counts)
+
+        Integer counts are not copied to float: they are converted in the sparse matrix product
+
+        Parameters
+        ----------
+        counts_array : numpy.ndarray
+            1D counts of each pixel or 2D counts of shape (number of sub runs, number of pixels)
+        finite_array : numpy.ndarray or None
+            boolean array in the shape of counts for pixels to include.  None to include all
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            histogram, square root of histogrammed variances
+        """
+        if finite_array is None and counts_array.dtype.kind in 'iub':
+            pixel_var_array = np.where(counts_array == 0, 1, counts_array)
+            hist = self._matrix.dot(counts_array.T).T
+            var = np.sqrt(self._var_matrix.dot(pixel_var_array.T).T)
+            return hist, var
+
+        pixel_var_array = counts_array.astype('float64')
+        pixel_var_array[pixel_var_array == 0.] = 1.
+
+        if finite_array is None:
+            pixel_count_array = counts_array.astype('float64', copy=False)
+        else:
+            # zero weights to excluded pixels
+            pixel_count_array = np.where(finite_array, counts_array, 0.)
+            pixel_var_array[np.logical_not(finite_array)] = 0.
+
+        hist = self._matrix.dot(pixel_count_array.T).T
+        var = np.sqrt(self._var_matrix.dot(pixel_var_array.T).T)
+
+        return hist, var
+
+    def histogram(self, counts_array, is_point_data=True):
+        """Histogram detector counts
+
+        Parameters
+        ----------
+        counts_array : numpy.ndarray
+            counts of each pixel in the order of pixel ID.  It can be a 2D array of shape
+            (number of sub runs, number of pixels) to histogram multiple sub runs at once.
+            Pixels with NaN or infinity counts are excluded from counts and vanadium.
+        is_point_data : bool
+            Output shall be point data; otherwise, histogram data
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            bins (centers or boundaries), intensity, and variances (vectors or matrices as counts)
+        """
+        if counts_array.dtype.kind in 'iub' or np.all(np.isfinite(counts_array)):
+            finite_array = None
+        else:
+            finite_array = np.isfinite(counts_array)
+        hist, var = self._histogram_counts(counts_array, finite_array)
+
+        if self._van_hist is not None:
+            if finite_array is None:
+                hist_bin, van_var = self._van_denominator, self._van_var
+            else:
+                van_hist, van_var = self._histogram_counts(np.broadcast_to(self._vanadium_counts,
+                                                                           counts_array.shape), finite_array)
+
+                # Mask the bins without vanadium counts by NaN
+                hist_bin = van_hist.copy()
+                hist_bin[np.where(hist_bin < 1E-10)] = np.nan
+
+            # propagation of error
+            var = np.sqrt((var / hist)**2 + (van_var / hist_bin)**2)
+
+            # Normalize diffraction data
+            hist /= hist_bin
+            var *= hist
+
+        if is_point_data:
+            bins = 0.5 * (self._bin_edges[..., 1:] + self._bin_edges[..., :-1])
+        else:
+            bins = self._bin_edges
+
+        return bins, hist, var
+
+
+class PixelSplittingBinningPlan(PixelBinningPlan):
+    """Pre-computed pixel to bin weights for rebinning detector counts with pixel splitting
+
+    Each pixel covers a 2theta range (footprint) instead of a single 2theta.  Its counts are split to
+    the overlapped bins in proportion to the overlap.  Variances are propagated with the squared weights.
+    """
+
+    def __init__(self, pixel_x_min_array, pixel_x_max_array, bin_edges, mask_array=None, vanadium_counts=None,
+                 vanadium_histogram=None):
+        """Initialization
+
+        Parameters
+        ----------
+        pixel_x_min_array : numpy.ndarray
+            minimum X value (e.g., 2theta) of each pixel in the order of pixel ID
+        pixel_x_max_array : numpy.ndarray
+            maximum X value of each pixel in the order of pixel ID
+        bin_edges : numpy.ndarray
+            bin boundaries
+        mask_array : numpy.ndarray or None
+            mask: 1 to keep, 0 to mask (exclude)
+        vanadium_counts : numpy.ndarray or None
+            vanadium counts of each pixel for normalization.  Pixels with vanadium counts less than 0.9
+            are excluded
+        vanadium_histogram : tuple or None
+            histogrammed vanadium and its variances from a plan of the same geometry, bins, mask and vanadium
+        """
+        checkdatatypes.check_numpy_arrays('Pixel X minimum and maximum arrays',
+                                          [pixel_x_min_array, pixel_x_max_array], 1, True)
+        checkdatatypes.check_numpy_arrays('Bin edges', [bin_edges], 1, False)
+        num_pixels = pixel_x_min_array.shape[0]
+        num_bins = bin_edges.shape[0] - 1
+
+        # Pixels to exclude: out of range, masked and no vanadium counts
+        valid_pixels = (pixel_x_max_array >= bin_edges[0]) & (pixel_x_min_array <= bin_edges[-1])
+        if mask_array is not None:
+            checkdatatypes.check_numpy_arrays('Pixel X array and mask', [pixel_x_min_array, mask_array], 1, True)
+            valid_pixels &= mask_array == 1
+        if vanadium_counts is not None:
+            checkdatatypes.check_numpy_arrays('Pixel X array and vanadium counts',
+                                              [pixel_x_min_array, vanadium_counts], 1, True)
+            valid_pixels &= np.logical_not(vanadium_counts < 0.9)
+        pixel_ids = np.where(valid_pixels)[0]
+        min_x_array = pixel_x_min_array[pixel_ids].astype('float64')
+        max_x_array = pixel_x_max_array[pixel_ids].astype('float64')
+
+        # First and last bins overlapped by each pixel.  Pixels without width are not split
+        first_bin_array = np.clip(np.searchsorted(bin_edges, min_x_array, side='right') - 1, 0, num_bins - 1)
+        last_bin_array = np.clip(np.searchsorted(bin_edges, max_x_array, side='left') - 1, 0, num_bins - 1)
+        last_bin_array = np.maximum(first_bin_array, last_bin_array)
+        width_array = max_x_array - min_x_array
+        no_width = width_array <= 0.
+        width_array[no_width] = 1.
+
+        row_index_list = list()
+        pixel_ids_list = list()
+        weight_list = list()
+        for bin_shift in range(int(np.max(last_bin_array - first_bin_array)) + 1 if pixel_ids.shape[0] else 0):
+            bin_index_array = first_bin_array + bin_shift
+            in_footprint = bin_index_array <= last_bin_array
+            bin_index_array = bin_index_array[in_footprint]
+
+            overlap_array = (np.minimum(max_x_array[in_footprint], bin_edges[bin_index_array + 1]) -
+                             np.maximum(min_x_array[in_footprint], bin_edges[bin_index_array]))
+            weight_array = overlap_array / width_array[in_footprint]
+            if bin_shift == 0:
+                weight_array[no_width[in_footprint]] = 1.
+
+            has_weight = weight_array > 0.
+            row_index_list.append(bin_index_array[has_weight])
+            pixel_ids_list.append(pixel_ids[in_footprint][has_weight])
+            weight_list.append(weight_array[has_weight])
+
+        if row_index_list:
+            self._set_matrix(np.concatenate(row_index_list), np.concatenate(pixel_ids_list), num_bins, num_pixels,
+                             np.concatenate(weight_list))
+        else:
+            self._set_matrix(np.zeros(0, dtype=int), np.zeros(0, dtype=int), num_bins, num_pixels,
+                             np.zeros(0))
+        self._valid_pixels = np.asarray(self._matrix.sum(axis=0)).reshape(-1) > 0
+
+        self._bin_edges = bin_edges
+        self._mask_array = mask_array
+        self._set_vanadium(vanadium_counts, vanadium_histogram)
+
+
+class PixelWedgeBinningPlan(PixelBinningPlan):
+    """Pre-computed pixel to (wedge, bin) assignment for rebinning detector counts of multiple wedges at once
+
+    Each wedge (such as an eta range for texture) is a subset of pixels with its own bin boundaries, while all
+    the wedges have the same number of bins.  The assignment is a sparse matrix of shape
+    (number of wedges x number of bins, number of pixels), such that the patterns of all the wedges are
+    histogrammed with one sparse matrix-vector product.  A pixel can belong to more than one wedge.
+    """
+
+    def __init__(self, pixel_x_array, wedge_pixels_list, bin_edges_list, vanadium_counts=None):
+        """Initialization
+
+        Parameters
+        ----------
+        pixel_x_array : numpy.ndarray
+            X value (e.g., 2theta) of each pixel in the order of pixel ID
+        wedge_pixels_list : list
+            boolean arrays of the pixels in each wedge (with any detector mask folded in)
+        bin_edges_list : list
+            bin boundaries of each wedge.  All the wedges shall have the same number of bins
+        vanadium_counts : numpy.ndarray or None
+            vanadium counts of each pixel for normalization.  Pixels with vanadium counts less than 0.9
+            are excluded
+        """
+        checkdatatypes.check_numpy_arrays('Pixel X array', [pixel_x_array], 1, False)
+        if len(wedge_pixels_list) != len(bin_edges_list) or len(wedge_pixels_list) == 0:
+            raise RuntimeError('Number of wedges ({}) and number of bin boundaries ({}) shall be same and '
+                               'positive'.format(len(wedge_pixels_list), len(bin_edges_list)))
+        bin_edges = np.array(bin_edges_list)
+        checkdatatypes.check_numpy_arrays('Wedges\' bin edges', [bin_edges], 2, False)
+        num_pixels = pixel_x_array.shape[0]
+        num_wedges, num_bins = bin_edges.shape[0], bin_edges.shape[1] - 1
+
+        if vanadium_counts is None:
+            with_vanadium = np.ones(num_pixels, dtype=bool)
+        else:
+            checkdatatypes.check_numpy_arrays('Pixel X array and vanadium counts',
+                                              [pixel_x_array, vanadium_counts], 1, True)
+            with_vanadium = np.logical_not(vanadium_counts < 0.9)
+
+        # Row of (wedge, bin) of each pixel included: pixels in wedge, in range and with vanadium counts
+        row_index_list = list()
+        pixel_ids_list = list()
+        for wedge_index, wedge_pixels in enumerate(wedge_pixels_list):
+            pixel_ids = np.where(wedge_pixels & with_vanadium)[0]
+            bin_index_array = locate_bins(pixel_x_array[pixel_ids], bin_edges[wedge_index])
+            in_range = (bin_index_array >= 0) & (bin_index_array < num_bins)
+            row_index_list.append(bin_index_array[in_range] + wedge_index * num_bins)
+            pixel_ids_list.append(pixel_ids[in_range])
+        self._set_matrix(np.concatenate(row_index_list), np.concatenate(pixel_ids_list),
+                         num_wedges * num_bins, num_pixels)
+        self._valid_pixels = np.asarray(self._matrix.sum(axis=0)).reshape(-1) > 0
+
+        self._bin_edges = bin_edges
+        self._mask_array = None
+        self._set_vanadium(vanadium_counts)
+
+    def histogram(self, counts_array, is_point_data=True):
+        """Histogram detector counts to each wedge
+
+        Parameters
+        ----------
+        counts_array : numpy.ndarray
+            counts of each pixel in the order of pixel ID.  Pixels with NaN or infinity counts are excluded
+        is_point_data : bool
+            Output shall be point data; otherwise, histogram data
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            bins (centers or boundaries), intensity, and variances of shape (number of wedges, number of bins)
+        """
+        checkdatatypes.check_numpy_arrays('Detector counts', [counts_array], 1, False)
+        bins, hist, var = super(PixelWedgeBinningPlan, self).histogram(counts_array, is_point_data)
+        num_wedges = self._bin_edges.shape[0]
+
+        return bins, hist.reshape((num_wedges, -1)), var.reshape((num_wedges, -1))
+
+
+class PixelGeometryCache(object):
+    """Least-recently-used cache of pixels' 2theta and eta of built instruments
+
+    Instruments are keyed by detector setup, detector position (2theta and L2), geometry calibration and wave length.
+    Position, calibration and wave length are quantized by a resolution.
+    The cache is limited by the total memory of the cached arrays.
+
+    Optionally the arrays are persisted to a cache directory as .npy files named by the hash of the geometry key,
+    and memory-mapped by the later processes reducing data with the same instrument.
+    """
+
+    def __init__(self, memory_budget=512 * 1024**2, resolution=1.E-6, cache_dir=None):
+        """Initialization
+
+        Parameters
+        ----------
+        memory_budget : int
+            maximum memory in bytes for all the cached arrays
+        resolution : float
+            resolution to quantize 2theta (degree), L2 (meter), calibration and wave length in keys
+        cache_dir : str or None
+            directory to persist pixels' 2theta and eta.  None for not persisting
+        """
+        checkdatatypes.check_float_variable('Geometry key resolution', resolution, (0., None))
+
+        self._resolution = resolution
+        self._memory_budget = 0
+        self._memory_used = 0
+        self._geometry_dict = OrderedDict()  # [geometry key] = 2theta matrix, eta matrix
+        self._cache_dir = None
+
+        self.set_memory_budget(memory_budget)
+        self.set_cache_directory(cache_dir)
+
+    def __contains__(self, geometry_key):
+        return geometry_key in self._geometry_dict
+
+    def __len__(self):
+        return len(self._geometry_dict)
+
+    @property
+    def memory_used(self):
+        """Memory (bytes) used by cached arrays
+        """
+        return self._memory_used
+
+    def set_memory_budget(self, memory_budget):
+        """Set the maximum memory (bytes) for cached arrays.  Least recently used instruments are removed if needed
+        """
+        checkdatatypes.check_int_variable('Geometry cache memory budget', memory_budget, (0, None))
+        self._memory_budget = memory_budget
+        self._shrink(0)
+
+    @property
+    def cache_directory(self):
+        """Directory where pixels' 2theta and eta are persisted.  None if not persisted
+        """
+        return self._cache_dir
+
+    def set_cache_directory(self, cache_dir):
+        """Set the directory to persist pixels' 2theta and eta to.  It will be created if it does not exist
+
+        Parameters
+        ----------
+        cache_dir : str or None
+            cache directory.  None to turn off persisting
+        """
+        if cache_dir is not None:
+            checkdatatypes.check_string_variable('Geometry cache directory', cache_dir)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            elif not os.path.isdir(cache_dir):
+                raise RuntimeError('Geometry cache {} is not a directory'.format(cache_dir))
+
+        self._cache_dir = cache_dir
+
+    def clear(self):
+        """Remove all the cached instruments from memory.  Persisted files are kept
+        """
+        self._geometry_dict.clear()
+        self._memory_used = 0
+
+    def _quantize(self, value):
+        if value is None:
+            return None
+        return int(round(value / self._resolution))
+
+    def generate_key(self, instrument_setup, two_theta, l2, calibration, wave_length, use_float32=False):
+        """Generate the key of a built instrument
+
+        Parameters
+        ----------
+        instrument_setup : ~pyrs.core.instrument_geometry.AnglerCameraDetectorGeometry
+            detector setup
+        two_theta : float
+            detector's 2theta in degree (PyRS convention)
+        l2 : float or None
+            L2.  None for arm length of the detector setup
+        calibration : ~pyrs.core.instrument_geometry.AnglerCameraDetectorShift or None
+            geometry calibration
+        wave_length : float or None
+            wave length
+        use_float32 : bool
+            flag whether pixels' 2theta and eta are calculated in single precision
+
+        Returns
+        -------
+        tuple
+            geometry key
+        """
+        if l2 is None:
+            l2 = instrument_setup.arm_length
+        if calibration is None:
+            calibration_key = None
+        else:
+            calibration_key = tuple(self._quantize(value) for value in
+                                    [calibration.center_shift_x, calibration.center_shift_y,
+                                     calibration.center_shift_z, calibration.rotation_x,
+                                     calibration.rotation_y, calibration.rotation_z])
+        # detector setup is not quantized as it is not a measured value
+        setup_key = instrument_setup.detector_size + instrument_setup.pixel_dimension
+        setup_key += (instrument_setup.arm_length, 'float32' if use_float32 else 'float64')
+
+        return setup_key, self._quantize(two_theta), self._quantize(l2), calibration_key, self._quantize(wave_length)
+
+    def get(self, geometry_key):
+        """Get pixels' 2theta and eta of a cached instrument
+
+        Returns
+        -------
+        tuple or None
+            2theta matrix and eta matrix (read-only).  None if the instrument is not cached
+        """
+        if geometry_key not in self._geometry_dict:
+            pixel_angles = self._load(geometry_key)
+            if pixel_angles is not None:
+                self._add_to_memory(geometry_key, *pixel_angles)
+            return pixel_angles
+
+        # move to the most recently used
+        pixel_angles = self._geometry_dict.pop(geometry_key)
+        self._geometry_dict[geometry_key] = pixel_angles
+
+        return pixel_angles
+
+    def add(self, geometry_key, two_theta_matrix, eta_matrix):
+        """Add pixels' 2theta and eta of a built instrument
+
+        Arrays are set to read-only as they will be shared by all reduction engines with the same instrument
+        """
+        if geometry_key in self._geometry_dict:
+            return
+
+        self._add_to_memory(geometry_key, two_theta_matrix, eta_matrix)
+        self._save(geometry_key, two_theta_matrix, eta_matrix)
+
+    def _add_to_memory(self, geometry_key, two_theta_matrix, eta_matrix):
+        """Add pixels' 2theta and eta to the in-memory cache within memory budget
+        """
+        memory_size = two_theta_matrix.nbytes + eta_matrix.nbytes
+        if memory_size > self._memory_budget:
+            return
+
+        self._shrink(memory_size)
+        two_theta_matrix.flags.writeable = False
+        eta_matrix.flags.writeable = False
+        self._geometry_dict[geometry_key] = two_theta_matrix, eta_matrix
+        self._memory_used += memory_size
+
+    def _shrink(self, memory_size):
+        """Remove least recently used instruments to free memory for a new item
+        """
+        while self._geometry_dict and self._memory_used + memory_size > self._memory_budget:
+            two_theta_matrix, eta_matrix = self._geometry_dict.popitem(last=False)[1]
+            self._memory_used -= two_theta_matrix.nbytes + eta_matrix.nbytes
+
+    def _get_file_names(self, geometry_key):
+        """Names of the files persisting 2theta and eta of an instrument in the cache directory
+        """
+        key_hash = hashlib.sha1(repr(geometry_key).encode('utf-8')).hexdigest()
+        return [os.path.join(self._cache_dir, '{}_{}.npy'.format(key_hash, name)) for name in ['2theta', 'eta']]
+
+    def _load(self, geometry_key):
+        """Memory-map pixels' 2theta and eta persisted in cache directory
+
+        Returns
+        -------
+        tuple or None
+            2theta matrix and eta matrix (read-only).  None if the instrument is not persisted
+        """
+        if self._cache_dir is None:
+            return None
+
+        file_names = self._get_file_names(geometry_key)
+        if not all(os.path.exists(file_name) for file_name in file_names):
+            return None
+        try:
+            pixel_angles = tuple(np.load(file_name, mmap_mode='r') for file_name in file_names)
+        except (IOError, ValueError):
+            # corrupted files shall be ignored and recalculated
+            return None
+        if pixel_angles[0].shape != pixel_angles[1].shape:
+            return None
+
+        return pixel_angles
+
+    def _save(self, geometry_key, two_theta_matrix, eta_matrix):
+        """Persist pixels' 2theta and eta to cache directory
+
+        Each file is written to a temporary file and then renamed such that a concurrent process never
+        memory-maps a partially written file
+        """
+        if self._cache_dir is None:
+            return
+
+        for file_name, matrix in zip(self._get_file_names(geometry_key), [two_theta_matrix, eta_matrix]):
+            if os.path.exists(file_name):
+                continue
+            temp_name = '{}.{}.tmp'.format(file_name, os.getpid())
+            try:
+                with open(temp_name, 'wb') as temp_file:
+                    np.save(temp_file, matrix)
+                os.rename(temp_name, file_name)
+            except (IOError, OSError) as io_error:
+                print('[WARNING] Unable to persist pixel geometry to {}: {}'.format(file_name, io_error))
+                if os.path.exists(temp_name):
+                    os.remove(temp_name)
+
+
+# pixels' 2theta and eta cache shared by all reduction engines in the process
+PIXEL_GEOMETRY_CACHE = PixelGeometryCache()
+
 
 class PyHB2BReduction(object):
     """ A class to reduce HB2B data in pure Python and numpy
     """
 
-    def __init__(self, instrument, wave_length=None):
+    def __init__(self, instrument, wave_length=None, use_float32=False, pixel_splitting=False):
         """
         initialize the instrument
         :param instrument
+        :param wave_length
+        :param use_float32: flag to calculate instrument geometry in single precision
+        :param pixel_splitting: flag to split each pixel's counts to the 2theta bins overlapped by the pixel
         """
-        self._instrument = ResidualStressInstrument(instrument)
+        self._instrument = ResidualStressInstrument(instrument, use_float32)
 
         if wave_length is not None:
             self._instrument.set_wavelength(wave_length)
@@ -415,6 +1324,15 @@ class PyHB2BReduction(object):
         self._detector_2theta = None
         self._detector_l2 = None
         self._detector_counts = None
+        self._instrument_setup = instrument
+        self._geometry_key = None
+        self._calibration = None
+
+        # pixel to 2theta bin assignment of the current instrument: reused among sub runs
+        checkdatatypes.check_bool_variable('Flag to split pixels', pixel_splitting)
+        self._pixel_splitting = pixel_splitting
+        self._binning_plan = None
+        self._binning_unit = None  # unit and wave length of the binning plan
 
         # buffer for the last reduced data set
         # supposed to be 2 tuple for vector of 2theta and vector of intensity
@@ -430,20 +1348,80 @@ class PyHB2BReduction(object):
         """
         return self._instrument
 
-    def build_instrument(self, calibration):
+    @property
+    def instrument_setup(self):
+        """Detector setup of the instrument
+        """
+        return self._instrument_setup
+
+    @property
+    def pixel_splitting(self):
+        """Flag whether pixels' counts are split to the 2theta bins overlapped by pixels
+        """
+        return self._pixel_splitting
+
+    @property
+    def geometry_key(self):
+        """Key of the instrument built in the pixel geometry cache.  None if instrument is not built
+        """
+        return self._geometry_key
+
+    def generate_geometry_key(self, two_theta, l2, calibration):
+        """Generate the key of instrument with this detector setup at a given position in the pixel geometry cache
+        """
+        return PIXEL_GEOMETRY_CACHE.generate_key(self._instrument_setup, two_theta, l2, calibration,
+                                                 self._instrument.wave_length, self._instrument.use_float32)
+
+    def build_instrument(self, calibration, use_cache=True):
         """ Build an instrument for each pixel's position in cartesian coordinate
         :param calibration: AnglerCameraDetectorShift from geometry calibration
+        :param use_cache: flag to get pixels' 2theta and eta from (and add to) the pixel geometry cache.
+                          Pixels' positions are calculated on request if the instrument is found in cache.
         :return: 2D numpy array
         """
         if calibration is not None:
             checkdatatypes.check_type('Instrument geometry calibrated shift', calibration,
                                       instrument_geometry.AnglerCameraDetectorShift)
 
-        self._instrument.build_instrument(self._detector_2theta, self._detector_l2,
-                                          instrument_calibration=calibration)
+        geometry_key = self.generate_geometry_key(self._detector_2theta, self._detector_l2, calibration)
+        cached_angles = PIXEL_GEOMETRY_CACHE.get(geometry_key) if use_cache else None
+
+        if cached_angles is None:
+            self._instrument.build_instrument(self._detector_2theta, self._detector_l2,
+                                              instrument_calibration=calibration)
+            if use_cache:
+                PIXEL_GEOMETRY_CACHE.add(geometry_key, self._instrument.get_pixels_2theta(2),
+                                         self._instrument.get_eta_values(2))
+        else:
+            # pixels' positions are calculated only if they are requested
+            self._instrument.set_pixel_angles(cached_angles[0], cached_angles[1], self._detector_2theta,
+                                              self._detector_l2, calibration)
+
+        self._geometry_key = geometry_key
+        self._calibration = calibration
+        self._binning_plan = None
 
         return
 
+    def calculate_2theta_deviation(self):
+        """Calculate the maximum deviation of pixels' 2theta from the ones calculated in double precision
+
+        It is a self-check of the single precision geometry, which is supposed to be well below 2theta bin width
+
+        Returns
+        -------
+        float
+            maximum absolute deviation of pixels' 2theta in degree
+        """
+        if self._geometry_key is None:
+            raise RuntimeError('Instrument must be built by build_instrument before checking its precision')
+
+        reference_instrument = ResidualStressInstrument(self._instrument_setup)
+        reference_instrument.build_instrument(self._detector_2theta, self._detector_l2, self._calibration)
+        deviation_array = self._instrument.get_pixels_2theta(1) - reference_instrument.get_pixels_2theta(1)
+
+        return float(np.max(np.abs(deviation_array)))
+
     def build_instrument_prototype(self, two_theta, arm_length, arm_length_shift, center_shift_x, center_shift_y,
                                    rot_x_flip, rot_y_flip, rot_z_spin):
         """
@@ -464,6 +1442,8 @@ class PyHB2BReduction(object):
 
         self._instrument.build_instrument(two_theta=two_theta, l2=arm_length,
                                           instrument_calibration=calibration)
+        self._geometry_key = None
+        self._binning_plan = None
 
         return
 
@@ -475,6 +1455,8 @@ class PyHB2BReduction(object):
         """
         print('[INFO] Rotating: 2theta from {} to {}'.format(two_theta_0, two_theta_1))
         self._instrument.rotate_detector(two_theta_1 - two_theta_0)
+        self._geometry_key = None
+        self._binning_plan = None
 
         return
 
@@ -562,44 +1544,126 @@ class PyHB2BReduction(object):
                                           [pixel_2theta_array, self._detector_counts], 1,
                                           check_same_shape=True)  # optional check
 
-        # Convert vector counts array's dtype to float
-        counts_array = self._detector_counts.astype('float64')
+        # Histogram with the pixel to bin matrix: mask, vanadium and 2theta range are folded in it
+        binning_plan = self.get_binning_plan(two_theta_bins, mask_array, vanadium_counts_array)
+        self._reduced_diffraction_data = binning_plan.histogram(self._detector_counts, is_point_data)
 
-        # print('[INFO] PyRS.Instrument: pixels 2theta range: ({}, {}) vs 2theta histogram range: ({}, {})'
-        #       ''.format(pixel_2theta_array.min(), pixel_2theta_array.max(), two_theta_bins.min(),
-        #                 two_theta_bins.max()))
+        return self._reduced_diffraction_data
 
-        # Apply mask: act on local variable vec_counts and thus won't affect raw data
-        if mask_array is not None:
-            # mask detector counts, assuming detector mask and counts are in same order of pixel
-            checkdatatypes.check_numpy_arrays('Counts vector and mask vector',
-                                              [counts_array, mask_array], 1, True)
-            # exclude mask from histogramming
-            counts_array = counts_array[np.where(mask_array == 1)]
-            pixel_2theta_array = pixel_2theta_array[np.where(mask_array == 1)]
-            if vanadium_counts_array is not None:
-                vanadium_counts_array = vanadium_counts_array[np.where(mask_array == 1)]
-        else:
-            # no mask: do nothing
-            pass
-        # END-IF-ELSE
+    def reduce_sub_runs_to_2theta_histogram(self, counts_matrix, two_theta_bins, mask_array,
+                                            is_point_data=True, vanadium_counts_array=None):
+        """Reduce detector counts of multiple sub runs to 2theta histograms in one shot
 
-        # Histogram:
-        # NOTE: input 2theta_range may not be accurate because 2theta max may not be on the full 2-theta tick
-        # TODO - If use vanadium for normalization, then (1) flag to normalize by pixel count and (2) efficiency
-        #        are not required anymore but both of them will be replaced by integrated vanadium counts
+        All the sub runs shall be measured at the detector position of the instrument built
 
-        # use numpy.histogram
-        two_theta_bins, intensity_vector, variances_vector = self.histogram_by_numpy(pixel_2theta_array,
-                                                                                     counts_array,
-                                                                                     two_theta_bins,
-                                                                                     is_point_data,
-                                                                                     vanadium_counts_array)
+        Parameters
+        ----------
+        counts_matrix : numpy.ndarray
+            detector counts with shape (number of sub runs, number of pixels)
+        two_theta_bins : numpy.ndarray
+            2theta bin boundaries to binned to
+        mask_array : numpy.ndarray or None
+            mask: 1 to keep, 0 to mask (exclude)
+        is_point_data : bool
+            Flag whether the output is point data (numbers of X and Y are same)
+        vanadium_counts_array : None or numpy.ndarray
+            Vanadium counts array for normalization and efficiency calibration
 
-        # Record
-        self._reduced_diffraction_data = two_theta_bins, intensity_vector, variances_vector
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            2theta vector, intensity matrix, and variances matrix.  Matrices are of shape
+            (number of sub runs, number of 2theta)
+
+        """
+        return self.reduce_sub_runs_to_histogram(counts_matrix, two_theta_bins, mask_array, is_point_data,
+                                                 vanadium_counts_array)
+
+    def reduce_sub_runs_to_histogram(self, counts_matrix, bin_edges, mask_array, is_point_data=True,
+                                     vanadium_counts_array=None, unit='2theta', wave_length=None):
+        """Reduce detector counts of multiple sub runs to 2theta, d-spacing or Q histograms in one shot
+
+        Pixels' d-spacing or Q are converted from 2theta once for the instrument built and the wave length.
+        The sub runs reduced to the same d-spacing (or Q) bins from different detector positions can be
+        merged directly.
+
+        Parameters
+        ----------
+        counts_matrix : numpy.ndarray
+            detector counts with shape (number of sub runs, number of pixels)
+        bin_edges : numpy.ndarray
+            bin boundaries in the unit
+        mask_array : numpy.ndarray or None
+            mask: 1 to keep, 0 to mask (exclude)
+        is_point_data : bool
+            Flag whether the output is point data (numbers of X and Y are same)
+        vanadium_counts_array : None or numpy.ndarray
+            Vanadium counts array for normalization and efficiency calibration
+        unit : str
+            unit in BINNING_UNITS: 2theta (degree), dSpacing (Angstrom) or Q (1/Angstrom)
+        wave_length : float or None
+            wave length in Angstrom for d-spacing and Q.  None for the wave length of the engine
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            bin vector, intensity matrix, and variances matrix.  Matrices are of shape
+            (number of sub runs, number of bins)
+
+        """
+        checkdatatypes.check_numpy_arrays('Bin edges', [bin_edges], 1, False)
+        checkdatatypes.check_numpy_arrays('Detector counts matrix', [counts_matrix], 2, False)
+        pixel_2theta_array = self._instrument.get_pixels_2theta(1)
+        if counts_matrix.shape[1] != pixel_2theta_array.shape[0]:
+            raise RuntimeError('Detector counts matrix with shape {} does not match {} pixels'
+                               ''.format(counts_matrix.shape, pixel_2theta_array.shape[0]))
 
-        return two_theta_bins, intensity_vector, variances_vector
+        binning_plan = self.get_binning_plan(bin_edges, mask_array, vanadium_counts_array, unit=unit,
+                                             wave_length=wave_length)
+
+        return binning_plan.histogram(counts_matrix, is_point_data)
+
+    def get_binning_plan(self, two_theta_bins, mask_array, vanadium_counts_array, vanadium_histogram=None,
+                         unit='2theta', wave_length=None):
+        """Get the pixel to bin plan of the instrument built
+
+        The plan is rebuilt only if the instrument is rebuilt or bins, mask, vanadium or unit are changed
+
+        Parameters
+        ----------
+        two_theta_bins : numpy.ndarray
+            bin boundaries (in the unit) to binned to
+        mask_array : numpy.ndarray or None
+            mask: 1 to keep, 0 to mask (exclude)
+        vanadium_counts_array : None or numpy.ndarray
+            Vanadium counts array for normalization and efficiency calibration
+        vanadium_histogram : tuple or None
+            histogrammed vanadium and its variances of a previous plan with the same instrument, bins, mask,
+            vanadium and unit.  It is used only if the plan is rebuilt
+        unit : str
+            unit in BINNING_UNITS
+        wave_length : float or None
+            wave length in Angstrom for d-spacing and Q.  None for the wave length of the engine
+
+        Returns
+        -------
+        PixelBinningPlan
+            pixel to bin plan
+        """
+        if self._binning_plan is None or self._binning_unit != (unit, wave_length) or \
+                not self._binning_plan.is_compatible(two_theta_bins, mask_array, vanadium_counts_array):
+            if self._pixel_splitting:
+                min_x_array, max_x_array = self._instrument.get_pixels_footprint(unit, wave_length)
+                self._binning_plan = PixelSplittingBinningPlan(min_x_array, max_x_array, two_theta_bins,
+                                                               mask_array, vanadium_counts_array,
+                                                               vanadium_histogram)
+            else:
+                self._binning_plan = PixelBinningPlan(self._instrument.get_pixels_values(unit, wave_length),
+                                                      two_theta_bins, mask_array, vanadium_counts_array,
+                                                      vanadium_histogram)
+            self._binning_unit = unit, wave_length
+
+        return self._binning_plan
 
     def set_experimental_data(self, two_theta, l2, raw_count_vec):
         """ Set experimental data (for a sub-run)
@@ -631,7 +1695,12 @@ class PyHB2BReduction(object):
 
     @staticmethod
     def histogram_by_numpy(pixel_2theta_array, pixel_count_array, two_theta_bins, is_point_data, vanadium_counts):
-        """Histogram a data set (X, Y) by numpy histogram algorithm
+        """Histogram a data set (X, Y) with the same bin convention as numpy histogram
+
+        Pixels' bins are located once and counts, vanadium and their variances are accumulated by numpy bincount
+
+        Reduction histograms with PixelBinningPlan instead.  This plain numpy implementation is kept as the
+        reference which PixelBinningPlan is verified against
 
         Assumption:
         1. pixel_2theta_array[i] and vec_counts[i] correspond to the same detector pixel
@@ -657,49 +1726,41 @@ class PyHB2BReduction(object):
         checkdatatypes.check_numpy_arrays('Pixel 2theta array, pixel counts array',
                                           [pixel_2theta_array, pixel_count_array],
                                           1, True)
+        if vanadium_counts is not None:
+            checkdatatypes.check_numpy_arrays('Vanadium counts', [vanadium_counts], 1, False)
+
+        # Locate pixels' 2theta bins once for counts, vanadium and their variances
+        num_bins = two_theta_bins.shape[0] - 1
+        bin_index_array = locate_bins(pixel_2theta_array, two_theta_bins)
 
-        # Exclude pixels with no vanadium counts
+        # Exclude pixels out of range, with NaN or infinity counts, and with no vanadium counts
+        valid_pixels = (bin_index_array >= 0) & (bin_index_array < num_bins)
+        valid_pixels &= np.isfinite(pixel_count_array)
         if vanadium_counts is not None:
-            vandium_mask = vanadium_counts < 0.9
-            pixel_2theta_array = np.ma.masked_where(vandium_mask, pixel_2theta_array)
-            pixel_count_array = np.ma.masked_where(vandium_mask, pixel_count_array)
-            vanadium_counts = np.ma.masked_where(vandium_mask, vanadium_counts)
-
-        # Exclude NaN and infinity regions
-        masked_pixels = (np.isnan(pixel_count_array)) | (np.isinf(pixel_count_array))
-        pixel_2theta_array = np.ma.masked_where(masked_pixels, pixel_2theta_array).compressed()
-        pixel_count_array = np.ma.masked_where(masked_pixels, pixel_count_array).compressed()
-
-        # construct variance array
-        pixel_var_array = np.sqrt(pixel_count_array)
-        pixel_var_array[pixel_var_array == 0.0] = 1.
-
-        # Call numpy to histogram raw counts and variance
-        hist, bin_edges = np.histogram(pixel_2theta_array, bins=two_theta_bins, weights=pixel_count_array)
-        var, var_edges = np.histogram(pixel_2theta_array, bins=two_theta_bins, weights=pixel_var_array**2)
+            valid_pixels &= np.logical_not(vanadium_counts < 0.9)
+        bin_index_array = bin_index_array[valid_pixels]
+        pixel_count_array = pixel_count_array[valid_pixels]
+
+        # Histogram raw counts and variance: variance of pixel with zero count is 1
+        hist = np.bincount(bin_index_array, weights=pixel_count_array, minlength=num_bins)
+        var = np.bincount(bin_index_array, weights=np.where(pixel_count_array == 0, 1., pixel_count_array),
+                          minlength=num_bins)
         var = np.sqrt(var)
+        bin_edges = two_theta_bins
 
         # Optionally to normalize by number of pixels (sampling points) in the 2theta bin
         if vanadium_counts is not None:
             # Normalize by vanadium including efficiency calibration
-            checkdatatypes.check_numpy_arrays('Vanadium counts', [vanadium_counts], 1, False)
-
-            # Exclude NaN and infinity regions
-            vanadium_counts = np.ma.masked_where(masked_pixels, vanadium_counts).compressed()
-
-            # construct variance array
-            vanadium_var = np.sqrt(vanadium_counts)
-            vanadium_var[vanadium_var == 0.0] = 1.
+            vanadium_counts = vanadium_counts[valid_pixels]
 
-            # Call numpy to histogram vanadium counts and variance
-            hist_bin, be_temp = np.histogram(pixel_2theta_array, bins=two_theta_bins, weights=vanadium_counts)
-            van_var, van_var_temp = np.histogram(pixel_2theta_array, bins=two_theta_bins, weights=vanadium_var**2)
+            # Histogram vanadium counts and variance
+            hist_bin = np.bincount(bin_index_array, weights=vanadium_counts, minlength=num_bins)
+            van_var = np.bincount(bin_index_array, weights=np.where(vanadium_counts == 0, 1., vanadium_counts),
+                                  minlength=num_bins)
             van_var = np.sqrt(van_var)
 
             # Find out the bin where there is either no vanadium count or no pixel's located
             # Mask these bins by NaN
-            # make sure it is float
-            hist_bin = hist_bin.astype(float)
             hist_bin[np.where(hist_bin < 1E-10)] = np.nan
 
             # propogation of error
@@ -1,5 +1,8 @@
 # Reduction engine including slicing
 from __future__ import (absolute_import, division, print_function)  # python3 compatibility
+from collections import OrderedDict
+import hashlib
+import multiprocessing
 import os
 import numpy as np
 from pyrs.core import workspaces
@@ -12,6 +15,61 @@ from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode
 from pyrs.utilities import calibration_file_io
 from pyrs.utilities import checkdatatypes
 
+# reduction manager, workspace and arguments of a worker process reducing sub runs: set by the pool initializer
+_WORKER_REDUCTION_ARGS = None
+# maximum number of vanadium histograms cached by a reduction manager
+MAX_VANADIUM_HISTOGRAMS = 64
+# maximum number of pixels' ranges cached by a reduction manager
+MAX_PIXEL_RANGES = 1024
+
+
+def _update_hash(hash_obj, array):
+    """Update a hash object with the content (including dtype and shape) of an array or None
+    """
+    if array is None:
+        hash_obj.update(b'None')
+    else:
+        array = np.ascontiguousarray(array)
+        hash_obj.update(repr((array.dtype.str, array.shape)).encode())
+        hash_obj.update(array)
+
+
+def _mask_digest(mask_vec):
+    """Digest of the pixels kept (mask value 1) by a mask or None
+
+    The kept pixels are packed to bits, which is much cheaper to hash than the mask itself
+    """
+    if mask_vec is None:
+        return None
+
+    return hashlib.sha1(np.packbits(mask_vec == 1)).hexdigest()
+
+
+def _init_reduction_worker(reduction_manager, workspace, reduction_args, batch_size):
+    """Set the reduction manager, workspace and arguments for the sub runs reduced in this worker process"""
+    global _WORKER_REDUCTION_ARGS
+    _WORKER_REDUCTION_ARGS = reduction_manager, workspace, reduction_args, batch_size
+
+
+def _reduce_sub_runs_in_worker(chunk_tuple):
+    """Reduce a chunk of sub runs in a forked worker process
+
+    Parameters
+    ----------
+    chunk_tuple : tuple
+        sub runs and flag to check single precision geometry
+
+    Returns
+    -------
+    list
+        sub runs, 2theta bin centers, intensities and variances of each batch
+    """
+    reduction_manager, workspace, reduction_args, batch_size = _WORKER_REDUCTION_ARGS
+    sub_runs, check_precision = chunk_tuple
+
+    return list(reduction_manager._reduce_sub_runs_batches(workspace, sub_runs, batch_size=batch_size,
+                                                           check_precision=check_precision, **reduction_args))
+
 
 class HB2BReductionManager(object):
     """
@@ -36,6 +94,17 @@ class HB2BReductionManager(object):
 
         # Reduction engine
         self._last_reduction_engine = None
+        # texture (eta wedges) binning plan and its key
+        self._texture_binning_plan = None
+        # [geometry key, pixel splitting, digest of bins, mask and vanadium] = vanadium histogram and variances
+        self._vanadium_histogram_dict = OrderedDict()
+        # [geometry key, unit, wave length, digest of mask] = minimum and maximum of (unmasked) pixels
+        self._pixel_range_dict = OrderedDict()
+        # split pixels' counts to overlapped 2theta bins
+        self._pixel_splitting = False
+        # single precision instrument geometry and the maximum pixels' 2theta deviation allowed in unit of bin width
+        self._use_float32_geometry = False
+        self._max_2theta_deviation = 0.01
 
         # Vanadium
         self._van_ws = None
@@ -59,6 +128,59 @@ class HB2BReductionManager(object):
 
         return ws_name
 
+    def set_float32_geometry(self, use_float32, max_2theta_deviation=0.01):
+        """Set whether instrument geometry is calculated in single precision
+
+        Single precision geometry is checked against double precision once per reduction.  A warning is
+        issued if pixels' 2theta deviate more than the allowed fraction of 2theta bin width.
+
+        Parameters
+        ----------
+        use_float32 : bool
+            flag to calculate pixels' positions, 2theta and eta in single precision
+        max_2theta_deviation : float
+            maximum allowed deviation of pixels' 2theta in unit of 2theta bin width
+        """
+        checkdatatypes.check_bool_variable('Flag to use float32 geometry', use_float32)
+        checkdatatypes.check_float_variable('Maximum 2theta deviation', max_2theta_deviation, (0., None))
+
+        self._use_float32_geometry = use_float32
+        self._max_2theta_deviation = max_2theta_deviation
+
+    def set_pixel_splitting(self, pixel_splitting):
+        """Set whether each pixel's counts are split to the 2theta bins overlapped by the pixel
+
+        Pixel splitting is not applied to out-of-plane (texture) reduction
+
+        Parameters
+        ----------
+        pixel_splitting : bool
+            flag to split pixels.  Otherwise, pixel's counts are assigned to the bin of pixel's center
+        """
+        checkdatatypes.check_bool_variable('Flag to split pixels', pixel_splitting)
+        self._pixel_splitting = pixel_splitting
+
+    def _check_geometry_precision(self, reduction_engine, two_theta_bins):
+        """Report maximum deviation of single precision pixels' 2theta comparing to bin width
+
+        Returns
+        -------
+        float
+            maximum deviation of pixels' 2theta in unit of bin width
+        """
+        deviation = reduction_engine.calculate_2theta_deviation()
+        bin_width = np.min(two_theta_bins[1:] - two_theta_bins[:-1])
+        relative_deviation = deviation / bin_width
+
+        if relative_deviation > self._max_2theta_deviation:
+            print('[WARNING] Float32 geometry: maximum 2theta deviation {:.3g} degree is {:.3g} of bin width, '
+                  'larger than allowed {}'.format(deviation, relative_deviation, self._max_2theta_deviation))
+        else:
+            print('[INFO] Float32 geometry: maximum 2theta deviation {:.3g} degree ({:.3g} of bin width)'
+                  ''.format(deviation, relative_deviation))
+
+        return relative_deviation
+
     def get_last_reduction_engine(self):
         """
         Get the reduction engine recently used
@@ -404,15 +526,24 @@ class HB2BReductionManager(object):
 
             if normalized:
                 van_duration = self._van_ws.get_sample_log_value(HidraConstants.SUB_RUN_DURATION, sub_run)
-                van_counts_array /= van_duration
+                van_counts_array = van_counts_array / van_duration
 
         return van_counts_array
 
     def reduce_diffraction_data(self, session_name, apply_calibrated_geometry, num_bins, sub_run_list,
                                 mask, mask_id, vanadium_counts=None, van_duration=None, normalize_by_duration=True,
-                                eta_step=None, eta_min=None, eta_max=None):
+                                eta_step=None, eta_min=None, eta_max=None, workers=1, lazy=False,
+                                shared_bins=False):
         """Reduce ALL sub runs in a workspace from detector counts to diffraction data
 
+        In lazy mode, the sub runs are not reduced here but registered to the workspace.  Each of them is then
+        reduced (once) when its diffraction data is requested from the workspace, reusing the reduction engine
+        and the cached pixel geometry
+
+        Reduction is incremental: a sub run is not reduced again if the fingerprint of its reduction inputs
+        (counts, detector position, calibration, mask, bins and vanadium) matches the one recorded to the
+        workspace (or loaded from project file) with the reduced data
+
         Parameters
         ----------
         session_name
@@ -436,6 +567,13 @@ class HB2BReductionManager(object):
             min angle for out-of-plane reduction
         eta_max : float
             max angle for out-of-plane reduction
+        workers : int
+            number of processes to reduce sub runs (not applied to out-of-plane reduction)
+        lazy : bool
+            flag to reduce each sub run on demand (not applied to out-of-plane reduction)
+        shared_bins : bool
+            flag to reduce all the sub runs to the same 2theta bins covering all the detector positions,
+            such that 2theta of reduced data is a single vector (not applied to out-of-plane reduction)
 
         Returns
         -------
@@ -485,6 +623,53 @@ class HB2BReductionManager(object):
                                ''.format(workspace, HidraConstants.SUB_RUN_DURATION,
                                          workspace.get_sample_log_names()))
 
+        if eta_step is None:
+            # Reset workspace's 2theta matrix and intensities if the number of bins is changed
+            if workspace.get_num_2theta_bins() != num_bins:
+                workspace.reset_diffraction_data()
+            # Sub runs pending from an earlier lazy reduction with this mask are reduced from the inputs here
+            workspace.discard_pending_sub_runs(mask_id, sub_run_list)
+
+            # 2theta range of bins common to all sub runs or default to each detector position's
+            if shared_bins:
+                min_2theta, max_2theta = self.get_shared_2theta_range(workspace, sub_run_list, det_pos_shift,
+                                                                      mask_vec)
+            else:
+                min_2theta = max_2theta = None
+
+            # Skip the sub runs reduced from the same inputs
+            fingerprint_dict = dict(zip(sub_run_list,
+                                        self.generate_reduction_fingerprints(workspace, sub_run_list, det_pos_shift,
+                                                                             mask_vec, min_2theta=min_2theta,
+                                                                             max_2theta=max_2theta,
+                                                                             num_bins=num_bins,
+                                                                             vanadium_counts=vanadium_counts,
+                                                                             van_duration=van_duration)))
+            sub_run_list = [sub_run for sub_run in sub_run_list
+                            if workspace.get_reduction_fingerprint(sub_run, mask_id) != fingerprint_dict[sub_run]]
+
+            def reduce_sub_runs(sub_runs, num_workers=1):
+                # reduce sub runs: the ones at the same detector position are reduced together
+                self.reduce_sub_runs_diffraction(workspace, sub_runs, det_pos_shift,
+                                                 mask_vec_tuple=(mask_id, mask_vec),
+                                                 min_2theta=min_2theta,
+                                                 max_2theta=max_2theta,
+                                                 num_bins=num_bins,
+                                                 vanadium_counts=vanadium_counts,
+                                                 van_duration=van_duration,
+                                                 workers=num_workers)
+                for sub_run_i in sub_runs:
+                    workspace.set_reduction_fingerprint(sub_run_i, mask_id, fingerprint_dict[sub_run_i])
+
+            if len(sub_run_list) == 0:
+                print('[INFO] All sub runs have been reduced from the same inputs')
+            elif lazy:
+                # reduce sub runs on demand
+                workspace.set_pending_reduction(mask_id, sub_run_list, reduce_sub_runs)
+            else:
+                reduce_sub_runs(sub_run_list, workers)
+            return
+
         # Reset workspace's 2theta matrix and intensities
         workspace.reset_diffraction_data()
 
@@ -497,34 +682,85 @@ class HB2BReductionManager(object):
                 # not normalized
                 duration_i = 1.
 
-            if eta_step is None:
-                # reduce sub run
-                self.reduce_sub_run_diffraction(workspace, sub_run, det_pos_shift,
-                                                mask_vec_tuple=(mask_id, mask_vec),
-                                                num_bins=num_bins,
-                                                sub_run_duration=duration_i,
-                                                vanadium_counts=vanadium_counts,
-                                                van_duration=van_duration)
-            else:
-                # reduce sub run texture
-                self.reduce_sub_run_texture(workspace, sub_run, det_pos_shift,
-                                            mask_vec_tuple=(mask_id, mask_vec),
-                                            num_bins=num_bins,
-                                            sub_run_duration=duration_i,
-                                            vanadium_counts=vanadium_counts,
-                                            van_duration=van_duration,
-                                            eta_step=eta_step,
-                                            eta_min=eta_min,
-                                            eta_max=eta_max)
-
-            # END-IF (texture)
-
+            # reduce sub run texture
+            self.reduce_sub_run_texture(workspace, sub_run, det_pos_shift,
+                                        mask_vec_tuple=(mask_id, mask_vec),
+                                        num_bins=num_bins,
+                                        sub_run_duration=duration_i,
+                                        vanadium_counts=vanadium_counts,
+                                        van_duration=van_duration,
+                                        eta_step=eta_step,
+                                        eta_min=eta_min,
+                                        eta_max=eta_max)
         # END-FOR (sub run)
 
+    def generate_reduction_fingerprints(self, workspace, sub_runs, geometry_calibration, mask_vec,
+                                        min_2theta=None, max_2theta=None, num_bins=1000,
+                                        vanadium_counts=None, van_duration=None):
+        """Generate the fingerprint of each sub run's inputs to reduce to 2-theta ~ I
+
+        The fingerprint is the SHA-1 digest of the sub run's counts, the pixel geometry key of the detector
+        position, the mask, the 2theta bins, vanadium and the reduction options of this manager
+
+        Parameters
+        ----------
+        workspace : HidraWorkspace
+            workspace with detector counts and position
+        sub_runs : list or numpy.ndarray
+            sub run numbers in workspace
+        geometry_calibration : instrument_geometry.AnglerCameraDetectorShift or None
+            instrument geometry to calculate diffraction pattern
+        mask_vec : numpy.ndarray or None
+            1D array for masking (1 to keep, 0 to mask out)
+        min_2theta : float or None
+            min 2theta
+        max_2theta : float or None
+            max 2theta
+        num_bins : int
+            number of bins
+        vanadium_counts : numpy.ndarray or None
+            detector pixels' vanadium for efficiency and normalization
+        van_duration : float or None
+            vanadium duration in seconds
+
+        Returns
+        -------
+        list
+            fingerprint (hex string) of each sub run
+
+        """
+        # inputs shared by all the sub runs
+        common_hash = hashlib.sha1()
+        common_hash.update(repr((min_2theta, max_2theta, num_bins, van_duration,
+                                 self._pixel_splitting)).encode())
+        _update_hash(common_hash, mask_vec)
+        _update_hash(common_hash, vanadium_counts)
+
+        instrument_setup = workspace.get_instrument_setup()
+        fingerprint_list = list()
+        for sub_run in sub_runs:
+            # detector position in PyRS convention as the reduction engine
+            geometry_key = reduce_hb2b_pyrs.PIXEL_GEOMETRY_CACHE.generate_key(instrument_setup,
+                                                                              -workspace.get_detector_2theta(sub_run),
+                                                                              workspace.get_l2(sub_run),
+                                                                              geometry_calibration, None,
+                                                                              self._use_float32_geometry)
+            counts = np.ascontiguousarray(workspace.get_detector_counts(sub_run))
+
+            sub_run_hash = common_hash.copy()
+            sub_run_hash.update(repr((geometry_key, counts.dtype.str, counts.shape)).encode())
+            sub_run_hash.update(counts)
+            fingerprint_list.append(sub_run_hash.hexdigest())
+
+        return fingerprint_list
+
     def setup_reduction_engine(self, workspace, sub_run, geometry_calibration):
         """Setup reduction engine to reduce data (workspace or vector) to 2-theta ~ I
 
-        Builds a new 2theta pixel map if none is present or if the detector has moved
+        Reuses the last reduction engine if the detector is at the same position.  Otherwise, the instrument
+        is rebuilt, whose pixels' 2theta map is taken from the process-wide pixel geometry cache if the detector
+        position has been visited before (in any session).  An engine with the same detector setup is reused
+        for rebuilding such that only 2theta rotation is applied if L2 and calibration are not changed
 
         Parameters
         ----------
@@ -548,27 +784,473 @@ class HB2BReductionManager(object):
         two_theta = workspace.get_detector_2theta(sub_run)
         l2 = workspace.get_l2(sub_run)
 
-        if sub_run > 1:
-            rebuild_instrument = two_theta != workspace.get_detector_2theta(sub_run - 1)
-        else:
-            rebuild_instrument = True
-
         # Convert 2-theta from DAS convention to Mantid/PyRS convention
         mantid_two_theta = -two_theta
 
-        # Set up reduction engine and also
+        # Reuse the last reduction engine if detector setup and precision are not changed
+        reduction_engine = self._last_reduction_engine
+        if reduction_engine is None or reduction_engine.instrument_setup is not workspace.get_instrument_setup() \
+                or reduction_engine.instrument.use_float32 != self._use_float32_geometry \
+                or reduction_engine.pixel_splitting != self._pixel_splitting:
+            reduction_engine = reduce_hb2b_pyrs.PyHB2BReduction(workspace.get_instrument_setup(),
+                                                                use_float32=self._use_float32_geometry,
+                                                                pixel_splitting=self._pixel_splitting)
+            rebuild_instrument = True
+        else:
+            geometry_key = reduction_engine.generate_geometry_key(mantid_two_theta, l2, geometry_calibration)
+            rebuild_instrument = geometry_key != reduction_engine.geometry_key
+
+        # Set up reduction engine and also rebuild instrument if detector moves
         if not rebuild_instrument:
-            reduction_engine = self._last_reduction_engine
             reduction_engine.set_raw_counts(raw_count_vec)
         else:
-            reduction_engine = reduce_hb2b_pyrs.PyHB2BReduction(workspace.get_instrument_setup())
-
-            # Set up reduction engine
             reduction_engine.set_experimental_data(mantid_two_theta, l2, raw_count_vec)
             reduction_engine.build_instrument(geometry_calibration)
 
         return reduction_engine
 
+    @staticmethod
+    def _group_sub_runs_by_detector_position(workspace, sub_runs):
+        """Group sub runs by detector position (2theta and L2)
+
+        Returns
+        -------
+        list
+            list of sub run lists.  Sub runs in each list share the same detector position
+        """
+        position_dict = OrderedDict()
+        for sub_run in sub_runs:
+            position = workspace.get_detector_2theta(sub_run), workspace.get_l2(sub_run)
+            position_dict.setdefault(position, list()).append(sub_run)
+
+        return list(position_dict.values())
+
+    def reduce_sub_runs_diffraction(self, workspace, sub_runs, geometry_calibration, mask_vec_tuple,
+                                    min_2theta=None, max_2theta=None, num_bins=1000,
+                                    vanadium_counts=None, van_duration=None, batch_size=16, workers=1):
+        """Reduce multiple sub runs from detector counts to 2-theta ~ I
+
+        Sub runs at the same detector position share the instrument geometry and 2theta bins.  Their counts
+        are stacked to a (number of sub runs, number of pixels) matrix and histogrammed in one shot.
+
+        With multiple workers, sub runs are distributed to a pool of forked processes, which inherit the
+        workspace's counts from this process instead of receiving pickled copies.  Reduced data are merged
+        to the workspace in the same order as reducing serially.
+
+        Parameters
+        ----------
+        workspace : HidraWorkspace
+            workspace with detector counts and position
+        sub_runs : list or numpy.ndarray
+            sub run numbers in workspace to reduce
+        geometry_calibration : instrument_geometry.AnglerCameraDetectorShift
+            instrument geometry to calculate diffraction pattern
+        mask_vec_tuple : tuple (str, numpy.ndarray)
+            mask ID and 1D array for masking (1 to keep, 0 to mask out)
+        min_2theta : float or None
+            min 2theta
+        max_2theta : float or None
+            max 2theta
+        num_bins : int
+            number of bins
+        vanadium_counts : numpy.ndarray or None
+            detector pixels' vanadium for efficiency and normalization.
+            If vanadium duration is recorded, the vanadium counts are normalized by its duration in seconds
+        van_duration : float or None
+            vanadium duration in seconds
+        batch_size : int
+            maximum number of sub runs to histogram in one shot, which limits the memory of stacked counts
+        workers : int
+            number of processes to reduce sub runs.  1 for reducing in this process
+
+        Returns
+        -------
+        None
+
+        """
+        checkdatatypes.check_int_variable('Batch size', batch_size, (1, None))
+        checkdatatypes.check_int_variable('Number of workers', workers, (1, None))
+        mask_id, mask_vec = mask_vec_tuple
+        reduction_args = {'geometry_calibration': geometry_calibration, 'mask_vec': mask_vec,
+                          'min_2theta': min_2theta, 'max_2theta': max_2theta, 'num_bins': num_bins,
+                          'vanadium_counts': vanadium_counts, 'van_duration': van_duration}
+
+        if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            print('[WARNING] Sub runs are reduced serially: process pool requires fork start method')
+            workers = 1
+
+        if workers == 1:
+            data_sets = self._reduce_sub_runs_batches(workspace, sub_runs, batch_size=batch_size,
+                                                      check_precision=True, **reduction_args)
+        else:
+            data_sets = self._reduce_sub_runs_in_pool(workspace, sub_runs, reduction_args, batch_size, workers)
+
+        # record
+        for batch_sub_runs, bin_centers, hist, variances in data_sets:
+            workspace.set_reduced_diffraction_data_set(batch_sub_runs, mask_id, bin_centers, hist, variances)
+
+    def _reduce_sub_runs_batches(self, workspace, sub_runs, geometry_calibration, mask_vec, min_2theta,
+                                 max_2theta, num_bins, vanadium_counts, van_duration, batch_size, check_precision,
+                                 unit='2theta', wave_length=None, bin_edges=None):
+        """Reduce sub runs in batches of the same detector position
+
+        Bins are generated for each detector position from the range of (unmasked) pixels unless bin edges
+        common to all the positions are given
+
+        Returns
+        -------
+        generator
+            sub runs, bin centers, intensities and variances (2D arrays) of each batch
+        """
+        precision_checked = not (check_precision and self._use_float32_geometry and unit == '2theta')
+
+        # digest of mask and vanadium to look up pixels' ranges and vanadium histograms
+        mask_digest = _mask_digest(mask_vec)
+        vanadium_hash = hashlib.sha1()
+        if vanadium_counts is not None:
+            _update_hash(vanadium_hash, mask_vec)
+            _update_hash(vanadium_hash, vanadium_counts)
+
+        for position_sub_runs in self._group_sub_runs_by_detector_position(workspace, sub_runs):
+            # Set up reduction engine with the first sub run: instrument is built once for all
+            reduction_engine = self.setup_reduction_engine(workspace, position_sub_runs[0], geometry_calibration)
+            self._last_reduction_engine = reduction_engine
+            if bin_edges is None:
+                bin_boundaries_2theta = self._generate_bin_edges(reduction_engine, min_2theta, num_bins,
+                                                                 max_2theta, mask_vec, mask_digest, unit,
+                                                                 wave_length)
+            else:
+                bin_boundaries_2theta = bin_edges
+
+            # self-check single precision geometry with the first detector position
+            if not precision_checked:
+                self._check_geometry_precision(reduction_engine, bin_boundaries_2theta)
+                precision_checked = True
+
+            # set up binning plan with the cached vanadium histogram
+            self._get_binning_plan(reduction_engine, bin_boundaries_2theta, mask_vec, vanadium_counts,
+                                   vanadium_hash, unit, wave_length)
+
+            for start_index in range(0, len(position_sub_runs), batch_size):
+                batch_sub_runs = position_sub_runs[start_index:start_index + batch_size]
+                counts_matrix = np.array([workspace.get_detector_counts(sub_run) for sub_run in batch_sub_runs])
+
+                # Histogram
+                data_set = reduction_engine.reduce_sub_runs_to_histogram(counts_matrix,
+                                                                         bin_boundaries_2theta,
+                                                                         mask_array=mask_vec,
+                                                                         is_point_data=True,
+                                                                         vanadium_counts_array=vanadium_counts,
+                                                                         unit=unit, wave_length=wave_length)
+                bin_centers, hist, variances = data_set
+                del counts_matrix
+
+                if van_duration is not None:
+                    hist *= van_duration
+                    variances *= van_duration
+
+                yield batch_sub_runs, bin_centers, hist, variances
+
+    def _get_binning_plan(self, reduction_engine, bin_edges, mask_vec, vanadium_counts, vanadium_hash,
+                          unit='2theta', wave_length=None):
+        """Get the binning plan of a reduction engine
+
+        Vanadium is histogrammed once for each detector geometry, bins, mask and vanadium.  The histograms are
+        cached such that a plan rebuilt for a revisited detector position divides by the cached vanadium
+        histogram instead of histogramming vanadium again
+
+        Returns
+        -------
+        ~pyrs.core.reduce_hb2b_pyrs.PixelBinningPlan
+            binning plan
+        """
+        if vanadium_counts is None:
+            return reduction_engine.get_binning_plan(bin_edges, mask_vec, None, unit=unit, wave_length=wave_length)
+
+        bins_hash = vanadium_hash.copy()
+        _update_hash(bins_hash, bin_edges)
+        van_key = (reduction_engine.geometry_key, reduction_engine.pixel_splitting, unit, wave_length,
+                   bins_hash.hexdigest())
+
+        # least recently used is removed
+        vanadium_histogram = self._vanadium_histogram_dict.pop(van_key, None)
+        binning_plan = reduction_engine.get_binning_plan(bin_edges, mask_vec, vanadium_counts, vanadium_histogram,
+                                                         unit=unit, wave_length=wave_length)
+        self._vanadium_histogram_dict[van_key] = binning_plan.vanadium_histogram
+        while len(self._vanadium_histogram_dict) > MAX_VANADIUM_HISTOGRAMS:
+            self._vanadium_histogram_dict.popitem(last=False)
+
+        return binning_plan
+
+    def _get_pixels_range(self, reduction_engine, mask_vec, mask_digest, unit='2theta', wave_length=None):
+        """Get the minimum and maximum 2theta (or d-spacing, Q) of the unmasked pixels of a reduction engine
+
+        The range is cached for each detector geometry and mask such that it is not searched again from
+        the (masked) pixels for another sub run or reduction at the same detector position
+
+        Returns
+        -------
+        float, float
+            minimum and maximum
+        """
+        range_key = reduction_engine.geometry_key, unit, wave_length, mask_digest
+
+        # least recently used is removed
+        pixels_range = self._pixel_range_dict.pop(range_key, None)
+        if pixels_range is None:
+            pixel_x_array = reduction_engine.instrument.get_pixels_values(unit, wave_length)
+            if mask_vec is not None:
+                pixel_x_array = pixel_x_array[np.where(mask_vec == 1)]
+            pixels_range = float(np.min(pixel_x_array)), float(np.max(pixel_x_array))
+        self._pixel_range_dict[range_key] = pixels_range
+        while len(self._pixel_range_dict) > MAX_PIXEL_RANGES:
+            self._pixel_range_dict.popitem(last=False)
+
+        return pixels_range
+
+    def _generate_bin_edges(self, reduction_engine, min_2theta, num_bins, max_2theta, mask_vec, mask_digest,
+                            unit='2theta', wave_length=None):
+        """Generate bin edges with the default range from the cached range of unmasked pixels
+
+        Returns
+        -------
+        numpy.ndarray
+            bin boundaries
+        """
+        if min_2theta is None or max_2theta is None:
+            pixels_min, pixels_max = self._get_pixels_range(reduction_engine, mask_vec, mask_digest, unit,
+                                                            wave_length)
+            if min_2theta is None:
+                min_2theta = pixels_min
+            if max_2theta is None:
+                max_2theta = pixels_max
+
+        return self.generate_2theta_histogram_vector(min_2theta, num_bins, max_2theta, None, None)
+
+    def get_shared_2theta_range(self, workspace, sub_runs, geometry_calibration, mask_vec, min_2theta=None,
+                                max_2theta=None):
+        """Get the 2theta range covering the unmasked pixels of sub runs at all the detector positions
+
+        Sub runs reduced with the same range and number of bins share the same 2theta bins, such that
+        the reduced 2theta of all the sub runs is a single vector
+
+        Parameters
+        ----------
+        workspace : HidraWorkspace
+            workspace with detector counts and position
+        sub_runs : list or numpy.ndarray
+            sub run numbers in workspace
+        geometry_calibration : instrument_geometry.AnglerCameraDetectorShift or None
+            instrument geometry to calculate diffraction pattern
+        mask_vec : numpy.ndarray or None
+            1D array for masking (1 to keep, 0 to mask out)
+        min_2theta : float or None
+            min 2theta.  None for the minimum 2theta of pixels
+        max_2theta : float or None
+            max 2theta.  None for the maximum 2theta of pixels
+
+        Returns
+        -------
+        float, float
+            minimum and maximum 2theta
+
+        """
+        if min_2theta is not None and max_2theta is not None:
+            return min_2theta, max_2theta
+
+        mask_digest = _mask_digest(mask_vec)
+        range_list = list()
+        for position_sub_runs in self._group_sub_runs_by_detector_position(workspace, sub_runs):
+            reduction_engine = self.setup_reduction_engine(workspace, position_sub_runs[0], geometry_calibration)
+            self._last_reduction_engine = reduction_engine
+            range_list.append(self._get_pixels_range(reduction_engine, mask_vec, mask_digest))
+        if len(range_list) == 0:
+            raise RuntimeError('No sub run is given to get 2theta range')
+
+        if min_2theta is None:
+            min_2theta = min([pixels_range[0] for pixels_range in range_list])
+        if max_2theta is None:
+            max_2theta = max([pixels_range[1] for pixels_range in range_list])
+
+        return min_2theta, max_2theta
+
+    def reduce_sub_runs_to_common_bins(self, workspace, sub_runs, geometry_calibration, mask_vec, bin_edges,
+                                       unit='dSpacing', wave_length=None, vanadium_counts=None, van_duration=None,
+                                       batch_size=16):
+        """Reduce sub runs to the same 2theta, d-spacing or Q bins for all the detector positions
+
+        Pixels' d-spacing or Q are converted from 2theta once for each detector position.  The reduced sub runs
+        of a multi-position scan share the bins and thus can be merged without interpolation.
+        The reduced data are returned but not set to the workspace, which keeps the 2theta patterns.
+
+        Parameters
+        ----------
+        workspace : HidraWorkspace
+            workspace with detector counts and position
+        sub_runs : list or numpy.ndarray
+            sub run numbers in workspace to reduce
+        geometry_calibration : instrument_geometry.AnglerCameraDetectorShift or None
+            instrument geometry to calculate diffraction pattern
+        mask_vec : numpy.ndarray or None
+            1D array for masking (1 to keep, 0 to mask out)
+        bin_edges : numpy.ndarray
+            bin boundaries in the unit
+        unit : str
+            2theta (degree), dSpacing (Angstrom) or Q (1/Angstrom)
+        wave_length : float or None
+            wave length in Angstrom.  None for the wave length of the workspace
+        vanadium_counts : numpy.ndarray or None
+            detector pixels' vanadium for efficiency and normalization
+        van_duration : float or None
+            vanadium duration in seconds
+        batch_size : int
+            maximum number of sub runs to histogram in one shot
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            bin centers, intensities and variances of shape (number of sub runs, number of bins)
+
+        """
+        checkdatatypes.check_numpy_arrays('Bin edges', [bin_edges], 1, False)
+        checkdatatypes.check_int_variable('Batch size', batch_size, (1, None))
+        if unit != '2theta' and wave_length is None:
+            wave_length = workspace.get_wavelength(calibrated=False, throw_if_not_set=True)
+
+        intensity_matrix = np.ndarray(shape=(len(sub_runs), bin_edges.shape[0] - 1), dtype='float64')
+        variance_matrix = np.ndarray(shape=intensity_matrix.shape, dtype='float64')
+        row_dict = dict([(sub_run, row) for row, sub_run in enumerate(sub_runs)])
+        bin_centers = 0.5 * (bin_edges[1:] + bin_edges[:-1])
+
+        for batch_sub_runs, bin_centers, hist, variances in \
+                self._reduce_sub_runs_batches(workspace, sub_runs, geometry_calibration, mask_vec, None, None,
+                                              bin_edges.shape[0] - 1, vanadium_counts, van_duration, batch_size,
+                                              check_precision=False, unit=unit, wave_length=wave_length,
+                                              bin_edges=bin_edges):
+            rows = [row_dict[sub_run] for sub_run in batch_sub_runs]
+            intensity_matrix[rows] = hist
+            variance_matrix[rows] = variances
+
+        return bin_centers, intensity_matrix, variance_matrix
+
+    def reduce_merged_sub_runs(self, workspace, sub_runs, geometry_calibration, mask_vec, min_2theta=None,
+                               max_2theta=None, num_bins=1000, vanadium_counts=None, van_duration=None,
+                               normalize_by_duration=True):
+        """Reduce the sum of detector counts of multiple sub runs to one 2-theta ~ I pattern
+
+        Counts of the sub runs are accumulated pixel by pixel and histogrammed once, instead of reducing each
+        sub run and merging the patterns.  Variances are thus the Poisson variances of the summed counts.
+        If normalized by duration, the summed pattern is divided by the total duration of the sub runs,
+        which is the average of the sub runs' count rates weighted by their durations.
+
+        All the sub runs must be at the same detector position.  The merged pattern is returned but not
+        set to the workspace.
+
+        Parameters
+        ----------
+        workspace : HidraWorkspace
+            workspace with detector counts and position
+        sub_runs : list or numpy.ndarray
+            sub run numbers in workspace to merge
+        geometry_calibration : instrument_geometry.AnglerCameraDetectorShift or None
+            instrument geometry to calculate diffraction pattern
+        mask_vec : numpy.ndarray or None
+            1D array for masking (1 to keep, 0 to mask out)
+        min_2theta : float or None
+            min 2theta
+        max_2theta : float or None
+            max 2theta
+        num_bins : int
+            number of bins
+        vanadium_counts : numpy.ndarray or None
+            detector pixels' vanadium for efficiency and normalization
+        van_duration : float or None
+            vanadium duration in seconds
+        normalize_by_duration : bool
+            flag to divide the summed pattern by the total duration (sample log sub run duration) of sub runs
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            2theta bin centers, intensities and variances
+
+        """
+        if len(sub_runs) == 0:
+            raise RuntimeError('No sub run is given to merge')
+        if len(self._group_sub_runs_by_detector_position(workspace, sub_runs)) > 1:
+            raise RuntimeError('Sub runs {} are not at the same detector position and cannot be merged before '
+                               'reduction'.format(sub_runs))
+        if normalize_by_duration and not workspace.has_sample_log(HidraConstants.SUB_RUN_DURATION):
+            raise RuntimeError('Workspace {} does not have sample log {}.  Existing logs are {}'
+                               ''.format(workspace, HidraConstants.SUB_RUN_DURATION,
+                                         workspace.get_sample_log_names()))
+
+        # accumulate counts to a single vector
+        counts_sum = workspace.get_detector_counts(sub_runs[0]).astype('float64')
+        for sub_run in sub_runs[1:]:
+            counts_sum += workspace.get_detector_counts(sub_run)
+
+        reduction_engine = self.setup_reduction_engine(workspace, sub_runs[0], geometry_calibration)
+        self._last_reduction_engine = reduction_engine
+        bin_boundaries_2theta = self._generate_bin_edges(reduction_engine, min_2theta, num_bins, max_2theta,
+                                                         mask_vec, _mask_digest(mask_vec))
+        vanadium_hash = hashlib.sha1()
+        if vanadium_counts is not None:
+            _update_hash(vanadium_hash, mask_vec)
+            _update_hash(vanadium_hash, vanadium_counts)
+        self._get_binning_plan(reduction_engine, bin_boundaries_2theta, mask_vec, vanadium_counts, vanadium_hash)
+
+        # Histogram once
+        bin_centers, hist, variances = reduction_engine.reduce_sub_runs_to_histogram(
+            counts_sum.reshape((1, -1)), bin_boundaries_2theta, mask_array=mask_vec, is_point_data=True,
+            vanadium_counts_array=vanadium_counts)
+        hist, variances = hist[0], variances[0]
+
+        scale = 1. if van_duration is None else van_duration
+        if normalize_by_duration:
+            scale /= np.sum([workspace.get_sample_log_value(HidraConstants.SUB_RUN_DURATION, sub_run)
+                             for sub_run in sub_runs])
+        hist *= scale
+        variances *= scale
+
+        return bin_centers, hist, variances
+
+    def _reduce_sub_runs_in_pool(self, workspace, sub_runs, reduction_args, batch_size, workers):
+        """Reduce sub runs with a pool of forked processes
+
+        Sub runs of each detector position are split to chunks such that all the workers are busy
+
+        Returns
+        -------
+        list
+            sub runs, 2theta bin centers, intensities and variances (2D arrays) of each batch in serial order
+        """
+        chunk_list = list()
+        for position_sub_runs in self._group_sub_runs_by_detector_position(workspace, sub_runs):
+            chunk_size = min(batch_size, int(np.ceil(len(position_sub_runs) / float(workers))))
+            for start_index in range(0, len(position_sub_runs), chunk_size):
+                chunk_list.append(position_sub_runs[start_index:start_index + chunk_size])
+        if len(chunk_list) == 0:
+            return list()
+
+        # workers are given the reduction manager, workspace and arguments once at fork
+        pool = multiprocessing.get_context('fork').Pool(min(workers, len(chunk_list)),
+                                                        initializer=_init_reduction_worker,
+                                                        initargs=(self, workspace, reduction_args, batch_size))
+        try:
+            # only the first chunk checks single precision geometry
+            chunk_data_sets = pool.map(_reduce_sub_runs_in_worker,
+                                       [(chunk, index == 0) for index, chunk in enumerate(chunk_list)])
+        finally:
+            pool.close()
+            pool.join()
+
+        # keep the engine of the last detector position as reducing serially
+        self._last_reduction_engine = self.setup_reduction_engine(workspace, chunk_list[-1][0],
+                                                                  reduction_args['geometry_calibration'])
+
+        return [data_set for data_sets in chunk_data_sets for data_set in data_sets]
+
     # NOTE: Refer to compare_reduction_engines_tst
     def reduce_sub_run_diffraction(self, workspace, sub_run, geometry_calibration,
                                    mask_vec_tuple, min_2theta=None, max_2theta=None, num_bins=1000,
@@ -749,9 +1431,6 @@ class HB2BReductionManager(object):
         # Apply mask
         mask_id, mask_vec = mask_vec_tuple
 
-        # Get vector of pixel eta positions
-        eta_vec = reduction_engine.get_eta_value()
-
         # validate input
         if abs(eta_step) is not eta_step:
             eta_step = abs(eta_step)
@@ -759,33 +1438,88 @@ class HB2BReductionManager(object):
         # Generate eta roi vector
         eta_roi_vec = self.generate_eta_roi_vector(eta_step, eta_min, eta_max)
 
-        for eta_cent in eta_roi_vec:
-            # define mask to isolate narrow eta wedge
-            # here a value of zero means do not use
-            eta_mask = np.ones_like(eta_vec)
-            eta_mask[eta_vec > (eta_cent + eta_step / 2.)] = 0
-            eta_mask[eta_vec < (eta_cent - eta_step / 2.)] = 0
-            eta_mask[mask_vec] = 0
-
-            # Histogram data
-            bin_centers, hist, variances = self.convert_counts_to_diffraction(reduction_engine,
-                                                                              (min_2theta, max_2theta),
-                                                                              num_bins, eta_mask, vanadium_counts)
-
-            if van_duration is not None:
-                hist *= van_duration
-                variances *= van_duration
+        # Histogram data of all the eta wedges at once
+        binning_plan = self._get_texture_binning_plan(reduction_engine, eta_roi_vec, eta_step, mask_vec,
+                                                      (min_2theta, max_2theta), num_bins, vanadium_counts)
+        bin_centers, hist, variances = binning_plan.histogram(workspace.get_detector_counts(sub_run),
+                                                              is_point_data=True)
+
+        if van_duration is not None:
+            hist *= van_duration
+            variances *= van_duration
 
+        for wedge_index, eta_cent in enumerate(eta_roi_vec):
             if mask_id is None:
                 eta_mask_id = 'eta_{}'.format(eta_cent)
             else:
                 eta_mask_id = '{}_eta_{}'.format(mask_id, eta_cent)
 
             # record
-            workspace.set_reduced_diffraction_data(sub_run, eta_mask_id, bin_centers, hist, variances)
+            workspace.set_reduced_diffraction_data(sub_run, eta_mask_id, bin_centers[wedge_index],
+                                                   hist[wedge_index], variances[wedge_index])
 
         self._last_reduction_engine = reduction_engine
 
+    def _get_texture_binning_plan(self, reduction_engine, eta_roi_vec, eta_step, mask_vec, two_theta_range,
+                                  num_bins, vanadium_counts):
+        """Get the pixel to (eta wedge, 2theta bin) plan for texture reduction
+
+        The plan is reused among sub runs reduced with the same engine at the same detector position
+
+        Parameters
+        ----------
+        reduction_engine : ~pyrs.core.reduce_hb2b_pyrs.PyHB2BReduction
+            reduction engine with instrument built
+        eta_roi_vec : numpy.ndarray
+            centers of eta wedges
+        eta_step : float
+            width of eta wedges
+        mask_vec : numpy.ndarray or None
+            detector mask
+        two_theta_range : (min_2theta, max_2theta)
+            2theta range, each of which can be None to be determined by each wedge's pixels
+        num_bins : int
+            number of bins
+        vanadium_counts : numpy.ndarray or None
+            detector pixels' vanadium for efficiency and normalization
+
+        Returns
+        -------
+        ~pyrs.core.reduce_hb2b_pyrs.PixelWedgeBinningPlan
+            binning plan
+        """
+        plan_key = [reduction_engine, reduction_engine.geometry_key, tuple(eta_roi_vec), eta_step, mask_vec,
+                    two_theta_range, num_bins, vanadium_counts]
+        if self._texture_binning_plan is not None and \
+                all(item is cached_item or (not isinstance(item, np.ndarray) and item == cached_item)
+                    for item, cached_item in zip(plan_key, self._texture_binning_plan[0])):
+            return self._texture_binning_plan[1]
+
+        eta_vec = reduction_engine.get_eta_value()
+        pixel_2theta_array = reduction_engine.instrument.get_pixels_2theta(1)
+
+        # NOTE: the detector mask is applied as eta_mask[mask_vec] = 0, i.e., mask values are taken as
+        # pixel indices (pixels 0 and 1 for a 0/1 mask).  It is kept as the previous (wedge by wedge) reduction
+        excluded_pixels = np.zeros(eta_vec.shape, dtype=bool)
+        excluded_pixels[mask_vec] = True
+
+        wedge_pixels_list = list()
+        bin_edges_list = list()
+        for eta_cent in eta_roi_vec:
+            # pixels in narrow eta wedge
+            wedge_pixels = np.logical_not((eta_vec > (eta_cent + eta_step / 2.)) |
+                                          (eta_vec < (eta_cent - eta_step / 2.)) | excluded_pixels)
+            wedge_pixels_list.append(wedge_pixels)
+            bin_edges_list.append(self.generate_2theta_histogram_vector(two_theta_range[0], num_bins,
+                                                                        two_theta_range[1], pixel_2theta_array,
+                                                                        wedge_pixels))
+
+        binning_plan = reduce_hb2b_pyrs.PixelWedgeBinningPlan(pixel_2theta_array, wedge_pixels_list,
+                                                              bin_edges_list, vanadium_counts)
+        self._texture_binning_plan = plan_key, binning_plan
+
+        return binning_plan
+
     def convert_counts_to_diffraction(self, reduction_engine,
                                       two_theta_range, num_bins, mask_array, vanadium_array):
 
@@ -817,11 +1551,9 @@ class HB2BReductionManager(object):
         # Default minimum and maximum 2theta are related with
         min_2theta, max_2theta = two_theta_range
 
-        # Get the 2theta values for all pixels
-        pixel_2theta_array = reduction_engine.instrument.get_pixels_2theta(1)
-
-        bin_boundaries_2theta = self.generate_2theta_histogram_vector(min_2theta, num_bins, max_2theta,
-                                                                      pixel_2theta_array, mask_array)
+        # Default range is from the (cached) range of unmasked pixels
+        bin_boundaries_2theta = self._generate_bin_edges(reduction_engine, min_2theta, num_bins, max_2theta,
+                                                         mask_array, _mask_digest(mask_array))
 
         # Histogram
         data_set = reduction_engine.reduce_to_2theta_histogram(bin_boundaries_2theta,
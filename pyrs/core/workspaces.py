@@ -6,6 +6,34 @@ from pyrs.projectfile import HidraProjectFile
 from pyrs.utilities import checkdatatypes
 
 
+def compact_counts(counts):
+    """Convert integer detector counts to the smallest unsigned integer type (uint16 or uint32) holding them
+
+    Counts, which are not integers, are negative or are too large for uint32, are returned unchanged
+
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        detector counts
+
+    Returns
+    -------
+    numpy.ndarray
+        detector counts in compact type
+    """
+    if counts.dtype.kind not in 'iu' or counts.size == 0 or counts.min() < 0:
+        return counts
+
+    max_count = counts.max()
+    for dtype in (numpy.uint16, numpy.uint32):
+        if max_count <= numpy.iinfo(dtype).max:
+            if counts.dtype.itemsize <= numpy.dtype(dtype).itemsize:
+                return counts
+            return counts.astype(dtype)
+
+    return counts
+
+
 class HidraWorkspace(object):
     """
     This workspace is the central data structure to manage all the raw and/or processed data.
@@ -35,6 +63,10 @@ class HidraWorkspace(object):
         self._2theta_matrix = None  # ndarray.  shape = (m, ) m = number of 2theta
         self._diff_data_set = dict()  # [mask id] = ndarray: shape=(n, m), n: number of sub-run, m: number of of 2theta
         self._var_data_set = dict()  # [mask id] = ndarray: shape=(n, m), n: number of sub-run, m: number of of 2theta
+        # lazy reduction: [mask id] = (function to reduce a list of sub runs, set of sub runs not reduced yet)
+        self._pending_reduction_dict = dict()
+        # [mask id] = dict [sub run] = fingerprint of the inputs that the reduced data is calculated from
+        self._fingerprint_dict = dict()
 
         # instrument
         self._instrument_setup = None
@@ -78,7 +110,7 @@ class HidraWorkspace(object):
 
         for sub_run_i in self._sample_logs.subruns:
             counts_vec_i = hidra_file.read_raw_counts(sub_run_i)
-            self._raw_counts[sub_run_i] = counts_vec_i
+            self._raw_counts[sub_run_i] = compact_counts(counts_vec_i)
         # END-FOR
 
         return
@@ -142,6 +174,14 @@ class HidraWorkspace(object):
             if self._var_data_set[mask_name] is None:
                 self._var_data_set[mask_name] = numpy.sqrt(self._diff_data_set[mask_name])
 
+        # Load fingerprints of reduction inputs
+        sub_runs = hidra_file.read_sub_runs()
+        fingerprint_arrays = hidra_file.read_reduction_fingerprints()
+        for mask_name in fingerprint_arrays:
+            mask_id = None if mask_name == HidraConstants.REDUCED_MAIN else mask_name
+            self._fingerprint_dict[mask_id] = dict([(int(sub_run), str(fingerprint)) for sub_run, fingerprint
+                                                    in zip(sub_runs, fingerprint_arrays[mask_name]) if fingerprint])
+
         print('[INFO] Loaded diffraction data from {} includes : {}'
               ''.format(self._project_file_name, self._diff_data_set.keys()))
 
@@ -428,6 +468,9 @@ class HidraWorkspace(object):
         else:
             checkdatatypes.check_string_variable('Mask ID', mask_id)
 
+        # Reduce all the sub runs that are not reduced yet in lazy mode
+        self._reduce_pending_sub_runs(mask_id)
+
         # Vector 2theta
         matrix_2theta = self._2theta_matrix.copy()
 
@@ -447,6 +490,20 @@ class HidraWorkspace(object):
 
         return matrix_2theta, intensity_matrix, variance_matrix
 
+    def get_num_2theta_bins(self):
+        """Get the number of 2theta bins of the reduced diffraction data
+
+        Returns
+        -------
+        int or None
+            number of 2theta bins.  None if there is no reduced diffraction data
+
+        """
+        if self._2theta_matrix is None or len(self._2theta_matrix.shape) != 2:
+            return None
+
+        return self._2theta_matrix.shape[1]
+
     def get_reduced_diffraction_data_2theta(self, sub_run):
         """Get 2theta vector of reduced diffraction data
 
@@ -463,6 +520,11 @@ class HidraWorkspace(object):
         """
         # Check inputs
         checkdatatypes.check_int_variable('Sub run number', sub_run, (1, None))
+        # Reduce the sub run if it is not reduced yet in lazy mode (2theta is shared by all masks)
+        for mask_id in list(self._pending_reduction_dict.keys()):
+            if sub_run in self._pending_reduction_dict[mask_id][1]:
+                self._reduce_pending_sub_runs(mask_id, [sub_run])
+                break
         # Get spectrum index
         spec_index = self._sample_logs.get_subrun_indices(sub_run)[0]
         # Vector 2theta
@@ -473,6 +535,8 @@ class HidraWorkspace(object):
     def get_reduced_diffraction_data(self, sub_run, mask_id=None):
         """Get data set of a single diffraction pattern
 
+        In lazy reduction mode, the sub run is reduced at the first request
+
         Parameters
         ----------
         sub_run: int
@@ -494,6 +558,9 @@ class HidraWorkspace(object):
         else:
             checkdatatypes.check_string_variable('Mask ID', mask_id)
 
+        # Reduce the sub run if it is not reduced yet in lazy mode
+        self._reduce_pending_sub_runs(mask_id, [sub_run])
+
         spec_index = self._sample_logs.get_subrun_indices(sub_run)[0]
 
         # Vector 2theta
@@ -516,7 +583,167 @@ class HidraWorkspace(object):
         array list of mask ids
 
         """
-        return list(self._diff_data_set.keys())
+        mask_ids = list(self._diff_data_set.keys())
+        # masks whose reduction is pending entirely
+        mask_ids.extend([mask_id for mask_id in self._pending_reduction_dict if mask_id not in mask_ids])
+
+        return mask_ids
+
+    def get_reduction_fingerprint(self, sub_run, mask_id=None):
+        """Get the fingerprint of the inputs that a sub run's reduced diffraction data is calculated from
+
+        Parameters
+        ----------
+        sub_run : int
+            sub run number
+        mask_id : str or None
+            None (as default main) or ID as a String
+
+        Returns
+        -------
+        str or None
+            fingerprint.  None if the sub run is not reduced or its reduced data is set without fingerprint
+
+        """
+        return self._fingerprint_dict.get(mask_id, dict()).get(int(sub_run), None)
+
+    def set_reduction_fingerprint(self, sub_run, mask_id, fingerprint):
+        """Set the fingerprint of the inputs that a sub run's reduced diffraction data is calculated from
+
+        The fingerprint shall be set after the reduced diffraction data as setting data removes it
+
+        Parameters
+        ----------
+        sub_run : int
+            sub run number
+        mask_id : str or None
+            None (as default main) or ID as a String
+        fingerprint : str
+            fingerprint of reduction inputs
+
+        Returns
+        -------
+        None
+
+        """
+        checkdatatypes.check_string_variable('Reduction fingerprint', fingerprint, allow_empty=False)
+
+        self._fingerprint_dict.setdefault(mask_id, dict())[int(sub_run)] = fingerprint
+
+    def _remove_reduction_fingerprints(self, sub_runs):
+        """Remove the fingerprints of sub runs for all the masks as their diffraction data are changed
+
+        2theta is shared by all the masks.  Thus the fingerprints of other masks become invalid too.
+        """
+        for sub_run_fingerprints in self._fingerprint_dict.values():
+            for sub_run in sub_runs:
+                sub_run_fingerprints.pop(int(sub_run), None)
+
+    def set_pending_reduction(self, mask_id, sub_runs, reduce_function):
+        """Register sub runs to be reduced on demand (lazy reduction)
+
+        The sub runs are reduced by the given function only when their diffraction data are requested.
+        Each sub run is reduced once: the reduced data are kept in the workspace as usual.
+        The sub runs of the mask pending from an earlier registration, which are not registered again,
+        are reduced now by the earlier function such that the registration can be replaced
+
+        Parameters
+        ----------
+        mask_id : str or None
+            ID of the mask that the sub runs will be reduced with
+        sub_runs : List or numpy.ndarray
+            sub run numbers to reduce on demand
+        reduce_function : callable
+            function taking a list of sub runs to reduce them and set the diffraction data to this workspace
+
+        Returns
+        -------
+        None
+
+        """
+        if not callable(reduce_function):
+            raise RuntimeError('Lazy reduction function {} is not callable'.format(reduce_function))
+
+        sub_run_set = set([int(sub_run) for sub_run in sub_runs])
+        if mask_id in self._pending_reduction_dict:
+            self._reduce_pending_sub_runs(mask_id, sorted(self._pending_reduction_dict[mask_id][1] - sub_run_set))
+
+        self._pending_reduction_dict[mask_id] = reduce_function, sub_run_set
+
+    def discard_pending_sub_runs(self, mask_id, sub_runs):
+        """Discard the lazy reduction of sub runs as they are reduced again from other inputs
+
+        Parameters
+        ----------
+        mask_id : str or None
+            None (as default main) or ID as a String
+        sub_runs : List or numpy.ndarray
+            sub run numbers not to reduce on demand
+
+        Returns
+        -------
+        None
+
+        """
+        if mask_id not in self._pending_reduction_dict:
+            return
+
+        pending_sub_runs = self._pending_reduction_dict[mask_id][1]
+        pending_sub_runs.difference_update([int(sub_run) for sub_run in sub_runs])
+        if len(pending_sub_runs) == 0:
+            del self._pending_reduction_dict[mask_id]
+
+    def get_pending_sub_runs(self, mask_id=None):
+        """Get the sub runs registered for lazy reduction but not reduced yet
+
+        Parameters
+        ----------
+        mask_id : str or None
+            None (as default main) or ID as a String
+
+        Returns
+        -------
+        List
+            sorted sub run numbers
+
+        """
+        if mask_id not in self._pending_reduction_dict:
+            return list()
+
+        return sorted(self._pending_reduction_dict[mask_id][1])
+
+    def _reduce_pending_sub_runs(self, mask_id, sub_runs=None):
+        """Reduce the sub runs that are registered for lazy reduction but not reduced yet
+
+        Parameters
+        ----------
+        mask_id : str or None
+            mask ID
+        sub_runs : List or None
+            sub runs to reduce.  None for all the pending sub runs of the mask
+
+        Returns
+        -------
+        None
+
+        """
+        if mask_id not in self._pending_reduction_dict:
+            return
+
+        reduce_function, pending_sub_runs = self._pending_reduction_dict[mask_id]
+        if sub_runs is None:
+            reduce_set = set(pending_sub_runs)
+        else:
+            reduce_set = pending_sub_runs.intersection([int(sub_run) for sub_run in sub_runs])
+        if len(reduce_set) == 0:
+            return
+
+        reduce_function(sorted(reduce_set))
+
+        # memorize the reduced sub runs
+        pending_sub_runs.difference_update(reduce_set)
+        if len(pending_sub_runs) == 0:
+            del self._pending_reduction_dict[mask_id]
 
     def get_sample_log_names(self):
         return sorted(self._sample_logs.keys())
@@ -658,7 +885,7 @@ class HidraWorkspace(object):
 
     def set_raw_counts(self, sub_run_number, counts):
         """
-        Set the raw counts to
+        Set the raw counts to.  Integer counts are kept in the smallest unsigned integer type holding them
         :param sub_run_number: integer for sub run number
         :param counts: ndarray of detector counts
         :return:
@@ -669,7 +896,19 @@ class HidraWorkspace(object):
             # 1D array in 2D format: set to 1D array
             counts = counts.reshape((counts.shape[0],))
 
-        self._raw_counts[int(sub_run_number)] = counts
+        self._raw_counts[int(sub_run_number)] = compact_counts(counts)
+
+    def remove_raw_counts(self, sub_run_number):
+        """
+        Remove the raw counts of a sub run to release memory
+        :param sub_run_number: integer for sub run number
+        :return:
+        """
+        try:
+            del self._raw_counts[int(sub_run_number)]
+        except KeyError:
+            raise RuntimeError('Sub run {} does not exist in loaded raw counts. FYI loaded '
+                               'sub runs are {}'.format(sub_run_number, list(self._raw_counts.keys())))
 
     def set_reduced_diffraction_data(self, sub_run, mask_id, two_theta_array, intensity_array, variances_array=None):
         """Set reduced diffraction data to workspace
@@ -708,10 +947,10 @@ class HidraWorkspace(object):
 
         # Set 2-theta 2D array
         if self._2theta_matrix is None or len(self._2theta_matrix.shape) != 2:
-            # First time set up or legacy from input file: create the 2D array
+            # First time set up or legacy from input file: create the 2D array (NaN for sub runs not reduced)
             num_sub_runs = len(self._sample_logs.subruns)
-            self._2theta_matrix = numpy.ndarray(shape=(num_sub_runs, two_theta_array.shape[0]),
-                                                dtype=intensity_array.dtype)
+            self._2theta_matrix = numpy.full((num_sub_runs, two_theta_array.shape[0]), numpy.nan,
+                                             dtype=intensity_array.dtype)
 
             # set the diffraction data (2D) array with new dimension
             num_sub_runs = len(self._sample_logs.subruns)
@@ -755,6 +994,9 @@ class HidraWorkspace(object):
                                                               self._diff_data_set[mask_id].shape[1]))
         # END-IF-ELSE
 
+        # Reduced data is changed
+        self._remove_reduction_fingerprints([sub_run])
+
         # Set 2theta array
         self._2theta_matrix[spec_id] = two_theta_array
         # Set intensity
@@ -762,6 +1004,44 @@ class HidraWorkspace(object):
         # Set variances
         self._var_data_set[mask_id][spec_id] = variances_array
 
+    def set_reduced_diffraction_data_set(self, sub_runs, mask_id, two_theta_array, intensity_matrix,
+                                         variances_matrix):
+        """Set reduced diffraction data of multiple sub runs sharing the same 2theta bins to workspace
+
+        Parameters
+        ----------
+        sub_runs : list or numpy.ndarray
+            sub run numbers
+        mask_id : None or str
+            mask ID.  None for no-mask or masked by default/universal detector masks on edges
+        two_theta_array : numpy.ndarray
+            2theta bins (center)
+        intensity_matrix : numpy.ndarray
+            histogrammed intensities of shape (number of sub runs, number of 2theta)
+        variances_matrix : numpy.ndarray
+            histogrammed variances of shape (number of sub runs, number of 2theta)
+
+        Returns
+        -------
+        None
+
+        """
+        checkdatatypes.check_numpy_arrays('Intensity and variances', [intensity_matrix, variances_matrix], 2, True)
+        if intensity_matrix.shape[0] != len(sub_runs):
+            raise RuntimeError('Intensity matrix with shape {} does not match {} sub runs'
+                               ''.format(intensity_matrix.shape, len(sub_runs)))
+
+        # Set the first sub run to check inputs and set up the data set for this mask
+        self.set_reduced_diffraction_data(sub_runs[0], mask_id, two_theta_array, intensity_matrix[0],
+                                          variances_matrix[0])
+
+        # Set all the sub runs at once
+        spec_ids = numpy.array([self._sample_logs.get_subrun_indices(sub_run)[0] for sub_run in sub_runs])
+        self._remove_reduction_fingerprints(sub_runs)
+        self._2theta_matrix[spec_ids] = two_theta_array
+        self._diff_data_set[mask_id][spec_ids] = intensity_matrix
+        self._var_data_set[mask_id][spec_ids] = variances_matrix
+
     def set_sample_log(self, log_name, sub_runs, log_value_array):
         """Set sample log value for each sub run, i.e., average value in each sub run
 
@@ -876,14 +1156,59 @@ class HidraWorkspace(object):
         if self._wave_length is not None:
             hidra_project.write_wavelength(self._wave_length)
 
-    def save_reduced_diffraction_data(self, hidra_project):
+    def save_reduced_diffraction_data(self, hidra_project, sub_runs=None):
         """ Export reduced diffraction data to project
         :param hidra_project: HidraProjectFile instance
+        :param sub_runs: None for exporting all or the specified (reduced) sub runs only, i.e., their rows
         :return:
         """
         checkdatatypes.check_type('HIDRA project file', hidra_project, HidraProjectFile)
 
-        hidra_project.write_reduced_diffraction_data_set(self._2theta_matrix, self._diff_data_set, self._var_data_set)
+        if sub_runs is not None:
+            self._save_reduced_diffraction_sub_runs(hidra_project, sub_runs)
+            return
+
+        # Reduce all the sub runs that are not reduced yet in lazy mode
+        for mask_id in list(self._pending_reduction_dict.keys()):
+            self._reduce_pending_sub_runs(mask_id)
+
+        # 2theta shared by all the sub runs is written as a single vector.  Sub runs not reduced have NaN 2theta
+        two_theta_array = self._2theta_matrix
+        if two_theta_array is not None and not numpy.isnan(two_theta_array).any() \
+                and numpy.all(two_theta_array == two_theta_array[0]):
+            two_theta_array = two_theta_array[0]
+
+        hidra_project.write_reduced_diffraction_data_set(two_theta_array, self._diff_data_set, self._var_data_set)
+
+        self._save_reduction_fingerprints(hidra_project)
+
+    def _save_reduced_diffraction_sub_runs(self, hidra_project, sub_runs):
+        """Export the reduced diffraction data of the specified sub runs to the rows of project's data sets"""
+        # Reduce the sub runs that are not reduced yet in lazy mode
+        for mask_id in list(self._pending_reduction_dict.keys()):
+            self._reduce_pending_sub_runs(mask_id, sub_runs)
+
+        num_sub_runs = len(self.get_sub_runs())
+        for sub_run in sub_runs:
+            spec_index = int(self._sample_logs.get_subrun_indices(sub_run)[0])
+            diff_data_set = dict()
+            var_data_set = dict()
+            for mask_id in self._diff_data_set:
+                diff_data_set[mask_id] = self._diff_data_set[mask_id][spec_index]
+                var_data_set[mask_id] = self._var_data_set[mask_id][spec_index]
+            hidra_project.write_reduced_diffraction_sub_run(spec_index, num_sub_runs,
+                                                            self._2theta_matrix[spec_index], diff_data_set,
+                                                            var_data_set)
+
+        self._save_reduction_fingerprints(hidra_project)
+
+    def _save_reduction_fingerprints(self, hidra_project):
+        """Export the fingerprints of reduction inputs in the order of sub runs.  Empty for sub runs without one"""
+        fingerprint_arrays = dict()
+        for mask_id in self._fingerprint_dict:
+            fingerprint_arrays[mask_id] = [self._fingerprint_dict[mask_id].get(sub_run, '')
+                                           for sub_run in self.get_sub_runs()]
+        hidra_project.write_reduction_fingerprints(fingerprint_arrays)
 
     @property
     def sample_log_names(self):
@@ -942,3 +1267,5 @@ class HidraWorkspace(object):
 
         """
         self._2theta_matrix = None
+        self._pending_reduction_dict = dict()
+        self._fingerprint_dict = dict()
@@ -8,6 +8,7 @@ class HidraConstants(object):
     RAW_DATA = 'raw data'
     REDUCED_DATA = 'reduced diffraction data'
     REDUCED_MAIN = 'main'   # default reduced data
+    REDUCTION_FINGERPRINT = 'reduction fingerprint'  # fingerprints of reduction inputs of each sub run
     SUB_RUNS = 'sub-runs'
     CALIBRATION = 'calibration'
     SAMPLE_LOGS = 'logs'
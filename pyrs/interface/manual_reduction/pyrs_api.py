@@ -130,6 +130,8 @@ class ReductionController(object):
     def get_powder_pattern(self, sub_run_number):
         """Retrieve powder pattern from current HidraWorkspace
 
+        If the workspace is reduced in lazy mode, only the requested sub run is reduced (once)
+
         Exception: RuntimeError
             1. self._curr_hidra_ws does not exist
             2. sub run does not exist
@@ -2,7 +2,7 @@
 from __future__ import (absolute_import, division, print_function)  # python3 compatibility
 from enum import Enum
 import h5py
-from mantid.kernel import Logger
+import logging
 import numpy
 import os
 from pyrs.utilities import checkdatatypes
@@ -53,7 +53,7 @@ class HidraProjectFile(object):
         :param mode: I/O mode
         """
         # configure logging for this class
-        self._log = Logger(__name__)
+        self._log = logging.getLogger(__name__)
 
         # convert the mode to the enum
         self._io_mode = HidraProjectFileMode.getMode(mode)
@@ -330,7 +330,7 @@ class HidraProjectFile(object):
         if self._project_h5 is not None:
             self._project_h5.close()
             self._project_h5 = None  #
-            self._log.information('File {} is closed'.format(self._file_name))
+            self._log.info('File {} is closed'.format(self._file_name))
 
     def save(self, verbose=False):
         """
@@ -340,7 +340,7 @@ class HidraProjectFile(object):
         self._validate_write_operation()
 
         if verbose:
-            self._log.information('Changes are saved to {0}. File is now closed.'.format(self._project_h5.filename))
+            self._log.info('Changes are saved to {0}. File is now closed.'.format(self._project_h5.filename))
 
         self.close()
 
@@ -827,14 +827,17 @@ class HidraProjectFile(object):
         Parameters
         ----------
         two_theta_array : numppy.ndarray
-            2D array for 2-theta vector, which could be various to each other among sub runs
+            2D array for 2-theta vector, which could be various to each other among sub runs,
+            or 1D array for 2-theta vector shared by all the sub runs
         diff_data_set : dict
             dictionary of 2D arrays for reduced diffraction patterns' intensities
         var_data_set : dict
             dictionary of 2D arrays for reduced diffraction patterns' variances
         """
         # Check input
-        checkdatatypes.check_numpy_arrays('Two theta vector', [two_theta_array], 2, False)
+        checkdatatypes.check_numpy_arrays('Two theta vector', [two_theta_array], None, False)
+        if len(two_theta_array.shape) not in (1, 2):
+            raise RuntimeError('2theta array of shape {} must be 1D or 2D'.format(two_theta_array.shape))
         checkdatatypes.check_dict('Diffraction data set', diff_data_set)
 
         # Retrieve diffraction group
@@ -857,10 +860,10 @@ class HidraProjectFile(object):
         for mask_id in diff_data_set:
             # Get data
             diff_data_matrix_i = diff_data_set[mask_id]
-            self._log.information('Mask {} data set shape: {}'.format(mask_id, diff_data_matrix_i.shape))
+            self._log.info('Mask {} data set shape: {}'.format(mask_id, diff_data_matrix_i.shape))
             # Check
             checkdatatypes.check_numpy_arrays('Diffraction data (matrix)', [diff_data_matrix_i], None, False)
-            if two_theta_array.shape != diff_data_matrix_i.shape:
+            if two_theta_array.shape != diff_data_matrix_i.shape[-len(two_theta_array.shape):]:
                 raise RuntimeError('Length of 2theta vector ({}) is different from intensities ({})'
                                    ''.format(two_theta_array.shape, diff_data_matrix_i.shape))
             # Set name for default mask
@@ -892,10 +895,10 @@ class HidraProjectFile(object):
         for mask_id in var_data_set:
             # Get data
             var_data_matrix_i = var_data_set[mask_id]
-            self._log.information('Mask {} data set shape: {}'.format(mask_id, var_data_matrix_i.shape))
+            self._log.info('Mask {} data set shape: {}'.format(mask_id, var_data_matrix_i.shape))
             # Check
             checkdatatypes.check_numpy_arrays('Diffraction data (matrix)', [var_data_matrix_i], None, False)
-            if two_theta_array.shape != var_data_matrix_i.shape:
+            if two_theta_array.shape != var_data_matrix_i.shape[-len(two_theta_array.shape):]:
                 raise RuntimeError('Length of 2theta vector ({}) is different from intensities ({})'
                                    ''.format(two_theta_array.shape, var_data_matrix_i.shape))
             # Set name for default mask
@@ -918,6 +921,96 @@ class HidraProjectFile(object):
                 # new
                 diff_group.create_dataset(data_name, data=var_data_matrix_i)
 
+    def write_reduced_diffraction_sub_run(self, sub_run_index, num_sub_runs, two_theta_vector, diff_data_set,
+                                          var_data_set):
+        """Set the reduced diffraction data of a single sub run
+
+        The sub run's 2theta, intensities and variances are written to the row of the 2D data sets,
+        which are created with NaN for all the sub runs if they do not exist or have a different shape
+
+        Parameters
+        ----------
+        sub_run_index : int
+            index of the sub run in the sub runs
+        num_sub_runs : int
+            number of sub runs, i.e., number of rows of the 2D data sets
+        two_theta_vector : numpy.ndarray
+            1D array for the sub run's 2-theta vector
+        diff_data_set : dict
+            dictionary of 1D arrays for the sub run's reduced diffraction pattern intensities
+        var_data_set : dict
+            dictionary of 1D arrays for the sub run's reduced diffraction pattern variances
+        """
+        # Check input
+        checkdatatypes.check_int_variable('Sub run index', sub_run_index, (0, num_sub_runs))
+        checkdatatypes.check_numpy_arrays('Two theta vector', [two_theta_vector], 1, False)
+        checkdatatypes.check_dict('Diffraction data set', diff_data_set)
+        checkdatatypes.check_dict('Variance data set', var_data_set)
+
+        # Retrieve diffraction group
+        diff_group = self._project_h5[HidraConstants.REDUCED_DATA]
+        data_shape = (num_sub_runs, two_theta_vector.shape[0])
+
+        def write_row(data_name, vector):
+            if vector.shape != two_theta_vector.shape:
+                raise RuntimeError('Length of 2theta vector ({}) is different from {} ({})'
+                                   ''.format(two_theta_vector.shape, data_name, vector.shape))
+            if data_name in diff_group.keys() and diff_group[data_name].shape != data_shape:
+                # usually two theta vector size changed
+                del diff_group[data_name]
+            if data_name not in diff_group.keys():
+                diff_group.create_dataset(data_name, data=numpy.full(data_shape, numpy.nan))
+            diff_group[data_name][sub_run_index] = vector
+
+        write_row(HidraConstants.TWO_THETA, two_theta_vector)
+        for mask_id in diff_data_set:
+            # Set name for default mask
+            data_name = HidraConstants.REDUCED_MAIN if mask_id is None else mask_id
+            write_row(data_name, diff_data_set[mask_id])
+            write_row(data_name + '_var', var_data_set[mask_id])
+
+    def read_reduction_fingerprints(self):
+        """Read the fingerprints of the inputs that the reduced diffraction data are calculated from
+
+        Returns
+        -------
+        dict
+            dictionary of 1D arrays (str) for each sub run's fingerprint.  Empty string for no fingerprint
+        """
+        fingerprint_dict = dict()
+        if HidraConstants.REDUCTION_FINGERPRINT not in self._project_h5:
+            # project file from older version
+            return fingerprint_dict
+
+        fingerprint_group = self._project_h5[HidraConstants.REDUCTION_FINGERPRINT]
+        for mask_name in fingerprint_group.keys():
+            fingerprint_dict[mask_name] = fingerprint_group[mask_name][()].astype(str)
+
+        return fingerprint_dict
+
+    def write_reduction_fingerprints(self, fingerprint_dict):
+        """Write the fingerprints of the inputs that the reduced diffraction data are calculated from
+
+        Parameters
+        ----------
+        fingerprint_dict : dict
+            dictionary of lists of each sub run's fingerprint (str) for each mask ID.  Empty string for no fingerprint
+        """
+        checkdatatypes.check_dict('Reduction fingerprints', fingerprint_dict)
+
+        if HidraConstants.REDUCTION_FINGERPRINT in self._project_h5:
+            # remove all the previous fingerprints as the reduced data are overwritten
+            del self._project_h5[HidraConstants.REDUCTION_FINGERPRINT]
+        fingerprint_group = self._project_h5.create_group(HidraConstants.REDUCTION_FINGERPRINT)
+
+        for mask_id in fingerprint_dict:
+            # Set name for default mask
+            if mask_id is None:
+                data_name = HidraConstants.REDUCED_MAIN
+            else:
+                data_name = mask_id
+            fingerprint_group.create_dataset(data_name, data=numpy.array(fingerprint_dict[mask_id], dtype='S'))
+
     def write_sub_runs(self, sub_runs):
         """ Set sub runs to sample log entry
         """
@@ -1,13 +1,15 @@
 # flake8: noqa
 import os
-from qtpy.uic import loadUi
-from pyrs.interface import designer
 from .file_util import *
 
 __all__ = ['load_ui'] + file_util.__all__
 
 
 def load_ui(ui_filename, baseinstance):
+    # Qt is only required by the user interface
+    from qtpy.uic import loadUi
+    from pyrs.interface import designer
+
     ui_filename = os.path.split(ui_filename)[-1]
     ui_path = os.path.dirname(designer.__file__)
 
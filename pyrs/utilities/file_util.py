@@ -1,9 +1,6 @@
 from __future__ import (absolute_import, division, print_function)  # python3 compatibility
 from . import checkdatatypes
 from contextlib import contextmanager
-from mantid import ConfigService
-from mantid.api import FileFinder
-from mantid.simpleapi import mtd, GetIPTS, SaveNexusProcessed
 import os
 from subprocess import check_output
 
@@ -18,6 +15,9 @@ def save_mantid_nexus(workspace_name, file_name, title=''):
     :param title:
     :return:
     """
+    # Mantid is only imported by the functions using it
+    from mantid.simpleapi import mtd, SaveNexusProcessed
+
     # check input
     checkdatatypes.check_file_name(file_name, check_exist=False,
                                    check_writable=True, is_dir=False)
@@ -65,6 +65,7 @@ def archive_search():
     SEARCH_ARCHIVE = 'datasearch.searcharchive'
     HFIR = 'HFIR'
     HB2B = 'HB2B'
+    from mantid import ConfigService
 
     # get the old values
     config = ConfigService.Instance()
@@ -119,6 +120,8 @@ def get_ipts_dir(run_number):
     str
         IPTS path: example '/HFIR/HB2B/IPTS-22731/', None for not supported IPTS
     """
+    from mantid.simpleapi import GetIPTS
+
     # try with GetIPTS
     try:
         with archive_search():
@@ -188,6 +191,8 @@ def get_input_project_file(run_number, preferredType='manual'):
 
 
 def get_nexus_file(run_number):
+    from mantid.api import FileFinder
+
     try:
         with archive_search():
             nexus_file = FileFinder.findRuns('HB2B{}'.format(run_number))[0]
@@ -1,8 +1,11 @@
 #!/usr/bin/python
 from mantid.simpleapi import Logger
 import os
+from pyrs.core.instrument_geometry import HidraSetup
 from pyrs.core.nexus_conversion import NeXusConvertingApp
 from pyrs.core.powder_pattern import ReductionApp
+from pyrs.core.reduce_hb2b_pyrs import PIXEL_GEOMETRY_CACHE
+from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode
 
 # DEFAULT VALUES FOR DATA PROCESSING
 DEFAULT_CALIBRATION = None
@@ -10,7 +13,7 @@ DEFAULT_INSTRUMENT = None
 DEFAULT_MASK = None
 
 
-def _nexus_to_subscans(nexusfile, projectfile, mask_file_name, save_project_file):
+def _nexus_to_subscans(nexusfile, projectfile, mask_file_name, save_project_file, workers=1):
     """Split raw data from NeXus file to sub runs/scans
 
     Parameters
@@ -23,6 +26,8 @@ def _nexus_to_subscans(nexusfile, projectfile, mask_file_name, save_project_file
         Mask file name; None for no mask
     save_project_file : str
         Project file to save to.  None for not being saved
+    workers : int
+        number of processes to histogram the events of sub runs
 
     Returns
     -------
@@ -36,7 +41,7 @@ def _nexus_to_subscans(nexusfile, projectfile, mask_file_name, save_project_file
 
     logger.notice('Creating subscans from {} into project file {}'.format(nexusfile, projectfile))
     converter = NeXusConvertingApp(nexusfile, mask_file_name)
-    hydra_ws = converter.convert(use_mantid=False)
+    hydra_ws = converter.convert(use_mantid=False, workers=workers)
 
     # save project file as an option
     if save_project_file:
@@ -46,7 +51,7 @@ def _nexus_to_subscans(nexusfile, projectfile, mask_file_name, save_project_file
 
 
 def _create_powder_patterns(hidra_workspace, instrument, calibration, mask, subruns, project_file_name,
-                            append_mode):
+                            append_mode, workers=1):
     logger.notice('Adding powder patterns to Hidra Workspace{}'.format(hidra_workspace))
 
     reducer = ReductionApp(bool(options.engine == 'mantid'))
@@ -58,11 +63,69 @@ def _create_powder_patterns(hidra_workspace, instrument, calibration, mask, subr
                         calibration_file=calibration,
                         mask=mask,
                         sub_runs=subruns,
-                        van_file=None)
+                        van_file=None,
+                        workers=workers)
 
     reducer.save_diffraction_data(project_file_name, append_mode)
 
 
+def _stream_powder_patterns(nexusfile, projectfile, instrument, calibration, mask_file_name, subruns,
+                            save_counts):
+    """Reduce sub runs from NeXus file to powder patterns one sub run at a time
+
+    Each sub run's counts are histogrammed from events and reduced to powder pattern.  The powder pattern
+    and (optionally) the counts are written to the project file before the next sub run is processed
+
+    Parameters
+    ----------
+    nexusfile : str
+        HB2B event NeXus file's name
+    projectfile : str
+        Target HB2B HiDRA project file's name
+    instrument : str or None
+        instrument configuration file
+    calibration : str or None
+        instrument geometry calibration file
+    mask_file_name : str
+        Mask file name; None for no mask
+    subruns : list
+        sub runs to reduce.  Empty for all
+    save_counts : bool
+        Flag to save the counts of each sub run to the project file
+
+    Returns
+    -------
+    None
+
+    """
+    if os.path.exists(projectfile):
+        logger.information('Removing existing projectfile {}'.format(projectfile))
+        os.remove(projectfile)
+
+    logger.notice('Streaming sub runs from {} into project file {}'.format(nexusfile, projectfile))
+    converter = NeXusConvertingApp(nexusfile, mask_file_name)
+    # sample logs only: counts are streamed
+    hidra_ws = converter.convert(use_mantid=False, load_counts=False)
+    sub_runs = hidra_ws.get_sub_runs().raw_copy()
+
+    project = HidraProjectFile(projectfile, HidraProjectFileMode.OVERWRITE)
+    project.write_instrument_geometry(HidraSetup(hidra_ws.get_instrument_setup()))
+    hidra_ws.save_experimental_data(project, sub_runs=sub_runs, ignore_raw_counts=True)
+
+    reducer = ReductionApp()
+    reducer.load_hidra_workspace(hidra_ws)
+    sub_run_counts = converter.iterate_sub_run_counts(subruns if subruns else None)
+    for sub_run, counts in reducer.reduce_data_streaming(sub_run_counts, instrument_file=instrument,
+                                                         calibration_file=calibration, mask=None):
+        # the yielded counts are the streamed array as they have been removed from the workspace
+        if save_counts:
+            project.append_raw_counts(sub_run, counts)
+        hidra_ws.save_reduced_diffraction_data(project, sub_runs=[sub_run])
+        logger.information('Reduced sub run {}'.format(sub_run))
+
+    project.save()
+
+
 def _view_raw(hidra_workspace, mask, subruns, engine):
     reducer = ReductionApp(bool(engine == 'mantid'))
     # reducer.load_project_file(projectfile)
@@ -79,17 +142,30 @@ def _view_raw(hidra_workspace, mask, subruns, engine):
 
 def reduce_hidra_workflow(user_options):
 
+    # persist pixels' 2theta and eta for the following reductions with the same instrument
+    if user_options.geometrycache:
+        PIXEL_GEOMETRY_CACHE.set_cache_directory(user_options.geometrycache)
+
+    if user_options.stream and not user_options.viewraw:
+        # reduce sub runs without holding all the counts in memory
+        _stream_powder_patterns(user_options.nexus, user_options.project, user_options.instrument,
+                                user_options.calibration, user_options.mask, user_options.subruns,
+                                save_counts=user_options.savecounts)
+        logger.notice('Successful reduced {}'.format(user_options.nexus))
+        return
+
     # split into sub runs fro NeXus file
     hidra_ws = _nexus_to_subscans(user_options.nexus, user_options.project,
                                   mask_file_name=user_options.mask,
-                                  save_project_file=user_options.savecounts)
+                                  save_project_file=user_options.savecounts,
+                                  workers=user_options.workers)
 
     if user_options.viewraw:  # plot data
         _view_raw(hidra_ws, None, user_options.subruns, user_options.engine)
     else:  # add powder patterns
         _create_powder_patterns(hidra_ws, user_options.instrument, user_options.calibration,
                                 None, user_options.subruns, user_options.project,
-                                append_mode=user_options.savecounts)
+                                append_mode=user_options.savecounts, workers=user_options.workers)
         logger.notice('Successful reduced {}'.format(user_options.nexus))
 
 
@@ -115,6 +191,12 @@ if __name__ == '__main__':
                         help='reduction engine (default=%(default)s)')
     parser.add_argument('--viewraw', action='store_true',
                         help='viewing raw data with an option to mask (NO reduction)')
+    parser.add_argument('--geometrycache', default=None,
+                        help='directory to persist pixels\' 2theta and eta among reductions (default=%(default)s)')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='number of processes to convert and reduce sub runs (default=%(default)s)')
+    parser.add_argument('--stream', action='store_true',
+                        help='reduce one sub run at a time without holding all the counts in memory')
     parser.add_argument('--subruns', default=list(), nargs='*', type=int,
                         help='something about subruns (default is all runs)')  # TODO
 
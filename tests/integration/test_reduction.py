@@ -2,6 +2,7 @@ from __future__ import (absolute_import, division, print_function)  # python3 co
 import os
 from pyrs.core.nexus_conversion import NeXusConvertingApp, DEFAULT_KEEP_LOGS
 from pyrs.core.powder_pattern import ReductionApp
+from pyrs.core.reduction_manager import HB2BReductionManager
 from pyrs.dataobjects import HidraConstants
 from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode
 from pyrs.core.workspaces import HidraWorkspace
@@ -183,6 +184,150 @@ def test_reduce_data(mask_file_name, filtered_counts, histogram_counts):
     # TODO add checks for against golden version
 
 
+def test_convert_nexus_workers():
+    """Verify histogramming sub runs' events with a process pool against histogramming serially"""
+    nexus_file = '/HFIR/HB2B/IPTS-22731/nexus/HB2B_1017.ORIG.nxs.h5'
+    hidra_ws = convertNeXusToProject(nexus_file, projectfile=None, skippable=True)
+
+    pool_ws = NeXusConvertingApp(nexus_file).convert(use_mantid=False, workers=3)
+    np.testing.assert_equal(pool_ws.get_sub_runs(), hidra_ws.get_sub_runs())
+    for sub_run in hidra_ws.get_sub_runs():
+        counts = pool_ws.get_detector_counts(sub_run)
+        assert counts.dtype == hidra_ws.get_detector_counts(sub_run).dtype
+        np.testing.assert_equal(counts, hidra_ws.get_detector_counts(sub_run))
+
+
+def test_reduce_data_workers():
+    """Verify reducing sub runs with a process pool against reducing serially"""
+    hidra_ws = convertNeXusToProject('/HFIR/HB2B/IPTS-22731/nexus/HB2B_1017.ORIG.nxs.h5',
+                                     projectfile=None, skippable=True)
+
+    reduced_data_list = list()
+    for workers in [1, 3]:
+        reducer = ReductionApp()
+        reducer.load_hidra_workspace(hidra_ws)
+        reducer.reduce_data(sub_runs=None, instrument_file=None, calibration_file=None, mask=None,
+                            workers=workers)
+        reduced_data_list.append([reducer.get_diffraction_data(sub_run) for sub_run in hidra_ws.get_sub_runs()])
+
+    for serial_data, pool_data in zip(*reduced_data_list):
+        np.testing.assert_equal(pool_data[0], serial_data[0])
+        np.testing.assert_equal(pool_data[1], serial_data[1])
+
+
+def test_reduce_data_lazy():
+    """Verify reducing sub runs on demand against reducing all of them in advance"""
+    hidra_ws = convertNeXusToProject('/HFIR/HB2B/IPTS-22731/nexus/HB2B_1017.ORIG.nxs.h5',
+                                     projectfile=None, skippable=True)
+    sub_runs = hidra_ws.get_sub_runs()
+
+    reducer = ReductionApp()
+    reducer.load_hidra_workspace(hidra_ws)
+    reducer.reduce_data(sub_runs=None, instrument_file=None, calibration_file=None, mask=None)
+    reduced_data_list = [reducer.get_diffraction_data(sub_run) for sub_run in sub_runs]
+
+    # reduced data from the same inputs would not be reduced again
+    hidra_ws.reset_diffraction_data()
+    reducer.reduce_data(sub_runs=None, instrument_file=None, calibration_file=None, mask=None, lazy=True)
+    assert hidra_ws.get_pending_sub_runs() == list(sub_runs)
+
+    # reduce the last sub run only
+    vec_2theta, vec_intensity = hidra_ws.get_reduced_diffraction_data(sub_runs[-1])
+    assert hidra_ws.get_pending_sub_runs() == list(sub_runs[:-1])
+    np.testing.assert_equal(vec_2theta, reduced_data_list[-1][0])
+    np.testing.assert_equal(vec_intensity, reduced_data_list[-1][1])
+
+    # reduce the rest
+    for sub_run, (exp_2theta, exp_intensity) in zip(sub_runs, reduced_data_list):
+        vec_2theta, vec_intensity = reducer.get_diffraction_data(sub_run)
+        np.testing.assert_equal(vec_2theta, exp_2theta)
+        np.testing.assert_equal(vec_intensity, exp_intensity)
+    assert hidra_ws.get_pending_sub_runs() == list()
+
+
+def test_reduce_data_incremental():
+    """Verify that only the sub runs with changed inputs are reduced again"""
+    hidra_ws = convertNeXusToProject('/HFIR/HB2B/IPTS-22731/nexus/HB2B_1017.ORIG.nxs.h5',
+                                     projectfile=None, skippable=True)
+    sub_runs = list(hidra_ws.get_sub_runs())
+
+    reducer = ReductionApp()
+    reducer.load_hidra_workspace(hidra_ws)
+    reducer.reduce_data(sub_runs=None, instrument_file=None, calibration_file=None, mask=None)
+    fingerprints = [hidra_ws.get_reduction_fingerprint(sub_run) for sub_run in sub_runs]
+    assert None not in fingerprints
+    intensity_matrix = hidra_ws.get_reduced_diffraction_data_set()[1]
+
+    # change counts of the first sub run
+    hidra_ws.set_raw_counts(sub_runs[0], hidra_ws.get_detector_counts(sub_runs[0]) * 2)
+    reducer.reduce_data(sub_runs=None, instrument_file=None, calibration_file=None, mask=None)
+
+    new_fingerprints = [hidra_ws.get_reduction_fingerprint(sub_run) for sub_run in sub_runs]
+    assert new_fingerprints[0] != fingerprints[0]
+    assert new_fingerprints[1:] == fingerprints[1:]
+    new_intensity_matrix = hidra_ws.get_reduced_diffraction_data_set()[1]
+    np.testing.assert_allclose(new_intensity_matrix[0], intensity_matrix[0] * 2)
+    np.testing.assert_equal(new_intensity_matrix[1:], intensity_matrix[1:])
+
+
+def test_reduce_data_streaming():
+    """Verify reducing sub runs streamed from events one at a time against reducing the converted workspace"""
+    nexus_file = '/HFIR/HB2B/IPTS-22731/nexus/HB2B_1017.ORIG.nxs.h5'
+    hidra_ws = convertNeXusToProject(nexus_file, projectfile=None, skippable=True)
+    reducer = ReductionApp()
+    reducer.load_hidra_workspace(hidra_ws)
+    reducer.reduce_data(sub_runs=None, instrument_file=None, calibration_file=None, mask=None)
+
+    converter = NeXusConvertingApp(nexus_file)
+    stream_ws = converter.convert(use_mantid=False, load_counts=False)
+    stream_reducer = ReductionApp()
+    stream_reducer.load_hidra_workspace(stream_ws)
+    for sub_run, counts in stream_reducer.reduce_data_streaming(converter.iterate_sub_run_counts(),
+                                                                instrument_file=None, calibration_file=None,
+                                                                mask=None):
+        np.testing.assert_equal(counts, hidra_ws.get_detector_counts(sub_run))
+        assert not stream_ws.has_raw_data(sub_run)
+
+    for exp_data, stream_data in zip(hidra_ws.get_reduced_diffraction_data_set(),
+                                     stream_ws.get_reduced_diffraction_data_set()):
+        np.testing.assert_equal(stream_data, exp_data)
+
+
+def test_reduce_merged_sub_runs():
+    """Verify that merging sub runs before reduction is the duration weighted sum of their patterns"""
+    hidra_ws = convertNeXusToProject('/HFIR/HB2B/IPTS-22731/nexus/HB2B_1017.ORIG.nxs.h5',
+                                     projectfile=None, skippable=True)
+    sub_runs = [sub_run for sub_run in hidra_ws.get_sub_runs()
+                if hidra_ws.get_detector_2theta(sub_run) == hidra_ws.get_detector_2theta(hidra_ws.get_sub_runs()[0])]
+    mask_vec = hidra_ws.get_detector_mask(is_default=True)
+
+    manager = HB2BReductionManager()
+    manager.init_session('merge', hidra_ws)
+    bin_centers, intensity, variances = manager.reduce_merged_sub_runs(hidra_ws, sub_runs, None, mask_vec)
+
+    # reduce sub runs individually to the same bins
+    bin_edges = np.concatenate([[1.5 * bin_centers[0] - 0.5 * bin_centers[1]],
+                                0.5 * (bin_centers[1:] + bin_centers[:-1]),
+                                [1.5 * bin_centers[-1] - 0.5 * bin_centers[-2]]])
+    intensity_matrix = manager.reduce_sub_runs_to_common_bins(hidra_ws, sub_runs, None, mask_vec, bin_edges,
+                                                              unit='2theta')[1]
+    durations = hidra_ws.get_sample_log_values(HidraConstants.SUB_RUN_DURATION, sub_runs)
+    np.testing.assert_allclose(intensity, np.sum(intensity_matrix, axis=0) / np.sum(durations))
+    assert variances.shape == intensity.shape
+
+
+def test_reduce_data_shared_bins():
+    """Verify that sub runs at all detector positions are reduced to the same 2theta bins"""
+    hidra_ws = convertNeXusToProject('/HFIR/HB2B/IPTS-22731/nexus/HB2B_1017.ORIG.nxs.h5',
+                                     projectfile=None, skippable=True)
+    reducer = ReductionApp()
+    reducer.load_hidra_workspace(hidra_ws)
+    reducer.reduce_data(sub_runs=None, instrument_file=None, calibration_file=None, mask=None, shared_bins=True)
+
+    two_theta_matrix = hidra_ws.get_reduced_diffraction_data_set()[0]
+    np.testing.assert_equal(two_theta_matrix, np.repeat(two_theta_matrix[:1], two_theta_matrix.shape[0], axis=0))
+
+
 def test_split_log_time_average():
     """(Integration) test on doing proper time average on split sample logs
 
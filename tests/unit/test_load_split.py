@@ -3,9 +3,15 @@ from pyrs.projectfile import HidraProjectFile
 from pyrs.utilities import calibration_file_io
 from pyrs.core import workspaces
 import numpy as np
-from pyrs.core.nexus_conversion import NeXusConvertingApp
+from pyrs.core.nexus_conversion import NeXusConvertingApp, TimeSeriesLog, calculate_sub_run_time_average
+from pyrs.core.nexus_conversion import calculate_sub_runs_time_average, load_nexus_logs
+from pyrs.core.nexus_conversion import HIDRA_PIXEL_NUMBER, histogram_event_ids
+from pyrs.core.nexus_conversion import EventFilter, FilterSplitter
+import h5py
+import importlib
 import os
 import pytest
+import sys
 
 FILE_1017 = '/HFIR/HB2B/IPTS-22731/nexus/HB2B_1017.ORIG.nxs.h5'
 
@@ -69,5 +75,195 @@ def test_log_time_average():
     np.testing.assert_allclose(sample_logs['2theta'], [69.99525,  80.,  97.50225])
 
 
+def test_calculate_sub_run_time_average():
+    """Test the time average of a log in sub runs' time ranges"""
+    start = np.datetime64('2019-11-10T16:30:00')
+    log_times = start + np.array([0, 5, 12, 205, 300, 415]) * np.timedelta64(1, 's')
+    log_property = TimeSeriesLog(log_times, np.array([30., 35., 35.01, 40., 42., 50.]))
+
+    def time_filter(start_second, stop_second):
+        return start + start_second * np.timedelta64(1, 's'), start + stop_second * np.timedelta64(1, 's')
+
+    # value changes within the time range
+    assert calculate_sub_run_time_average(log_property, time_filter(10, 200)) == \
+        pytest.approx((35. * 2 + 35.01 * 188) / 190.)
+    # value is recorded before the time range
+    assert calculate_sub_run_time_average(log_property, time_filter(500, 600)) == pytest.approx(50.)
+    # time range is before the first value in log
+    assert calculate_sub_run_time_average(log_property, time_filter(-20, -10)) == pytest.approx(30.)
+    # whole log
+    assert calculate_sub_run_time_average(log_property, None) == \
+        pytest.approx((30. * 5 + 35. * 7 + 35.01 * 193 + 40. * 95 + 42. * 115) / 415.)
+
+    # all sub runs at once agree with the sub runs one by one
+    start_seconds, stop_seconds = np.array([-20, 0, 10, 203, 500, 700]), np.array([-10, 415, 200, 310, 600, 700])
+    start_times, stop_times = time_filter(start_seconds, stop_seconds)
+    expected = [calculate_sub_run_time_average(log_property, time_filter(start_second, stop_second))
+                for start_second, stop_second in zip(start_seconds, stop_seconds)]
+    np.testing.assert_allclose(calculate_sub_runs_time_average(log_property, start_times, stop_times), expected)
+    # sub run without duration takes the first value
+    assert expected[-1] == 30.
+
+
+def test_load_nexus_logs(tmpdir):
+    """Test loading sample logs from NeXus entry and DASlogs"""
+    nexus_name = str(tmpdir.join('HB2B_logs.nxs.h5'))
+    with h5py.File(nexus_name, 'w') as nexus_h5:
+        entry = nexus_h5.create_group('entry')
+        entry.create_dataset('title', data=[b'run title'])
+        entry.create_dataset('duration', data=np.array([600.], dtype='float32'))
+        log_group = entry.create_group('DASlogs').create_group('2theta')
+        log_group.create_dataset('value', data=np.array([35., 40.]))
+        log_times = log_group.create_dataset('time', data=np.array([10., 0.]))
+        log_times.attrs['start'] = np.bytes_('2019-11-10T16:30:00')
+        log_times.attrs['units'] = np.bytes_('second')
+
+    with h5py.File(nexus_name, 'r') as nexus_h5:
+        sample_logs = load_nexus_logs(nexus_h5, ['2theta', 'run_title', 'duration', 'omega'])
+
+    assert sorted(sample_logs.keys()) == ['2theta', 'duration', 'run_title']
+    assert sample_logs['run_title'] == 'run title'
+    assert sample_logs['duration'] == 600.
+    # log is sorted by time
+    np.testing.assert_equal(sample_logs['2theta'].value, [40., 35.])
+    np.testing.assert_equal(sample_logs['2theta'].times,
+                            np.array(['2019-11-10T16:30:00', '2019-11-10T16:30:10'], dtype='datetime64[ns]'))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+def test_histogram_event_ids(tmpdir, chunk_size):
+    """Test histogramming event IDs read from NeXus chunk by chunk"""
+    event_ids = np.random.RandomState(2019).randint(0, HIDRA_PIXEL_NUMBER, size=100).astype('uint32')
+    nexus_name = str(tmpdir.join('HB2B_events.nxs.h5'))
+    with h5py.File(nexus_name, 'w') as nexus_h5:
+        nexus_h5.create_dataset('event_id', data=event_ids)
+
+    with h5py.File(nexus_name, 'r') as nexus_h5:
+        # range of events
+        hist = histogram_event_ids(nexus_h5['event_id'], 15, 62, chunk_size)
+        np.testing.assert_equal(hist, np.bincount(event_ids[15:62], minlength=HIDRA_PIXEL_NUMBER))
+        # stop index beyond the last event
+        hist = histogram_event_ids(nexus_h5['event_id'], 0, event_ids.size + 1, chunk_size)
+        np.testing.assert_equal(hist, np.bincount(event_ids, minlength=HIDRA_PIXEL_NUMBER))
+        # empty range
+        assert histogram_event_ids(nexus_h5['event_id'], 50, 50, chunk_size).sum() == 0
+
+
+def test_filter_splitter():
+    """Test splitting a run to sub runs by time windows and log value ranges"""
+    start = np.datetime64('2019-11-10T16:30:00')
+    seconds = np.timedelta64(1, 's')
+    sample_logs = {'2theta': TimeSeriesLog(start + np.array([0, 5, 12, 205, 300, 415]) * seconds,
+                                           np.array([30., 35., 35.01, 40., 42., 50.]))}
+
+    def split(event_filter):
+        splitter = FilterSplitter(sample_logs, event_filter, start, start + 600 * seconds)
+        np.testing.assert_equal(splitter.subruns, np.arange(1, splitter.durations.size + 1))
+        return (splitter.times[::2] - start) / seconds, (splitter.times[1::2] - start) / seconds
+
+    # time windows only: adjacent windows are different sub runs and windows are clipped to the run
+    np.testing.assert_equal(split(EventFilter(time_windows=[(0, 100), (100, 150), (300, 700)])),
+                            ([0, 100, 300], [100, 150, 600]))
+    # log value range only: contiguous time range with the values in range is one sub run
+    np.testing.assert_equal(split(EventFilter(log_value_ranges={'2theta': (35., 41.)})), ([5], [300]))
+    np.testing.assert_equal(split(EventFilter(log_value_ranges={'2theta': (None, 35.005)})), ([0], [12]))
+    # both
+    np.testing.assert_equal(split(EventFilter([(0, 100), (200, 400)], {'2theta': (35., None)})),
+                            ([5, 200], [100, 400]))
+    # no filter is the whole run
+    np.testing.assert_equal(split(EventFilter()), ([0], [600]))
+
+    # nothing passes the filter
+    with pytest.raises(RuntimeError):
+        split(EventFilter(log_value_ranges={'2theta': (100., None)}))
+    # log does not exist
+    with pytest.raises(RuntimeError):
+        split(EventFilter(log_value_ranges={'omega': (0., 1.)}))
+    # overlapping time windows
+    with pytest.raises(RuntimeError):
+        EventFilter(time_windows=[(0, 100), (50, 150)])
+    # empty log value range
+    with pytest.raises(RuntimeError):
+        EventFilter(log_value_ranges={'2theta': (40., 35.)})
+
+
+def _create_nexus(nexus_name, num_pulses=3000, events_per_pulse=20):
+    """Create a NeXus file of 3 sub runs with random events in 300 seconds"""
+    np.random.seed(2019)
+
+    def add_log(das_logs, log_name, log_times, log_values):
+        log_group = das_logs.create_group(log_name)
+        time_set = log_group.create_dataset('time', data=np.array(log_times, dtype=float))
+        time_set.attrs['start'] = np.bytes_('2019-11-10T16:30:00')
+        time_set.attrs['units'] = np.bytes_('second')
+        log_group.create_dataset('value', data=np.array(log_values))
+
+    with h5py.File(nexus_name, 'w') as nexus_h5:
+        entry = nexus_h5.create_group('entry')
+        entry.create_dataset('duration', data=np.array([300.], dtype='float32'))
+        das_logs = entry.create_group('DASlogs')
+        add_log(das_logs, 'scan_index', [0, 10, 100, 200, 290], [0, 1, 2, 3, 0])
+        add_log(das_logs, '2theta', [0, 100, 200], [80., 85., 90.])
+        add_log(das_logs, 'mrot', [0], [-9.])
+
+        bank1_events = entry.create_group('bank1_events')
+        pulse_times = bank1_events.create_dataset('event_time_zero', data=np.arange(num_pulses) * 0.1)
+        pulse_times.attrs['offset'] = np.bytes_('2019-11-10T16:30:00')
+        pulse_times.attrs['units'] = np.bytes_('second')
+        bank1_events.create_dataset('event_index', data=np.arange(num_pulses, dtype='uint64') * events_per_pulse)
+        bank1_events.create_dataset('event_id', data=np.random.randint(0, HIDRA_PIXEL_NUMBER,
+                                                                       num_pulses * events_per_pulse,
+                                                                       dtype='uint32'))
+        bank1_events.create_dataset('total_counts', data=[num_pulses * events_per_pulse])
+
+
+def test_convert_workers(tmpdir):
+    """Test histogramming sub runs' events with a process pool against histogramming serially"""
+    nexus_name = str(tmpdir.join('HB2B_synthetic.nxs.h5'))
+    _create_nexus(nexus_name)
+
+    serial_ws = NeXusConvertingApp(nexus_name).convert()
+    np.testing.assert_equal(serial_ws.get_sub_runs(), [1, 2, 3])
+    # sub runs of 90, 100 and 90 seconds with 200 events per second
+    assert [serial_ws.get_detector_counts(sub_run).sum() for sub_run in [1, 2, 3]] == [18000, 20000, 18000]
+
+    pool_ws = NeXusConvertingApp(nexus_name).convert(workers=2)
+    np.testing.assert_equal(pool_ws.get_sub_runs(), serial_ws.get_sub_runs())
+    for sub_run in serial_ws.get_sub_runs():
+        counts = pool_ws.get_detector_counts(sub_run)
+        assert counts.dtype == serial_ws.get_detector_counts(sub_run).dtype
+        np.testing.assert_equal(counts, serial_ws.get_detector_counts(sub_run))
+    np.testing.assert_equal(pool_ws.get_sample_log_values('2theta'), [80., 85., 90.])
+
+    # sub runs are yielded in order
+    converter = NeXusConvertingApp(nexus_name)
+    assert [sub_run for sub_run, _ in converter.iterate_sub_run_counts([3, 1], workers=2)] == [1, 3]
+
+
+def test_convert_without_mantid(tmpdir, monkeypatch):
+    """Test converting a NeXus file with a mask while Mantid cannot be imported"""
+    nexus_name = str(tmpdir.join('HB2B_synthetic.nxs.h5'))
+    _create_nexus(nexus_name)
+    mask_name = str(tmpdir.join('HB2B_mask.xml'))
+    with open(mask_name, 'w') as mask_file:
+        mask_file.write('<?xml version="1.0"?>\n<detector-masking>\n\t<group>\n'
+                        '\t\t<detids>0-1023,2048,4096-5119</detids>\n\t</group>\n</detector-masking>\n')
+
+    # import the module again with any import of mantid failing
+    for module_name in ['mantid', 'mantid.simpleapi', 'mantid.kernel', 'mantid.api']:
+        monkeypatch.setitem(sys.modules, module_name, None)
+    monkeypatch.delitem(sys.modules, 'pyrs.core.nexus_conversion')
+    nexus_conversion = importlib.import_module('pyrs.core.nexus_conversion')
+
+    converter = nexus_conversion.NeXusConvertingApp(nexus_name, mask_file_name=mask_name)
+    assert converter.mask_array.sum() == HIDRA_PIXEL_NUMBER - 2049
+    hidra_ws = converter.convert()
+    np.testing.assert_equal(hidra_ws.get_sub_runs(), [1, 2, 3])
+    for sub_run in hidra_ws.get_sub_runs():
+        counts = hidra_ws.get_detector_counts(sub_run)
+        assert counts[:1024].sum() == counts[2048] == counts[4096:5120].sum() == 0
+        assert counts.sum() > 0
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
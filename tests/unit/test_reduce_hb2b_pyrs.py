@@ -0,0 +1,458 @@
+from __future__ import (absolute_import, division, print_function)  # python3 compatibility
+from pyrs.core.instrument_geometry import AnglerCameraDetectorGeometry, AnglerCameraDetectorShift
+from pyrs.core.reduce_hb2b_pyrs import ResidualStressInstrument, PixelBinningPlan, PyHB2BReduction, locate_bins
+from pyrs.core.reduce_hb2b_pyrs import PixelSplittingBinningPlan, PixelWedgeBinningPlan
+from pyrs.core.reduce_hb2b_pyrs import PixelGeometryCache, PIXEL_GEOMETRY_CACHE
+import numpy as np
+import pytest
+
+NUM_PIXEL_1D = 128
+
+
+def _create_reduction_engine(two_theta=85., seed=1):
+    """Create a reduction engine of a small detector with random counts"""
+    np.random.seed(seed)
+    setup = AnglerCameraDetectorGeometry(NUM_PIXEL_1D, NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D,
+                                         0.985, False)
+    engine = PyHB2BReduction(setup)
+    engine.set_experimental_data(two_theta, None, np.random.poisson(3., NUM_PIXEL_1D**2))
+    engine.build_instrument(None)
+
+    return engine
+
+
+def _create_mask_and_vanadium(seed=2):
+    np.random.seed(seed)
+    mask = np.ones(NUM_PIXEL_1D**2, dtype=int)
+    mask[:NUM_PIXEL_1D * 8] = 0
+    vanadium = np.random.poisson(4., NUM_PIXEL_1D**2).astype(float)
+
+    return mask, vanadium
+
+
+@pytest.mark.parametrize('use_mask, use_vanadium', [(False, False), (True, False), (True, True)],
+                         ids=['NoMask', 'Mask', 'MaskVanadium'])
+def test_binning_plan(use_mask, use_vanadium):
+    """Test histogramming with pixel to 2theta bin plan against numpy histogram"""
+    engine = _create_reduction_engine()
+    mask, vanadium = _create_mask_and_vanadium()
+    if not use_mask:
+        mask = None
+    if not use_vanadium:
+        vanadium = None
+
+    pixel_2theta = engine.instrument.get_pixels_2theta(1)
+    bin_edges = np.linspace(pixel_2theta.min() + 0.2, pixel_2theta.max() - 0.2, 201)
+    counts = engine._detector_counts
+
+    # expected from numpy histogram
+    if mask is None:
+        exp_data = engine.histogram_by_numpy(pixel_2theta, counts.astype(float), bin_edges, True, vanadium)
+    else:
+        keep = mask == 1
+        exp_data = engine.histogram_by_numpy(pixel_2theta[keep], counts[keep].astype(float), bin_edges, True,
+                                             None if vanadium is None else vanadium[keep])
+
+    plan = PixelBinningPlan(pixel_2theta, bin_edges, mask, vanadium)
+    plan_data = plan.histogram(counts, is_point_data=True)
+
+    for exp_vec, plan_vec in zip(exp_data, plan_data):
+        np.testing.assert_allclose(plan_vec, exp_vec, rtol=1E-10, equal_nan=True)
+
+
+@pytest.mark.parametrize('uniform_bins', [True, False], ids=['Uniform', 'NonUniform'])
+def test_locate_bins(uniform_bins):
+    """Test locating pixels' bins against numpy histogram including values on bin edges"""
+    np.random.seed(3)
+    if uniform_bins:
+        bin_edges = np.arange(101) * 0.0123 + 79.4
+    else:
+        bin_edges = np.sort(np.random.uniform(79.4, 80.6, 101))
+    x_array = np.concatenate([np.random.uniform(79., 81., 10000), bin_edges, [np.nan]])
+    np.random.shuffle(x_array)
+
+    bin_index_array = locate_bins(x_array, bin_edges)
+    in_range = (bin_index_array >= 0) & (bin_index_array < 100)
+    np.testing.assert_equal(np.bincount(bin_index_array[in_range], minlength=100),
+                            np.histogram(x_array[np.isfinite(x_array)], bin_edges)[0])
+    assert bin_index_array[np.isnan(x_array)][0] == 100
+
+
+def test_histogram_by_numpy():
+    """Test histogramming counts, variances and vanadium in one pass against numpy histogram"""
+    np.random.seed(4)
+    two_theta_array = np.random.uniform(75., 95., 5000)
+    counts_array = np.random.poisson(2., 5000).astype(float)
+    counts_array[:10] = np.nan
+    vanadium_array = np.random.poisson(3., 5000).astype(float)
+    bin_edges = np.linspace(76., 94., 91)
+
+    bin_centers, hist, variances = PyHB2BReduction.histogram_by_numpy(two_theta_array, counts_array, bin_edges,
+                                                                      True, vanadium_array)
+
+    # expected: pixels with NaN or no vanadium counts are excluded
+    keep = np.isfinite(counts_array) & (vanadium_array >= 0.9)
+    exp_counts = np.histogram(two_theta_array[keep], bin_edges, weights=counts_array[keep])[0]
+    exp_var = np.histogram(two_theta_array[keep], bin_edges, weights=np.maximum(counts_array[keep], 1.))[0]
+    exp_van = np.histogram(two_theta_array[keep], bin_edges, weights=vanadium_array[keep])[0]
+    exp_van_var = np.histogram(two_theta_array[keep], bin_edges, weights=np.maximum(vanadium_array[keep], 1.))[0]
+
+    np.testing.assert_allclose(bin_centers, 0.5 * (bin_edges[1:] + bin_edges[:-1]))
+    np.testing.assert_allclose(hist, exp_counts / exp_van, rtol=1.E-12)
+    np.testing.assert_allclose(variances, np.sqrt(exp_var / exp_counts**2 + exp_van_var / exp_van**2) * hist,
+                               rtol=1.E-12)
+
+
+def test_binning_plan_reuse():
+    """Test that the binning plan is reused among sub runs with the same detector position"""
+    engine = _create_reduction_engine()
+    mask, vanadium = _create_mask_and_vanadium()
+    pixel_2theta = engine.instrument.get_pixels_2theta(1)
+    bin_edges = np.linspace(pixel_2theta.min(), pixel_2theta.max(), 101)
+
+    engine.reduce_to_2theta_histogram(bin_edges, mask, True, vanadium)
+    plan = engine.get_binning_plan(bin_edges, mask, vanadium)
+
+    # new counts: same plan
+    engine.set_raw_counts(np.random.poisson(5., NUM_PIXEL_1D**2))
+    engine.reduce_to_2theta_histogram(bin_edges, mask, True, vanadium)
+    assert engine.get_binning_plan(bin_edges, mask, vanadium) is plan
+
+    # different bins or mask: new plan
+    assert engine.get_binning_plan(bin_edges[:-1], mask, vanadium) is not plan
+    assert engine.get_binning_plan(bin_edges, mask.copy(), vanadium) is not plan
+
+    # NaN in counts shall be excluded as numpy histogram does
+    counts = np.random.poisson(5., NUM_PIXEL_1D**2).astype(float)
+    counts[NUM_PIXEL_1D * 20] = np.nan
+    engine.set_raw_counts(counts)
+    two_theta, intensity, variances = engine.reduce_to_2theta_histogram(bin_edges, None, True, None)
+    assert np.all(np.isfinite(intensity))
+
+
+def test_binning_plan_vanadium_histogram():
+    """Test binning plan with vanadium histogram of another plan against histogramming vanadium itself"""
+    engine = _create_reduction_engine()
+    mask, vanadium = _create_mask_and_vanadium()
+    pixel_2theta = engine.instrument.get_pixels_2theta(1)
+    bin_edges = np.linspace(pixel_2theta.min(), pixel_2theta.max(), 101)
+    counts = np.random.poisson(5., (2, NUM_PIXEL_1D**2))
+
+    plan = PixelBinningPlan(pixel_2theta, bin_edges, mask, vanadium)
+    exp_data = plan.histogram(counts)
+
+    van_hist, van_var = plan.vanadium_histogram
+    assert van_hist.shape == (100,)
+    reused_plan = PixelBinningPlan(pixel_2theta, bin_edges, mask, vanadium, vanadium_histogram=(van_hist, van_var))
+    for exp_array, array in zip(exp_data, reused_plan.histogram(counts)):
+        np.testing.assert_equal(array, exp_array)
+
+    # histogram shall match the bins
+    with pytest.raises(RuntimeError):
+        PixelBinningPlan(pixel_2theta, bin_edges[:-1], mask, vanadium, vanadium_histogram=(van_hist, van_var))
+
+    # no vanadium
+    assert PixelBinningPlan(pixel_2theta, bin_edges, mask).vanadium_histogram is None
+
+
+@pytest.mark.parametrize('pixel_splitting', [False, True])
+def test_binning_plan_integer_counts(pixel_splitting):
+    """Test that compact integer counts are histogrammed the same as float counts"""
+    engine = _create_reduction_engine()
+    mask, vanadium = _create_mask_and_vanadium()
+    pixel_2theta = engine.instrument.get_pixels_2theta(1)
+    bin_edges = np.linspace(pixel_2theta.min(), pixel_2theta.max(), 101)
+    counts = np.random.poisson(5., (2, NUM_PIXEL_1D**2)).astype(np.uint16)
+
+    if pixel_splitting:
+        min_2theta, max_2theta = engine.instrument.get_pixels_2theta_footprint()
+        plan = PixelSplittingBinningPlan(min_2theta, max_2theta, bin_edges, mask, vanadium)
+    else:
+        plan = PixelBinningPlan(pixel_2theta, bin_edges, mask, vanadium)
+    for exp_array, array in zip(plan.histogram(counts.astype('float64')), plan.histogram(counts)):
+        np.testing.assert_equal(array, exp_array)
+
+
+def test_binning_plan_non_finite_counts():
+    """Test that pixels with NaN or infinity counts are excluded from counts and vanadium"""
+    engine = _create_reduction_engine()
+    mask, vanadium = _create_mask_and_vanadium()
+    pixel_2theta = engine.instrument.get_pixels_2theta(1)
+    bin_edges = np.linspace(pixel_2theta.min(), pixel_2theta.max(), 101)
+
+    counts_matrix = np.random.poisson(3., (3, NUM_PIXEL_1D**2)).astype(float)
+    counts_matrix[1, ::97] = np.nan
+    counts_matrix[2, 5000] = np.inf
+    plan = PixelBinningPlan(pixel_2theta, bin_edges, mask, vanadium)
+    two_theta, intensity_matrix, variances_matrix = plan.histogram(counts_matrix)
+
+    keep = mask == 1
+    for row_index in range(3):
+        exp_data = engine.histogram_by_numpy(pixel_2theta[keep], counts_matrix[row_index][keep], bin_edges, True,
+                                             vanadium[keep])
+        np.testing.assert_allclose(intensity_matrix[row_index], exp_data[1], rtol=1E-10, equal_nan=True)
+        np.testing.assert_allclose(variances_matrix[row_index], exp_data[2], rtol=1E-10, equal_nan=True)
+
+
+def test_wedge_binning_plan():
+    """Test histogramming all the eta wedges at once against histogramming wedge by wedge"""
+    engine = _create_reduction_engine(two_theta=-85.)
+    _, vanadium = _create_mask_and_vanadium()
+    pixel_2theta = engine.instrument.get_pixels_2theta(1)
+    eta_array = engine.get_eta_value()
+
+    wedge_pixels_list = list()
+    bin_edges_list = list()
+    for eta_center in [-3., 0., 3.]:
+        # overlapped wedges
+        wedge_pixels = np.abs(eta_array - eta_center) <= 2.
+        wedge_pixels_list.append(wedge_pixels)
+        bin_edges_list.append(np.linspace(pixel_2theta[wedge_pixels].min(), pixel_2theta[wedge_pixels].max(), 51))
+
+    plan = PixelWedgeBinningPlan(pixel_2theta, wedge_pixels_list, bin_edges_list, vanadium)
+    bins, intensity_matrix, variances_matrix = plan.histogram(engine._detector_counts)
+    assert intensity_matrix.shape == (3, 50)
+
+    for wedge_index in range(3):
+        wedge_plan = PixelBinningPlan(pixel_2theta, bin_edges_list[wedge_index],
+                                      wedge_pixels_list[wedge_index].astype(int), vanadium)
+        exp_data = wedge_plan.histogram(engine._detector_counts)
+        np.testing.assert_allclose(bins[wedge_index], exp_data[0])
+        np.testing.assert_allclose(intensity_matrix[wedge_index], exp_data[1], rtol=1E-12, equal_nan=True)
+        np.testing.assert_allclose(variances_matrix[wedge_index], exp_data[2], rtol=1E-12, equal_nan=True)
+
+
+def test_pixel_splitting():
+    """Test splitting pixels' counts to the 2theta bins overlapped by pixels"""
+    engine = _create_reduction_engine()
+    mask, vanadium = _create_mask_and_vanadium()
+    pixel_2theta = engine.instrument.get_pixels_2theta(1)
+    min_2theta, max_2theta = engine.instrument.get_pixels_2theta_footprint()
+    assert np.all(min_2theta <= pixel_2theta) and np.all(pixel_2theta <= max_2theta)
+    assert 0. < np.median(max_2theta - min_2theta) < 0.3 / NUM_PIXEL_1D / 0.985 * 180. / np.pi * 1.5
+
+    # pixels without width are same as not being split
+    bin_edges = np.linspace(pixel_2theta.min() + 0.2, pixel_2theta.max() - 0.2, 101)
+    exp_data = PixelBinningPlan(pixel_2theta, bin_edges, mask, vanadium).histogram(engine._detector_counts)
+    plan = PixelSplittingBinningPlan(pixel_2theta, pixel_2theta, bin_edges, mask, vanadium)
+    for exp_vec, plan_vec in zip(exp_data, plan.histogram(engine._detector_counts)):
+        np.testing.assert_allclose(plan_vec, exp_vec, rtol=1E-12, equal_nan=True)
+
+    # counts are conserved with fine bins covering all the pixels
+    bin_edges = np.linspace(min_2theta.min(), max_2theta.max(), 2001)
+    plan = PixelSplittingBinningPlan(min_2theta, max_2theta, bin_edges)
+    two_theta, intensity, variances = plan.histogram(engine._detector_counts)
+    np.testing.assert_allclose(intensity.sum(), engine._detector_counts.sum())
+    assert np.count_nonzero(intensity == 0.) == 0
+
+    # engine option
+    split_engine = PyHB2BReduction(engine.instrument_setup, pixel_splitting=True)
+    split_engine.set_experimental_data(85., None, engine._detector_counts)
+    split_engine.build_instrument(None)
+    split_data = split_engine.reduce_to_2theta_histogram(bin_edges, None, True, None)
+    np.testing.assert_allclose(split_data[1], intensity)
+
+
+def test_reduce_sub_runs_dspacing():
+    """Test reducing sub runs to d-spacing and Q bins against numpy histogram of converted pixels' 2theta"""
+    engine = _create_reduction_engine()
+    wave_length = 1.54
+    pixel_2theta = engine.instrument.get_pixels_2theta(1)
+    counts_matrix = np.random.poisson(3., (2, NUM_PIXEL_1D**2))
+
+    # pixels' d-spacing and Q are converted once for the instrument built
+    pixel_d = engine.instrument.get_pixels_values('dSpacing', wave_length)
+    np.testing.assert_allclose(pixel_d, 0.5 * wave_length / np.sin(np.deg2rad(0.5 * pixel_2theta)))
+    assert engine.instrument.get_pixels_values('dSpacing', wave_length) is pixel_d
+    pixel_q = engine.instrument.get_pixels_values('Q', wave_length)
+    np.testing.assert_allclose(pixel_q, 2. * np.pi / pixel_d)
+
+    for unit, pixel_x in [('dSpacing', pixel_d), ('Q', pixel_q)]:
+        bin_edges = np.linspace(pixel_x.min(), pixel_x.max(), 51)
+        bins, intensity_matrix, variances_matrix = \
+            engine.reduce_sub_runs_to_histogram(counts_matrix, bin_edges, None, False, None, unit, wave_length)
+        np.testing.assert_equal(bins, bin_edges)
+        for counts, intensity in zip(counts_matrix, intensity_matrix):
+            np.testing.assert_allclose(intensity, np.histogram(pixel_x, bin_edges, weights=counts)[0])
+
+    # 2theta plan is rebuilt
+    bin_edges = np.linspace(pixel_2theta.min(), pixel_2theta.max(), 51)
+    intensity_matrix = engine.reduce_sub_runs_to_2theta_histogram(counts_matrix, bin_edges, None, False)[1]
+    np.testing.assert_allclose(intensity_matrix[0], np.histogram(pixel_2theta, bin_edges,
+                                                                 weights=counts_matrix[0])[0])
+
+    # rebuilt instrument: converted again
+    engine.set_experimental_data(80., None, counts_matrix[0])
+    engine.build_instrument(None)
+    assert engine.instrument.get_pixels_values('dSpacing', wave_length) is not pixel_d
+
+    with pytest.raises(RuntimeError):
+        engine.instrument.get_pixels_values('dSpacing')
+
+
+def test_reduce_sub_runs():
+    """Test reducing multiple sub runs in one shot against reducing them one by one"""
+    engine = _create_reduction_engine()
+    mask, vanadium = _create_mask_and_vanadium()
+    pixel_2theta = engine.instrument.get_pixels_2theta(1)
+    bin_edges = np.linspace(pixel_2theta.min(), pixel_2theta.max(), 101)
+
+    counts_matrix = np.random.poisson(3., (4, NUM_PIXEL_1D**2))
+    two_theta, intensity_matrix, variances_matrix = \
+        engine.reduce_sub_runs_to_2theta_histogram(counts_matrix, bin_edges, mask, True, vanadium)
+    assert intensity_matrix.shape == (4, 100)
+
+    for row_index in range(4):
+        engine.set_raw_counts(counts_matrix[row_index])
+        exp_data = engine.reduce_to_2theta_histogram(bin_edges, mask, True, vanadium)
+        np.testing.assert_allclose(two_theta, exp_data[0])
+        np.testing.assert_allclose(intensity_matrix[row_index], exp_data[1], equal_nan=True)
+        np.testing.assert_allclose(variances_matrix[row_index], exp_data[2], equal_nan=True)
+
+
+def test_build_calibrated_instrument():
+    """Test building instrument with composed rotations against shifting and rotating pixels step by step"""
+    setup = AnglerCameraDetectorGeometry(NUM_PIXEL_1D, NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D,
+                                         0.985, False)
+    calibration = AnglerCameraDetectorShift(0.001, -0.002, 0.003, 0.5, -0.3, 0.2)
+    instrument = ResidualStressInstrument(setup)
+    pixel_matrix = instrument.build_instrument(-80., 0.99, calibration)
+
+    # step by step: shift, rotate at origin, push to arm length and rotate to 2theta
+    exp_matrix = instrument._raw_pixel_matrix.copy()
+    exp_matrix[:, :, 0] += calibration.center_shift_x
+    exp_matrix[:, :, 1] += calibration.center_shift_y
+    calib_matrix = instrument.generate_rotation_matrix(*np.deg2rad([calibration.rotation_x, calibration.rotation_y,
+                                                                    calibration.rotation_z]))
+    exp_matrix = instrument._rotate_detector(exp_matrix, calib_matrix)
+    exp_matrix[:, :, 2] += 0.99 + calibration.center_shift_z
+    exp_matrix = instrument._rotate_detector(exp_matrix, instrument._cal_rotation_matrix_y(np.deg2rad(-80.)))
+
+    np.testing.assert_allclose(pixel_matrix, exp_matrix, rtol=1E-12, atol=1E-15)
+    exp_2theta = np.arccos(exp_matrix[:, :, 2] / np.sqrt(np.sum(exp_matrix**2, axis=2))) * 180. / np.pi
+    np.testing.assert_allclose(instrument.get_pixels_2theta(2), exp_2theta, rtol=1E-12)
+
+
+def test_rotate_built_instrument():
+    """Test rebuilding instrument at another 2theta from the calibrated pixels against building from scratch"""
+    setup = AnglerCameraDetectorGeometry(NUM_PIXEL_1D, NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D,
+                                         0.985, False)
+    calibration = AnglerCameraDetectorShift(0.001, -0.002, 0.003, 0.5, -0.3, 0.2)
+    instrument = ResidualStressInstrument(setup)
+    instrument.build_instrument(-80., None, calibration)
+    unrotated_matrix = instrument._unrotated_pixel_matrix.copy()
+
+    for two_theta in [-90., 0., 35.]:
+        instrument.build_instrument(two_theta, None, calibration)
+        # calibrated pixels are not recalculated
+        np.testing.assert_equal(instrument._unrotated_pixel_matrix, unrotated_matrix)
+
+        exp_instrument = ResidualStressInstrument(setup)
+        exp_instrument.build_instrument(two_theta, None, calibration)
+        np.testing.assert_allclose(instrument.get_pixel_matrix(), exp_instrument.get_pixel_matrix(), atol=1E-15)
+        np.testing.assert_allclose(instrument.get_pixels_2theta(1), exp_instrument.get_pixels_2theta(1),
+                                   rtol=1E-12)
+        np.testing.assert_allclose(instrument.get_eta_values(1), exp_instrument.get_eta_values(1), rtol=1E-12)
+
+    # changing calibration recalculates calibrated pixels
+    instrument.build_instrument(-80., None, None)
+    assert not np.allclose(instrument._unrotated_pixel_matrix, unrotated_matrix)
+
+
+def test_float32_geometry():
+    """Test single precision instrument geometry against double precision"""
+    setup = AnglerCameraDetectorGeometry(NUM_PIXEL_1D, NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D,
+                                         0.985, False)
+    calibration = AnglerCameraDetectorShift(0.001, -0.002, 0.003, 0.5, -0.3, 0.2)
+    engine = PyHB2BReduction(setup, use_float32=True)
+    engine.set_experimental_data(-80., None, np.random.poisson(3., NUM_PIXEL_1D**2))
+    engine.build_instrument(calibration)
+
+    assert engine.instrument.use_float32
+    assert engine.instrument.get_pixels_2theta(1).dtype == np.float32
+    assert engine.instrument.get_eta_values(1).dtype == np.float32
+    assert engine.generate_geometry_key(-80., None, calibration) != \
+        PyHB2BReduction(setup).generate_geometry_key(-80., None, calibration)
+
+    # self-check
+    deviation = engine.calculate_2theta_deviation()
+    assert 0. < deviation < 1.E-4
+
+    # reduce
+    bin_edges = np.linspace(75., 85., 101)
+    two_theta, intensity, variances = engine.reduce_to_2theta_histogram(bin_edges, None, True, None)
+    assert np.all(np.isfinite(intensity))
+
+
+def test_pixel_geometry_cache():
+    """Test the least-recently-used pixel geometry cache"""
+    setup = AnglerCameraDetectorGeometry(NUM_PIXEL_1D, NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D,
+                                         0.985, False)
+    matrix_size = NUM_PIXEL_1D**2 * 8
+
+    # cache for 2 instruments
+    cache = PixelGeometryCache(memory_budget=4 * matrix_size)
+    keys = [cache.generate_key(setup, two_theta, None, None, None) for two_theta in [80., 85., 90.]]
+    # quantized
+    assert cache.generate_key(setup, 80. + 1.E-9, 0.985, None, None) == keys[0]
+
+    for key in keys[:2]:
+        cache.add(key, np.zeros((NUM_PIXEL_1D, NUM_PIXEL_1D)), np.zeros((NUM_PIXEL_1D, NUM_PIXEL_1D)))
+    assert cache.get(keys[0]) is not None  # 80 degree is now the most recently used
+    cache.add(keys[2], np.zeros((NUM_PIXEL_1D, NUM_PIXEL_1D)), np.zeros((NUM_PIXEL_1D, NUM_PIXEL_1D)))
+    assert len(cache) == 2
+    assert keys[1] not in cache
+    assert cache.memory_used == 4 * matrix_size
+
+    cache.set_memory_budget(2 * matrix_size)
+    assert len(cache) == 1 and keys[2] in cache
+
+
+def test_build_instrument_from_cache():
+    """Test that a reduction engine takes pixels' 2theta from the cache"""
+    engine = _create_reduction_engine(two_theta=-77.)
+    assert engine.geometry_key in PIXEL_GEOMETRY_CACHE
+
+    cached_engine = _create_reduction_engine(two_theta=-77.)
+    assert cached_engine.geometry_key == engine.geometry_key
+    np.testing.assert_allclose(cached_engine.instrument.get_pixels_2theta(1), engine.instrument.get_pixels_2theta(1))
+    np.testing.assert_allclose(cached_engine.get_eta_value(), engine.get_eta_value())
+
+    # pixels' positions are built on request
+    np.testing.assert_allclose(cached_engine.get_pixel_positions(), engine.get_pixel_positions())
+    np.testing.assert_allclose(cached_engine.get_pixel_positions(is_matrix=True),
+                               engine.get_pixel_positions(is_matrix=True))
+    # angles are still the cached ones
+    cached_2theta = PIXEL_GEOMETRY_CACHE.get(engine.geometry_key)[0]
+    assert np.shares_memory(cached_engine.instrument.get_pixels_2theta(2), cached_2theta)
+
+    # without cache
+    engine.build_instrument(None, use_cache=False)
+    np.testing.assert_allclose(cached_engine.instrument.get_pixels_2theta(1), engine.instrument.get_pixels_2theta(1))
+
+
+def test_persistent_geometry_cache(tmpdir):
+    """Test persisting pixels' 2theta and eta to a cache directory and memory-mapping them in another cache"""
+    engine = _create_reduction_engine(two_theta=-64.)
+    geometry_key = engine.geometry_key
+    cache_dir = str(tmpdir.join('geometry'))
+
+    cache = PixelGeometryCache(cache_dir=cache_dir)
+    cache.add(geometry_key, engine.instrument.get_pixels_2theta(2), engine.instrument.get_eta_values(2))
+    assert len(tmpdir.join('geometry').listdir()) == 2
+
+    # a new cache, as in a new process, finds the instrument from the cache directory
+    new_cache = PixelGeometryCache(cache_dir=cache_dir)
+    assert geometry_key not in new_cache
+    two_theta_matrix, eta_matrix = new_cache.get(geometry_key)
+    assert isinstance(two_theta_matrix, np.memmap)
+    assert geometry_key in new_cache
+    np.testing.assert_allclose(two_theta_matrix, engine.instrument.get_pixels_2theta(2))
+    np.testing.assert_allclose(eta_matrix, engine.instrument.get_eta_values(2))
+
+    # not persisted instrument
+    assert new_cache.get(cache.generate_key(engine.instrument_setup, -65., None, None, None)) is None
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
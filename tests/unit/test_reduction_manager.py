@@ -0,0 +1,257 @@
+from __future__ import (absolute_import, division, print_function)  # python3 compatibility
+from pyrs.core.instrument_geometry import AnglerCameraDetectorGeometry
+from pyrs.core.powder_pattern import ReductionApp
+from pyrs.core.reduction_manager import HB2BReductionManager
+from pyrs.core.workspaces import HidraWorkspace
+from pyrs.dataobjects import HidraConstants
+from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode
+import numpy as np
+import pytest
+
+NUM_PIXEL_1D = 128
+NUM_BINS = 100
+
+
+def _create_workspace(seed=1):
+    """Create a workspace of a small detector with random counts in 4 sub runs at 3 detector positions"""
+    np.random.seed(seed)
+    workspace = HidraWorkspace('synthetic')
+    workspace.set_instrument_geometry(AnglerCameraDetectorGeometry(NUM_PIXEL_1D, NUM_PIXEL_1D,
+                                                                   0.3 / NUM_PIXEL_1D, 0.3 / NUM_PIXEL_1D,
+                                                                   0.985, False))
+    sub_runs = np.arange(1, 5)
+    workspace.set_sample_log(HidraConstants.TWO_THETA, sub_runs, np.array([85., 85., 80., 90.]))
+    workspace.set_sample_log(HidraConstants.SUB_RUN_DURATION, sub_runs, np.array([10., 20., 30., 40.]))
+    for sub_run in sub_runs:
+        workspace.set_raw_counts(sub_run, np.random.poisson(3., NUM_PIXEL_1D**2))
+
+    return workspace
+
+
+def _create_mask(masked_slice):
+    mask = np.ones(NUM_PIXEL_1D**2, dtype=int)
+    mask[masked_slice] = 0
+
+    return mask
+
+
+def _reduce(workspace=None, mask=None, **kwargs):
+    """Reduce all the sub runs of a (new) workspace with a new reduction manager"""
+    if workspace is None:
+        workspace = _create_workspace()
+    manager = HB2BReductionManager()
+    manager.init_session('synthetic', workspace)
+    manager.reduce_diffraction_data('synthetic', False, NUM_BINS, None, None if mask is None else mask.copy(),
+                                    None, **kwargs)
+
+    return workspace, manager
+
+
+def test_lazy_reduction_replaced():
+    """Verify that a pending lazy reduction does not overwrite the later reduction with the same mask ID"""
+    mask_a = _create_mask(slice(None, 4000))
+    mask_b = _create_mask(slice(-4000, None))
+    expected_data = _reduce(mask=mask_b)[0].get_reduced_diffraction_data_set()
+
+    workspace, manager = _reduce()
+    # lazy with mask A and then eager with mask B
+    manager.reduce_diffraction_data('synthetic', False, NUM_BINS, None, mask_a.copy(), None, lazy=True)
+    assert workspace.get_pending_sub_runs() == [1, 2, 3, 4]
+    manager.reduce_diffraction_data('synthetic', False, NUM_BINS, None, mask_b.copy(), None)
+    assert workspace.get_pending_sub_runs() == list()
+    workspace.get_reduced_diffraction_data(1)
+    for exp_array, array in zip(expected_data, workspace.get_reduced_diffraction_data_set()):
+        np.testing.assert_equal(array, exp_array)
+
+    # lazy with mask A on some sub runs and then again with mask B on the others
+    workspace, manager = _reduce()
+    manager.reduce_diffraction_data('synthetic', False, NUM_BINS, [1, 2], mask_a.copy(), None, lazy=True)
+    manager.reduce_diffraction_data('synthetic', False, NUM_BINS, [3, 4], mask_b.copy(), None, lazy=True)
+    # sub runs pending with mask A are reduced as they are not registered again
+    assert workspace.get_pending_sub_runs() == [3, 4]
+    expected_data = _reduce(mask=mask_a)[0].get_reduced_diffraction_data_set()
+    data_set = workspace.get_reduced_diffraction_data_set()
+    np.testing.assert_equal(data_set[1][:2], expected_data[1][:2])
+    np.testing.assert_equal(data_set[1][2:], _reduce(mask=mask_b)[0].get_reduced_diffraction_data_set()[1][2:])
+
+
+def test_reduce_workers():
+    """Verify reducing sub runs with a process pool against reducing serially"""
+    serial_data = _reduce()[0].get_reduced_diffraction_data_set()
+    pool_data = _reduce(workers=3)[0].get_reduced_diffraction_data_set()
+
+    for serial_array, pool_array in zip(serial_data, pool_data):
+        np.testing.assert_equal(pool_array, serial_array)
+
+    # no sub run to reduce
+    workspace, manager = _reduce()
+    manager.reduce_sub_runs_diffraction(workspace, [], False, (None, None), None, None, NUM_BINS, None, None,
+                                        workers=3)
+    for serial_array, array in zip(serial_data, workspace.get_reduced_diffraction_data_set()):
+        np.testing.assert_equal(array, serial_array)
+
+
+def test_reduce_lazy():
+    """Verify reducing sub runs on demand against reducing all of them in advance"""
+    expected_data = _reduce()[0].get_reduced_diffraction_data_set()
+
+    workspace = _reduce(lazy=True)[0]
+    assert workspace.get_pending_sub_runs() == [1, 2, 3, 4]
+    assert workspace.get_mask_ids() == [None]
+
+    # reduce the sub runs one by one
+    vec_2theta, vec_intensity = workspace.get_reduced_diffraction_data(3)
+    assert workspace.get_pending_sub_runs() == [1, 2, 4]
+    np.testing.assert_equal(vec_2theta, expected_data[0][2])
+    np.testing.assert_equal(vec_intensity, expected_data[1][2])
+    np.testing.assert_equal(workspace.get_reduced_diffraction_data_2theta(1), expected_data[0][0])
+    assert workspace.get_pending_sub_runs() == [2, 4]
+
+    # reduce the rest
+    for expected_array, array in zip(expected_data, workspace.get_reduced_diffraction_data_set()):
+        np.testing.assert_equal(array, expected_array)
+    assert workspace.get_pending_sub_runs() == list()
+
+
+def test_reduce_incremental():
+    """Verify that only the sub runs with changed reduction inputs are reduced again"""
+    workspace, manager = _reduce()
+    fingerprints = [workspace.get_reduction_fingerprint(sub_run) for sub_run in workspace.get_sub_runs()]
+    assert None not in fingerprints and len(set(fingerprints)) == 4
+    intensity_matrix = workspace.get_reduced_diffraction_data_set()[1].copy()
+
+    # change counts of the second sub run
+    workspace.set_raw_counts(2, workspace.get_detector_counts(2) * 2)
+    manager.reduce_diffraction_data('synthetic', False, NUM_BINS, None, None, None)
+    new_fingerprints = [workspace.get_reduction_fingerprint(sub_run) for sub_run in workspace.get_sub_runs()]
+    assert [new != old for new, old in zip(new_fingerprints, fingerprints)] == [False, True, False, False]
+    new_intensity_matrix = workspace.get_reduced_diffraction_data_set()[1]
+    np.testing.assert_allclose(new_intensity_matrix[1], intensity_matrix[1] * 2)
+    np.testing.assert_equal(new_intensity_matrix[[0, 2, 3]], intensity_matrix[[0, 2, 3]])
+
+    # a different mask changes all the fingerprints
+    manager.reduce_diffraction_data('synthetic', False, NUM_BINS, None, _create_mask(slice(None, 4000)), None)
+    assert all(workspace.get_reduction_fingerprint(sub_run) not in new_fingerprints
+               for sub_run in workspace.get_sub_runs())
+
+    # a different number of bins resets the reduced data
+    manager.reduce_diffraction_data('synthetic', False, NUM_BINS // 2, [1, 2], None, None)
+    assert workspace.get_num_2theta_bins() == NUM_BINS // 2
+    assert workspace.get_reduction_fingerprint(3) is None
+
+
+def test_reduce_streaming(tmpdir):
+    """Verify reducing sub runs streamed one at a time against reducing the workspace with all the counts"""
+    expected_data = _reduce()[0].get_reduced_diffraction_data_set()
+
+    stream_ws = _create_workspace()
+    sub_run_counts = [(sub_run, stream_ws.get_detector_counts(sub_run)) for sub_run in stream_ws.get_sub_runs()]
+    for sub_run, _ in sub_run_counts:
+        stream_ws.remove_raw_counts(sub_run)
+
+    # each sub run's powder pattern is written to project file as it is yielded
+    project_name = str(tmpdir.join('streamed.h5'))
+    project = HidraProjectFile(project_name, HidraProjectFileMode.OVERWRITE)
+    stream_ws.save_experimental_data(project, sub_runs=[1, 2, 3, 4], ignore_raw_counts=True)
+
+    reducer = ReductionApp()
+    reducer.load_hidra_workspace(stream_ws)
+    streamed_sub_runs = list()
+    for (sub_run, counts), (exp_sub_run, exp_counts) in zip(
+            reducer.reduce_data_streaming(iter(sub_run_counts), instrument_file=None, calibration_file=None,
+                                          mask=None, num_bins=NUM_BINS), sub_run_counts):
+        assert sub_run == exp_sub_run and counts is exp_counts
+        # counts are released after reduction
+        assert not stream_ws.has_raw_data(sub_run)
+        stream_ws.save_reduced_diffraction_data(project, sub_runs=[sub_run])
+        np.testing.assert_equal(project.read_diffraction_intensity_vector(None, sub_run),
+                                expected_data[1][sub_run - 1])
+        if sub_run < 4:
+            assert np.isnan(project.read_diffraction_intensity_vector(None, sub_run + 1)).all()
+        streamed_sub_runs.append(sub_run)
+    assert streamed_sub_runs == [1, 2, 3, 4]
+    project.save()
+
+    for expected_array, array in zip(expected_data, stream_ws.get_reduced_diffraction_data_set()):
+        np.testing.assert_equal(array, expected_array)
+
+    project = HidraProjectFile(project_name)
+    np.testing.assert_equal(project.read_diffraction_2theta_array(), expected_data[0])
+    np.testing.assert_equal(project.read_diffraction_intensity_vector(None, None), expected_data[1])
+    np.testing.assert_equal(project.read_diffraction_variance_vector(None, None), expected_data[2])
+    project.close()
+
+
+def test_reduce_merged_sub_runs():
+    """Verify that merging sub runs before reduction is the duration weighted sum of their patterns"""
+    workspace = _create_workspace()
+    mask = _create_mask(slice(None, 4000))
+    manager = HB2BReductionManager()
+    manager.init_session('synthetic', workspace)
+    # sub runs 1 and 2 are at the same detector position
+    bin_centers, intensity, variances = manager.reduce_merged_sub_runs(workspace, [1, 2], None, mask,
+                                                                       num_bins=NUM_BINS)
+    assert bin_centers.shape == intensity.shape == variances.shape == (NUM_BINS,)
+
+    # reduce sub runs individually to the same bins
+    bin_edges = np.concatenate([[1.5 * bin_centers[0] - 0.5 * bin_centers[1]],
+                                0.5 * (bin_centers[1:] + bin_centers[:-1]),
+                                [1.5 * bin_centers[-1] - 0.5 * bin_centers[-2]]])
+    intensity_matrix = manager.reduce_sub_runs_to_common_bins(workspace, [1, 2], None, mask, bin_edges,
+                                                              unit='2theta')[1]
+    np.testing.assert_allclose(intensity, np.sum(intensity_matrix, axis=0) / 30., equal_nan=True)
+
+    # sub runs at different detector positions
+    with pytest.raises(RuntimeError):
+        manager.reduce_merged_sub_runs(workspace, [1, 3], None, mask)
+
+
+def test_reduce_shared_bins(tmpdir):
+    """Verify that sub runs at all detector positions are reduced to the same 2theta bins
+    and the shared 2theta is written as a single vector"""
+    workspace, manager = _reduce(shared_bins=True)
+    two_theta_matrix = workspace.get_reduced_diffraction_data_set()[0]
+    np.testing.assert_equal(two_theta_matrix, np.repeat(two_theta_matrix[:1], 4, axis=0))
+
+    # bins cover the lowest (sub run 3) and the highest (sub run 4) detector positions
+    min_2theta, max_2theta = manager.get_shared_2theta_range(workspace, [1, 2, 3, 4], None, None)
+    assert min_2theta == manager.get_shared_2theta_range(workspace, [3], None, None)[0]
+    assert max_2theta == manager.get_shared_2theta_range(workspace, [4], None, None)[1]
+    bin_edges = manager.generate_2theta_histogram_vector(min_2theta, NUM_BINS, max_2theta, None, None)
+    np.testing.assert_allclose(two_theta_matrix[0], 0.5 * (bin_edges[1:] + bin_edges[:-1]))
+
+    project_name = str(tmpdir.join('shared_bins.h5'))
+    project = HidraProjectFile(project_name, HidraProjectFileMode.OVERWRITE)
+    workspace.save_experimental_data(project, ignore_raw_counts=True)
+    workspace.save_reduced_diffraction_data(project)
+    project.save()
+
+    project = HidraProjectFile(project_name)
+    assert project.read_diffraction_2theta_array().shape == (NUM_BINS,)
+    loaded_workspace = HidraWorkspace('loaded')
+    loaded_workspace.load_hidra_project(project, load_raw_counts=False, load_reduced_diffraction=True)
+    project.close()
+    # 2theta vector is broadcast to all the sub runs
+    np.testing.assert_equal(loaded_workspace.get_reduced_diffraction_data_set()[0], two_theta_matrix)
+
+
+def test_save_2theta_partially_reduced(tmpdir):
+    """Verify that 2theta is written as a matrix if any sub run is not reduced"""
+    workspace, manager = _create_workspace(), HB2BReductionManager()
+    manager.init_session('synthetic', workspace)
+    manager.reduce_diffraction_data('synthetic', False, NUM_BINS, [1, 2], None, None)
+    assert np.isnan(workspace.get_reduced_diffraction_data_set()[0][2:]).all()
+
+    project_name = str(tmpdir.join('partial.h5'))
+    project = HidraProjectFile(project_name, HidraProjectFileMode.OVERWRITE)
+    workspace.save_experimental_data(project, ignore_raw_counts=True)
+    workspace.save_reduced_diffraction_data(project)
+    project.save()
+
+    project = HidraProjectFile(project_name)
+    assert project.read_diffraction_2theta_array().shape == (4, NUM_BINS)
+    project.close()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])